@@ -0,0 +1,80 @@
+"""Per-process admission control for /api/ws and the readiness signal behind /api/health."""
+import asyncio
+import random
+from typing import Any, Dict, Tuple
+
+
+class Admission:
+    """Per-process capacity limits and the readiness signal derived from them."""
+
+    def __init__(self, max_connections: int, max_rooms: int, max_room_size: int, retry_ms: int,
+                 ready_load: float, max_lag_ms: int, registry, scheduler):
+        self.max_connections = max_connections
+        self.max_rooms = max_rooms
+        self.max_room_size = max_room_size
+        self.retry = retry_ms
+        self.ready_load = ready_load
+        self.max_lag = max_lag_ms / 1000
+        # RoomRegistry and JoinScheduler, for room sizes and queued joiners
+        self.registry = registry
+        self.scheduler = scheduler
+        self.connections = 0
+        # Set by Drain: not ready, no new sockets or joins
+        self.draining = False
+        # Smoothed event loop lag in seconds, sampled by _monitor
+        self.lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _monitor(self, interval: float = 0.5):
+        # A sleep that wakes up late means callbacks are queueing; latency degrades before CPU shows it
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            late = max(0.0, loop.time() - started - interval)
+            self.lag = self.lag * 0.7 + late * 0.3
+
+    def retry_ms(self) -> int:
+        # Jittered so rejected clients do not come back in lockstep
+        return int(self.retry * random.uniform(0.5, 1.5))
+
+    def admit_connection(self) -> bool:
+        if self.draining:
+            return False
+        return not self.max_connections or self.connections < self.max_connections
+
+    def check_join(self, room: str) -> Tuple[str, str] | None:
+        # None when `room` may be joined, else (error code, message)
+        size = len(self.registry.members(room))
+        if self.max_room_size and size + self.scheduler.waiting(room) >= self.max_room_size:
+            return "room-full", f"room is full ({self.max_room_size} peers)"
+        if self.max_rooms and not size and self.registry.room_count() >= self.max_rooms:
+            return "server-busy", "no capacity for new rooms"
+        return None
+
+    def load(self) -> float:
+        usage = [0.0]
+        if self.max_connections:
+            usage.append(self.connections / self.max_connections)
+        if self.max_rooms:
+            usage.append(self.registry.room_count() / self.max_rooms)
+        return max(usage)
+
+    def status(self) -> Dict[str, Any]:
+        load = self.load()
+        return {
+            "ready": not self.draining and load < self.ready_load and self.lag < self.max_lag,
+            "draining": self.draining,
+            "load": round(load, 3),
+            "connections": self.connections,
+            "rooms": self.registry.room_count(),
+            "loopLagMs": round(self.lag * 1000, 1),
+        }
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the backend.
+
+Each run is a fresh interpreter, so nothing is shared between samples:
+  import  time to `import server` plus its startup hooks, measured inside
+          the child, and the child's wall-clock time from spawn to exit
+  serve   time from spawning run.py until /api/health first answers 200
+By default the children get no MONGO_URL (a signaling-only process; a
+backend/.env that sets one still applies); use --mongo-url to include
+whatever the database path costs at startup.
+
+Examples:
+  python backend/bench_startup.py
+  python backend/bench_startup.py --runs 10 --mode import --json startup.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND = Path(__file__).parent
+
+# Runs in the child: import the app, run startup and shutdown hooks, report timings
+IMPORT_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+async def hooks():
+    await server.app.router.startup()
+    ready = time.perf_counter()
+    await server.app.router.shutdown()
+    return ready
+ready = asyncio.run(hooks())
+print(json.dumps({"import_s": imported - started, "startup_s": ready - imported,
+                  "mongo_connected": server.mongo.connected}))
+"""
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    ms = sorted(v * 1000 for v in values)
+    if not ms:
+        return {"count": 0, "p50_ms": None, "max_ms": None}
+    return {"count": len(ms), "p50_ms": round(ms[len(ms) // 2], 1), "max_ms": round(ms[-1], 1)}
+
+
+def child_env(args) -> Dict[str, str]:
+    env = {k: v for k, v in os.environ.items() if k != "MONGO_URL"}
+    if args.mongo_url:
+        env["MONGO_URL"] = args.mongo_url
+    return env
+
+
+def run_import(args) -> Dict[str, Any]:
+    imports, startups, walls = [], [], []
+    connected = False
+    for _ in range(args.runs):
+        spawned = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND, env=child_env(args),
+                             capture_output=True, text=True, timeout=120)
+        walls.append(time.perf_counter() - spawned)
+        if out.returncode != 0:
+            raise RuntimeError(f"import probe failed:\n{out.stderr}")
+        sample = json.loads(out.stdout.strip().splitlines()[-1])
+        imports.append(sample["import_s"])
+        startups.append(sample["startup_s"])
+        connected = connected or sample["mongo_connected"]
+    return {"import": summarize(imports), "startup_hooks": summarize(startups), "process": summarize(walls),
+            "mongo_connected": connected}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_serve(args) -> Dict[str, Any]:
+    readies = []
+    for _ in range(args.runs):
+        port = free_port()
+        spawned = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, str(BACKEND / "run.py"), "--host", "127.0.0.1", "--port", str(port),
+                                 "--log-level", "warning"], cwd=BACKEND, env=child_env(args),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"server exited with {proc.returncode}")
+                if time.perf_counter() - spawned > args.timeout:
+                    raise RuntimeError(f"server not ready within {args.timeout}s")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as resp:
+                        if resp.status == 200:
+                            break
+                except (urllib.error.URLError, ConnectionError, OSError):
+                    pass
+                time.sleep(0.01)
+            readies.append(time.perf_counter() - spawned)
+        finally:
+            proc.terminate()
+            proc.wait(10)
+    return {"ready": summarize(readies)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark backend startup time")
+    parser.add_argument("--mode", choices=("import", "serve", "both"), default="both")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-url", help="give the children a MONGO_URL (default: none, signaling-only)")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for /api/health")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if args.runs < 1:
+        parser.error("--runs must be positive")
+
+    sys.path.insert(0, str(BACKEND))
+    from run import runtime_profile
+    result: Dict[str, Any] = {"config": {"runs": args.runs, "mongo_url": bool(args.mongo_url), **runtime_profile()}}
+    if args.mode in ("import", "both"):
+        result["import"] = run_import(args)
+    if args.mode in ("serve", "both"):
+        result["serve"] = run_serve(args)
+
+    if args.json == "-":
+        print(json.dumps(result, indent=2))
+        return 0
+    cfg = result["config"]
+    print(f"=== startup ({cfg['runs']} runs, loop={cfg['loop']} http={cfg['http']}, "
+          f"MONGO_URL {'set' if cfg['mongo_url'] else 'unset'}) ===")
+    if "import" in result:
+        r = result["import"]
+        for name in ("import", "startup_hooks", "process"):
+            print(f"{name + ':':<15} p50={r[name]['p50_ms']}ms max={r[name]['max_ms']}ms")
+        print(f"{'mongo client:':<15} {'created' if r['mongo_connected'] else 'not created'}")
+    if "serve" in result:
+        r = result["serve"]["ready"]
+        print(f"{'spawn->ready:':<15} p50={r['p50_ms']}ms max={r['max_ms']}ms")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+Load generator and benchmark for the /api/ws signaling server.
+
+By default the FastAPI app runs in-process: clients talk to it over an ASGI
+transport (no sockets) and MongoDB is replaced by an in-memory store, so no
+MONGO_URL or running server is needed. With --url the same workload is driven
+against a live server through the `websockets` package.
+
+The workload: --clients peers spread over --rooms rooms join at --join-rate,
+then for --duration seconds each peer sends chat messages (--chat-rate/s) and
+ICE candidates to random room mates (--ice-rate/s). Reported:
+  - join latency (join -> joined) and fan-out latency (send -> each delivery), p50/p99
+  - frames sent/received per second
+  - memory per connection
+Use --json to write the results for regression tracking.
+
+Examples:
+  python backend/bench_ws.py --clients 2000 --rooms 200 --duration 20
+  python backend/bench_ws.py --clients 200 --rooms 10 --chat-rate 2 --json bench.json
+  python backend/bench_ws.py --url ws://localhost:8001/api/ws --clients 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+# The in-memory store below stands in for MongoDB; the URL is never dialled
+os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+# Measure fan-out, not the inbound limiter; set these explicitly to benchmark with limits on
+os.environ.setdefault("WS_RATE_LIMITS", "")
+os.environ.setdefault("WS_ROOM_RATE_LIMITS", "")
+
+from codec import decode_message, encode_json  # noqa: E402
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# ----------------------------
+# In-memory stand-in for the Motor database
+# ----------------------------
+def _match(doc: Dict[str, Any], flt: Dict[str, Any]) -> bool:
+    for key, cond in flt.items():
+        if key == "$or":
+            if not any(_match(doc, sub) for sub in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(_match(doc, sub) for sub in cond):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(cond, dict) and any(k.startswith("$") for k in cond):
+            for op, arg in cond.items():
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+                if op == "$lte" and not (value is not None and value <= arg):
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op == "$gte" and not (value is not None and value >= arg):
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[Dict[str, Any]], projection: Optional[Dict[str, Any]]):
+        self._docs = docs
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: int = 1):
+        keys = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        for key, d in reversed(keys):
+            self._docs.sort(key=lambda doc: (doc.get(key) is None, doc.get(key)), reverse=d < 0)
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def skip(self, n: int):
+        self._skip = n
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def _project(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        doc = dict(doc)
+        if not self._projection:
+            return doc
+        include = {k for k, v in self._projection.items() if v and k != "_id"}
+        if include:
+            keep = include | ({"_id"} if self._projection.get("_id", 1) else set())
+            return {k: v for k, v in doc.items() if k in keep}
+        return {k: v for k, v in doc.items() if self._projection.get(k, 1)}
+
+    def _window(self) -> List[Dict[str, Any]]:
+        docs = self._docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [self._project(d) for d in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        docs = self._window()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        self._iter = iter(self._window())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self):
+        self.docs: List[Dict[str, Any]] = []
+
+    async def insert_one(self, doc: Dict[str, Any]):
+        self.docs.append(dict(doc))
+
+    async def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True):
+        self.docs.extend(dict(d) for d in docs)
+
+    async def create_index(self, keys, **kwargs):
+        return "memory"
+
+    async def count_documents(self, flt: Dict[str, Any]) -> int:
+        return sum(1 for d in self.docs if _match(d, flt))
+
+    def find(self, flt: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> MemoryCursor:
+        return MemoryCursor([d for d in self.docs if _match(d, flt or {})], projection)
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self._collections.setdefault(name, MemoryCollection())
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+# ----------------------------
+# Transports
+# ----------------------------
+class AsgiWebSocket:
+    """WebSocket client speaking ASGI directly to the in-process app."""
+
+    _ports = iter(range(10000, 10**9))
+
+    def __init__(self, app, path: str, subprotocols: List[str]):
+        self._app = app
+        self._inbound: asyncio.Queue = asyncio.Queue()
+        self._outbound: asyncio.Queue = asyncio.Queue()
+        path, _, query = path.partition("?")
+        self._scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+            "headers": [(b"host", b"bench")], "client": ("127.0.0.1", next(self._ports)),
+            "server": ("bench", 80), "subprotocols": subprotocols,
+        }
+        self._task: Optional[asyncio.Task] = None
+        self.subprotocol: Optional[str] = None
+
+    async def connect(self):
+        self._task = asyncio.create_task(self._app(self._scope, self._inbound.get, self._push))
+        self._inbound.put_nowait({"type": "websocket.connect"})
+        message = await self._outbound.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"rejected: {message}")
+        self.subprotocol = message.get("subprotocol")
+
+    async def _push(self, message):
+        self._outbound.put_nowait(message)
+
+    async def send(self, data):
+        key = "bytes" if isinstance(data, (bytes, bytearray)) else "text"
+        self._inbound.put_nowait({"type": "websocket.receive", key: data})
+
+    async def recv(self):
+        message = await self._outbound.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError("closed by server")
+        return message.get("text") if message.get("text") is not None else message.get("bytes")
+
+    async def close(self):
+        self._inbound.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, 5)
+            except (asyncio.TimeoutError, Exception):
+                pass
+
+
+class NetWebSocket:
+    """WebSocket client over the network (requires the `websockets` package)."""
+
+    def __init__(self, url: str, subprotocols: List[str]):
+        self._url = url
+        self._subprotocols = subprotocols
+        self._ws = None
+        self.subprotocol: Optional[str] = None
+
+    async def connect(self):
+        import websockets
+        self._ws = await websockets.connect(self._url, subprotocols=self._subprotocols or None, max_size=None)
+        self.subprotocol = self._ws.subprotocol
+
+    async def send(self, data):
+        await self._ws.send(data)
+
+    async def recv(self):
+        return await self._ws.recv()
+
+    async def close(self):
+        await self._ws.close()
+
+
+def decode_frame(raw, binary: bool) -> Dict[str, Any]:
+    # Server frame as received: JSON text, MessagePack, or either deflated behind a 0x00 byte
+    if isinstance(raw, str):
+        return decode_message(raw, None)
+    if raw[:1] == b"\x00":
+        inflated = zlib.decompress(raw[1:], -15)
+        return decode_message(None, inflated) if binary else decode_message(inflated.decode(), None)
+    return decode_message(None, raw)
+
+
+# ----------------------------
+# Workload
+# ----------------------------
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    ms = [v * 1000 for v in values]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 0.50), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 3) if ms else None,
+        "max_ms": round(max(ms), 3) if ms else None,
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.join_latency: List[float] = []
+        self.fanout_latency: List[float] = []
+        self.signal_latency: List[float] = []
+        self.types: Dict[str, int] = {}
+
+
+_BENCH_TS = re.compile(r"^bench:(\d+\.\d+)$")
+
+
+class BenchClient:
+    def __init__(self, idx: int, room: str, ws, stats: Stats, binary: bool):
+        self.idx = idx
+        self.room = room
+        self.ws = ws
+        self.stats = stats
+        self.binary = binary
+        self.self_id: Optional[str] = None
+        self.peers: set = set()
+        self.joined = asyncio.Event()
+        self._join_sent = 0.0
+        self._reader: Optional[asyncio.Task] = None
+
+    async def send(self, msg: Dict[str, Any]):
+        data = msgpack.packb(msg, use_bin_type=True) if self.binary else encode_json(msg)
+        self.stats.sent += 1
+        await self.ws.send(data)
+
+    async def join(self):
+        self._reader = asyncio.create_task(self._read())
+        self._join_sent = time.perf_counter()
+        await self.send({"type": "join", "room": self.room, "name": f"bench-{self.idx}", "features": ["ice-batch"]})
+
+    async def _read(self):
+        try:
+            while True:
+                raw = await self.ws.recv()
+                now = time.perf_counter()
+                self.stats.received += 1
+                self.stats.bytes_received += len(raw)
+                msg = decode_frame(raw, self.binary)
+                self._handle(msg, now)
+                if msg.get("type") == "ping":
+                    await self.send({"type": "pong"})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            self.stats.errors += 1
+
+    def _handle(self, msg: Dict[str, Any], now: float):
+        mtype = msg.get("type")
+        self.stats.types[mtype] = self.stats.types.get(mtype, 0) + 1
+        if mtype == "joined":
+            self.self_id = msg.get("selfId")
+            self.peers.update(p["id"] for p in msg.get("peers") or [])
+            self.stats.join_latency.append(now - self._join_sent)
+            self.joined.set()
+        elif mtype == "new-peer":
+            self.peers.add(msg.get("id"))
+        elif mtype == "leave":
+            self.peers.discard(msg.get("id"))
+        elif mtype == "text":
+            m = _BENCH_TS.match(str(msg.get("message", "")))
+            if m:
+                self.stats.fanout_latency.append(now - float(m.group(1)))
+        elif mtype == "ice-candidate":
+            self._candidate_latency(msg.get("candidate"), now)
+        elif mtype == "ice-candidates":
+            for c in msg.get("candidates") or []:
+                self._candidate_latency(c, now)
+        elif mtype == "error":
+            self.stats.errors += 1
+
+    def _candidate_latency(self, candidate, now: float):
+        if isinstance(candidate, dict) and "t" in candidate:
+            self.stats.signal_latency.append(now - candidate["t"])
+
+    async def chat(self):
+        await self.send({"type": "text", "message": f"bench:{time.perf_counter():.9f}"})
+
+    async def ice(self):
+        if not self.peers:
+            return
+        to = random.choice(tuple(self.peers))
+        await self.send({"type": "ice-candidate", "to": to, "candidate": {
+            "candidate": f"candidate:1 1 UDP 2130706431 10.0.{self.idx % 250}.1 {50000 + self.idx % 10000} typ host",
+            "sdpMid": "0", "sdpMLineIndex": 0, "t": time.perf_counter()}})
+
+    async def close(self):
+        await self.ws.close()
+        if self._reader:
+            self._reader.cancel()
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+async def paced(rate: float, duration: float, action, clients: List[BenchClient]):
+    # Issue `rate` actions per second per client, spread evenly across clients
+    total_rate = rate * len(clients)
+    if total_rate <= 0:
+        await asyncio.sleep(duration)
+        return
+    interval = 1.0 / total_rate
+    deadline = time.perf_counter() + duration
+    next_at = time.perf_counter()
+    i = 0
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            return
+        if now < next_at:
+            await asyncio.sleep(min(next_at - now, deadline - now))
+            continue
+        # Catch up in bursts when the loop falls behind rather than drifting
+        while next_at <= now:
+            await action(clients[i % len(clients)])
+            i += 1
+            next_at += interval
+
+
+async def run(args) -> Dict[str, Any]:
+    random.seed(args.seed)
+    server = None
+    if not args.url:
+        import server as server_module
+        server = server_module
+        server.db = MemoryDatabase()
+        await server.app.router.startup()
+
+    subprotocols = ["soundcore.msgpack"] if args.protocol == "msgpack" else []
+    binary = args.protocol == "msgpack"
+    path = "/api/ws" + ("?compress=deflate" if args.compress else "")
+
+    def make_ws():
+        if args.url:
+            return NetWebSocket(args.url + ("?compress=deflate" if args.compress else ""), subprotocols)
+        return AsgiWebSocket(server.app, path, subprotocols)
+
+    stats = Stats()
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+    traced_before = tracemalloc.get_traced_memory()[0] if args.trace_memory else None
+
+    # Join phase
+    clients: List[BenchClient] = []
+    join_started = time.perf_counter()
+    join_interval = 1.0 / args.join_rate if args.join_rate > 0 else 0
+    for i in range(args.clients):
+        ws = make_ws()
+        await ws.connect()
+        client = BenchClient(i, f"bench-room-{i % args.rooms}", ws, stats, binary and ws.subprotocol == "soundcore.msgpack")
+        clients.append(client)
+        await client.join()
+        if join_interval:
+            await asyncio.sleep(join_interval)
+    try:
+        await asyncio.wait_for(asyncio.gather(*(c.joined.wait() for c in clients)), args.join_timeout)
+    except asyncio.TimeoutError:
+        pass
+    join_elapsed = time.perf_counter() - join_started
+    joined = sum(1 for c in clients if c.joined.is_set())
+    # Let new-peer notifications settle before measuring memory
+    await asyncio.sleep(0.2)
+    rss_after = rss_bytes()
+    traced_after = tracemalloc.get_traced_memory()[0] if args.trace_memory else None
+
+    # Steady-state phase
+    sent_before, received_before = stats.sent, stats.received
+    steady_started = time.perf_counter()
+    await asyncio.gather(
+        paced(args.chat_rate, args.duration, BenchClient.chat, clients),
+        paced(args.ice_rate, args.duration, BenchClient.ice, clients),
+    )
+    # Drain in-flight frames
+    await asyncio.sleep(args.drain)
+    steady_elapsed = time.perf_counter() - steady_started
+
+    for c in clients:
+        await c.close()
+    if server is not None:
+        await server.app.router.shutdown()
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    per_conn_rss = (rss_after - rss_before) / max(1, joined) if rss_before and rss_after else None
+    per_conn_traced = (traced_after - traced_before) / max(1, joined) if traced_before is not None else None
+    return {
+        "config": {
+            "mode": "url" if args.url else "in-process",
+            "clients": args.clients, "rooms": args.rooms, "join_rate": args.join_rate,
+            "chat_rate": args.chat_rate, "ice_rate": args.ice_rate, "duration": args.duration,
+            "protocol": args.protocol, "compress": args.compress, "seed": args.seed,
+        },
+        "join": {"joined": joined, "elapsed_s": round(join_elapsed, 3), **summarize(stats.join_latency)},
+        "fanout": summarize(stats.fanout_latency),
+        "signaling": summarize(stats.signal_latency),
+        "throughput": {
+            "sent_per_s": round((stats.sent - sent_before) / steady_elapsed, 1),
+            "received_per_s": round((stats.received - received_before) / steady_elapsed, 1),
+            "received_bytes": stats.bytes_received,
+        },
+        "memory": {
+            "rss_per_connection_bytes": round(per_conn_rss) if per_conn_rss is not None else None,
+            "traced_per_connection_bytes": round(per_conn_traced) if per_conn_traced is not None else None,
+        },
+        "errors": stats.errors,
+        "frame_types": stats.types,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    cfg = result["config"]
+    print(f"=== /api/ws benchmark ({cfg['mode']}, {cfg['clients']} clients / {cfg['rooms']} rooms, {cfg['protocol']}) ===")
+    j = result["join"]
+    print(f"join:      {j['joined']}/{cfg['clients']} in {j['elapsed_s']}s  p50={j['p50_ms']}ms p99={j['p99_ms']}ms")
+    for name in ("fanout", "signaling"):
+        s = result[name]
+        print(f"{name + ':':<10} n={s['count']}  p50={s['p50_ms']}ms p99={s['p99_ms']}ms max={s['max_ms']}ms")
+    t = result["throughput"]
+    print(f"throughput: sent {t['sent_per_s']}/s  received {t['received_per_s']}/s")
+    m = result["memory"]
+    print(f"memory:    rss/conn={m['rss_per_connection_bytes']}B  traced/conn={m['traced_per_connection_bytes']}B")
+    print(f"errors:    {result['errors']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the /api/ws signaling server")
+    parser.add_argument("--url", help="ws:// URL of a live server (default: in-process app)")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--join-rate", type=float, default=0, help="joins per second (0 = as fast as possible)")
+    parser.add_argument("--join-timeout", type=float, default=30)
+    parser.add_argument("--chat-rate", type=float, default=0.2, help="chat messages per client per second")
+    parser.add_argument("--ice-rate", type=float, default=1.0, help="ICE candidates per client per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--drain", type=float, default=0.5, help="seconds to wait for in-flight frames")
+    parser.add_argument("--protocol", choices=("json", "msgpack"), default="json")
+    parser.add_argument("--compress", action="store_true", help="request deflated large frames")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc per-connection memory (slow)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if args.rooms < 1 or args.clients < 1:
+        parser.error("--clients and --rooms must be positive")
+
+    import logging
+    logging.getLogger("server").setLevel(logging.WARNING)
+    result = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+        if args.json:
+            Path(args.json).write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Persistent room chat for the signaling server.
+
+Messages are appended to an in-memory buffer and written to Mongo in batches
+by a background task, so the broadcast path never waits on the database.
+History is read newest-first through the (room, timestamp, id) index with
+keyset pagination: a page is one indexed range scan however large the
+collection gets. Messages still waiting to be written are merged into reads.
+"""
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import Counter, Histogram, SIZE_BUCKETS
+from pagination import as_utc, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+chat_persisted = Counter("signaling_chat_messages_persisted_total", "Chat messages written to the database")
+chat_dropped = Counter("signaling_chat_messages_dropped_total", "Chat messages lost to a full buffer or failed write")
+chat_write_seconds = Histogram("signaling_chat_write_seconds", "Time of one batched chat insert")
+chat_batch_size = Histogram("signaling_chat_write_batch_size", "Messages per batched chat insert", SIZE_BUCKETS)
+
+# Index backing every history read: equality on room, then newest first
+HISTORY_INDEX = [("room", 1), ("timestamp", -1), ("id", -1)]
+
+
+def utc_now() -> datetime:
+    # Mongo stores milliseconds; truncate up front so cursors match what reads return
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+# Message ids sort in send order within a process, breaking timestamp ties (ms resolution)
+_sequence = itertools.count()
+_process = uuid.uuid4().hex[:8]
+
+
+def new_message_id() -> str:
+    return f"{next(_sequence):012x}-{_process}"
+
+
+def public(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # Same shape as the live 'text' frame
+    return {
+        "id": doc["id"],
+        "from": doc["from"],
+        "message": doc["message"],
+        "timestamp": as_utc(doc["timestamp"]).isoformat(),
+    }
+
+
+class ChatLog:
+    def __init__(self, flush_ms: int = 200, batch_max: int = 100, buffer_max: int = 10000, read_timeout_ms: int = 2000):
+        self.flush_interval = flush_ms / 1000
+        self.batch_max = max(1, batch_max)
+        self.buffer_max = max(self.batch_max, buffer_max)
+        self.read_timeout = read_timeout_ms / 1000
+        self._get_collection: Optional[Callable[[], Any]] = None
+        self._collection = None
+        self._buffer: List[Dict[str, Any]] = []
+        # Batch being inserted; still served to readers until the insert returns
+        self._inflight: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._get_collection is not None
+
+    async def start(self, collection: Callable[[], Any]):
+        # Resolved on the first write or read, so a process nobody chats on never connects
+        self._get_collection = collection
+        self._task = asyncio.create_task(self._writer())
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._collection = self._get_collection()
+            # Index creation must not hold up the first write when the database is slow or down
+            asyncio.create_task(self._ensure_index())
+        return self._collection
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._get_collection is not None and self._buffer:
+            batch, self._buffer = self._buffer, []
+            try:
+                await asyncio.wait_for(self._write(batch), self.read_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Chat history flush on shutdown timed out ({len(batch)} messages dropped)")
+
+    async def _ensure_index(self):
+        try:
+            await self._collection.create_index(HISTORY_INDEX, name="room_timestamp")
+        except Exception as e:
+            logger.warning(f"Chat history index creation failed: {e}")
+
+    def add(self, doc: Dict[str, Any]):
+        # Never blocks: the writer task picks the message up on its next flush
+        if self._get_collection is None:
+            return
+        if len(self._buffer) >= self.buffer_max:
+            # Database is not keeping up; keep the newest messages
+            del self._buffer[0]
+            chat_dropped.inc()
+        self._buffer.append(doc)
+        if len(self._buffer) >= self.batch_max:
+            self._wakeup.set()
+
+    async def _writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer:
+                batch = self._buffer[:self.batch_max]
+                del self._buffer[:self.batch_max]
+                await self._write(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        self._inflight = batch
+        started = time.perf_counter()
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            chat_persisted.inc(len(batch))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            chat_dropped.inc(len(batch))
+            logger.warning(f"Chat history write failed ({len(batch)} messages dropped): {e}")
+        finally:
+            self._inflight = []
+            chat_write_seconds.observe(time.perf_counter() - started)
+            chat_batch_size.observe(len(batch))
+
+    def _pending(self, room: str, before: Optional[Tuple[datetime, str]]) -> List[Dict[str, Any]]:
+        docs = [d for d in self._inflight + self._buffer if d["room"] == room]
+        if before is not None:
+            docs = [d for d in docs if (d["timestamp"], d["id"]) < before]
+        return docs
+
+    async def history(self, room: str, limit: int, before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Up to `limit` messages older than `before`, oldest first, plus the cursor for the next page.
+
+        Raises ValueError for a malformed cursor.
+        """
+        if self._get_collection is None or limit <= 0:
+            return [], None
+        key = decode_cursor(before) if before else None
+        flt: Dict[str, Any] = {"room": room}
+        if key is not None:
+            ts, msg_id = key
+            flt["$or"] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "id": {"$lt": msg_id}}]
+        pending = self._pending(room, key)
+        cursor = self.collection.find(flt, {"_id": 0}).sort([("timestamp", -1), ("id", -1)]).limit(limit + 1)
+        try:
+            stored = await asyncio.wait_for(cursor.to_list(limit + 1), self.read_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Chat history read for room '{room}' timed out")
+            stored = []
+        # Writes may land between the buffer snapshot and the query; ids dedupe
+        merged = {d["id"]: d for d in stored}
+        merged.update((d["id"], d) for d in pending)
+        docs = sorted(merged.values(), key=lambda d: (as_utc(d["timestamp"]), d["id"]), reverse=True)
+        page, more = docs[:limit], len(docs) > limit
+        next_cursor = encode_cursor(page[-1]) if more else None
+        return [public(d) for d in reversed(page)], next_cursor
@@ -0,0 +1,350 @@
+"""Cluster bus for the /api/ws signaling server.
+
+Each worker keeps its own sockets in the local RoomRegistry; the bus carries
+whatever has to cross a process boundary: room membership, room broadcasts
+and targeted offer/answer/ice-candidate forwards.
+
+- InProcessBus: single worker (default). Every peer is local, nothing to relay.
+- RedisBus: membership in Redis hashes, frames over Redis pub/sub. Works with
+  any Redis-protocol server, so several uvicorn workers and hosts can share rooms.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from codec import decode_json, encode_json
+
+logger = logging.getLogger(__name__)
+
+# on_room(room, data, exclude, key) / on_peer(user_id, data)
+RoomHandler = Callable[[str, Dict[str, Any], Set[str], Optional[str]], None]
+PeerHandler = Callable[[str, Dict[str, Any]], None]
+
+
+class ClusterBus:
+    """Interface between the local registry and the rest of the cluster."""
+
+    name = "base"
+
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or uuid.uuid4().hex[:12]
+
+    async def start(self, on_room: RoomHandler, on_peer: PeerHandler):
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+    async def register(self, room: str, user_id: str, name: str, offer_order: bool = False):
+        # A local peer joined `room`; offer_order: its client follows the lower-id-offers rule
+        raise NotImplementedError
+
+    async def unregister(self, room: str, user_id: str):
+        # A local peer left `room` (or disconnected)
+        raise NotImplementedError
+
+    async def remote_members(self, room: str) -> List[Dict[str, Any]]:
+        # [{id, name, offerOrder?}] of members of `room` connected to other nodes
+        raise NotImplementedError
+
+    def publish_room(self, room: str, data: Dict[str, Any], exclude: Iterable[str] = (), key: Optional[str] = None):
+        # Fan `data` out to members of `room` on other nodes; never blocks
+        raise NotImplementedError
+
+    async def forward(self, user_id: str, data: Dict[str, Any] | List[Dict[str, Any]], room: Optional[str] = None) -> bool:
+        # Route `data` (one frame, or several delivered in order) to a peer on another node;
+        # False if no such peer (in `room`, if given)
+        raise NotImplementedError
+
+
+class InProcessBus(ClusterBus):
+    name = "memory"
+
+    async def start(self, on_room: RoomHandler, on_peer: PeerHandler):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def register(self, room: str, user_id: str, name: str, offer_order: bool = False):
+        pass
+
+    async def unregister(self, room: str, user_id: str):
+        pass
+
+    async def remote_members(self, room: str) -> List[Dict[str, Any]]:
+        return []
+
+    def publish_room(self, room: str, data: Dict[str, Any], exclude: Iterable[str] = (), key: Optional[str] = None):
+        pass
+
+    async def forward(self, user_id: str, data: Dict[str, Any] | List[Dict[str, Any]], room: Optional[str] = None) -> bool:
+        return False
+
+
+class RedisBus(ClusterBus):
+    """Redis-backed bus.
+
+    Keys (all under `prefix`):
+      room:<room>   hash user_id -> {"name", "node", "o"?}
+      peers         hash user_id -> {"room", "node"}
+      node:<node>   liveness key refreshed every node_ttl/3 seconds
+    Entries of nodes whose liveness key expired (crashed without unregistering)
+    are skipped on read and deleted by every node's periodic reaper.
+    Channels:
+      chan:room:<room>  broadcasts; subscribed while this node has members there
+      chan:node:<node>  targeted forwards to peers on that node
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "soundcore", node_id: Optional[str] = None, node_ttl: int = 15):
+        super().__init__(node_id)
+        # Imported here: optional, only needed for CLUSTER_BUS=redis, and slow to import
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("CLUSTER_BUS=redis requires the 'redis' package")
+        self.url = url
+        self.prefix = prefix
+        self.node_ttl = max(3, node_ttl)
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._pubsub = None
+        self._on_room: Optional[RoomHandler] = None
+        self._on_peer: Optional[PeerHandler] = None
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        # Local members { user_id: (room, name, offer_order) } and per-room counts driving subscriptions
+        self._local: Dict[str, Tuple[str, str, bool]] = {}
+        self._room_counts: Dict[str, int] = {}
+        # { node_id: (alive, checked_at) }
+        self._alive_cache: Dict[str, Tuple[bool, float]] = {}
+
+    def _k(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    async def start(self, on_room: RoomHandler, on_peer: PeerHandler):
+        self._on_room = on_room
+        self._on_peer = on_peer
+        await self._redis.set(self._k("node", self.node_id), "1", ex=self.node_ttl)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self._k("chan", "node", self.node_id))
+        self._tasks = [
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self._publisher()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+        logger.info(f"Cluster bus: redis node {self.node_id} at {self.url}")
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for user_id, (room, _, _) in self._local.items():
+                pipe.hdel(self._k("room", room), user_id)
+                pipe.hdel(self._k("peers"), user_id)
+            pipe.delete(self._k("node", self.node_id))
+            await pipe.execute()
+            if self._pubsub is not None:
+                await self._pubsub.aclose()
+            await self._redis.aclose()
+        except Exception as e:
+            logger.warning(f"Cluster bus shutdown: {e}")
+        self._local.clear()
+        self._room_counts.clear()
+
+    def _put(self, pipe, room: str, user_id: str, name: str, offer_order: bool):
+        member = {"name": name, "node": self.node_id}
+        if offer_order:
+            member["o"] = 1
+        pipe.hset(self._k("room", room), user_id, encode_json(member))
+        pipe.hset(self._k("peers"), user_id, encode_json({"room": room, "node": self.node_id}))
+
+    async def register(self, room: str, user_id: str, name: str, offer_order: bool = False):
+        self._local[user_id] = (room, name, offer_order)
+        self._room_counts[room] = self._room_counts.get(room, 0) + 1
+        try:
+            if self._room_counts[room] == 1:
+                await self._pubsub.subscribe(self._k("chan", "room", room))
+            pipe = self._redis.pipeline(transaction=False)
+            self._put(pipe, room, user_id, name, offer_order)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Cluster bus register failed: {e}")
+
+    async def unregister(self, room: str, user_id: str):
+        if self._local.pop(user_id, None) is None:
+            return
+        count = self._room_counts.get(room, 0) - 1
+        try:
+            if count <= 0:
+                self._room_counts.pop(room, None)
+                await self._pubsub.unsubscribe(self._k("chan", "room", room))
+            else:
+                self._room_counts[room] = count
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hdel(self._k("room", room), user_id)
+            pipe.hdel(self._k("peers"), user_id)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Cluster bus unregister failed: {e}")
+
+    async def _nodes_alive(self, nodes: Set[str]) -> Set[str]:
+        # Members of crashed nodes linger in the hashes until their TTL key is gone; filter them out
+        now = time.monotonic()
+        alive: Set[str] = set()
+        stale: List[str] = []
+        for n in nodes:
+            cached = self._alive_cache.get(n)
+            if cached and now - cached[1] < 1.0:
+                if cached[0]:
+                    alive.add(n)
+            else:
+                stale.append(n)
+        if stale:
+            flags = await self._redis.mget([self._k("node", n) for n in stale])
+            for n, flag in zip(stale, flags):
+                self._alive_cache[n] = (flag is not None, now)
+                if flag is not None:
+                    alive.add(n)
+        return alive
+
+    async def remote_members(self, room: str) -> List[Dict[str, str]]:
+        try:
+            entries = await self._redis.hgetall(self._k("room", room))
+            parsed = {uid: decode_json(v) for uid, v in entries.items()}
+            remote = {uid: meta for uid, meta in parsed.items() if meta.get("node") != self.node_id}
+            alive = await self._nodes_alive({meta.get("node") for meta in remote.values()})
+        except Exception as e:
+            logger.warning(f"Cluster bus membership lookup failed: {e}")
+            return []
+        members = []
+        for uid, meta in remote.items():
+            if meta.get("node") not in alive:
+                continue
+            member = {"id": uid, "name": meta.get("name") or f"User-{uid[:5]}"}
+            if meta.get("o"):
+                member["offerOrder"] = True
+            members.append(member)
+        return members
+
+    def publish_room(self, room: str, data: Dict[str, Any], exclude: Iterable[str] = (), key: Optional[str] = None):
+        msg = {"o": self.node_id, "r": room, "x": list(exclude), "k": key, "d": data}
+        self._outbox.put_nowait((self._k("chan", "room", room), encode_json(msg)))
+
+    async def forward(self, user_id: str, data: Dict[str, Any] | List[Dict[str, Any]], room: Optional[str] = None) -> bool:
+        # One lookup however many frames go to the peer
+        try:
+            raw = await self._redis.hget(self._k("peers"), user_id)
+            if raw is None:
+                return False
+            meta = decode_json(raw)
+            node = meta.get("node")
+            if node == self.node_id or (room is not None and meta.get("room") != room):
+                return False
+            if node not in await self._nodes_alive({node}):
+                return False
+        except Exception as e:
+            logger.warning(f"Cluster bus forward lookup failed: {e}")
+            return False
+        channel = self._k("chan", "node", node)
+        for frame in data if isinstance(data, list) else [data]:
+            self._outbox.put_nowait((channel, encode_json({"o": self.node_id, "to": user_id, "d": frame})))
+        return True
+
+    async def _publisher(self):
+        # Drain everything queued since the last round trip into one pipeline
+        while True:
+            channel, payload = await self._outbox.get()
+            batch = [(channel, payload)]
+            while not self._outbox.empty():
+                batch.append(self._outbox.get_nowait())
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for ch, p in batch:
+                    pipe.publish(ch, p)
+                await pipe.execute()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cluster bus publish failed ({len(batch)} frames dropped): {e}")
+
+    async def _reader(self):
+        room_prefix = self._k("chan", "room", "")
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None or message.get("type") != "message":
+                    continue
+                msg = decode_json(message["data"])
+                if msg.get("o") == self.node_id:
+                    continue
+                channel = message["channel"]
+                if channel.startswith(room_prefix):
+                    self._on_room(msg["r"], msg["d"], set(msg.get("x") or ()), msg.get("k"))
+                else:
+                    self._on_peer(msg["to"], msg["d"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cluster bus receive failed: {e}")
+                await asyncio.sleep(0.5)
+
+    async def _heartbeat(self):
+        beats = 0
+        while True:
+            await asyncio.sleep(self.node_ttl / 3)
+            beats += 1
+            try:
+                previous = await self._redis.set(self._k("node", self.node_id), "1", ex=self.node_ttl, get=True)
+                if previous is None and self._local:
+                    # Our key lapsed (e.g. Redis was unreachable) and other nodes may have reaped us
+                    await self._restore()
+                if beats % 3 == 0:
+                    await self.reap()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cluster bus heartbeat failed: {e}")
+
+    async def _restore(self):
+        pipe = self._redis.pipeline(transaction=False)
+        for user_id, (room, name, offer_order) in self._local.items():
+            self._put(pipe, room, user_id, name, offer_order)
+        await pipe.execute()
+        logger.warning(f"Cluster bus: re-registered {len(self._local)} members after the node key lapsed")
+
+    async def reap(self) -> int:
+        # Delete members of nodes that are gone; unregister never ran for them
+        entries = await self._redis.hgetall(self._k("peers"))
+        parsed = {uid: decode_json(raw) for uid, raw in entries.items()}
+        alive = await self._nodes_alive({meta.get("node") for meta in parsed.values()})
+        dead = {uid: meta for uid, meta in parsed.items() if meta.get("node") not in alive}
+        if not dead:
+            return 0
+        pipe = self._redis.pipeline(transaction=False)
+        for uid, meta in dead.items():
+            pipe.hdel(self._k("room", str(meta.get("room"))), uid)
+            pipe.hdel(self._k("peers"), uid)
+        await pipe.execute()
+        logger.info(f"Cluster bus: reaped {len(dead)} members of departed nodes")
+        return len(dead)
+
+
+def create_bus() -> ClusterBus:
+    # CLUSTER_BUS=memory (default) | redis
+    kind = os.environ.get("CLUSTER_BUS", "memory").strip().lower()
+    if kind == "redis":
+        return RedisBus(
+            os.environ.get("CLUSTER_REDIS_URL", "redis://localhost:6379/0"),
+            prefix=os.environ.get("CLUSTER_PREFIX", "soundcore"),
+            node_id=os.environ.get("CLUSTER_NODE_ID") or None,
+        )
+    if kind != "memory":
+        logger.warning(f"Unknown CLUSTER_BUS '{kind}', using in-process bus")
+    return InProcessBus()
@@ -0,0 +1,154 @@
+"""Wire codec for /api/ws.
+
+Outbound messages are wrapped in a Frame so a broadcast is serialized once per
+wire format and the same payload is written to every recipient. orjson is used
+when installed, with the stdlib json module as fallback.
+
+Two framings are negotiated per connection through the WebSocket subprotocol:
+- soundcore.json (or no subprotocol): JSON text frames, the original protocol
+- soundcore.msgpack: MessagePack binary frames (needs the msgpack package)
+
+Clients that connect with ?compress=deflate may also receive large frames as
+binary `0x00 + raw deflate(payload)`, where payload is the connection's normal
+encoding. Small frames (ICE candidates) always go out uncompressed.
+"""
+import json
+import zlib
+from typing import Any, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, enables the binary subprotocol
+    msgpack = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+SUBPROTOCOL_JSON = "soundcore.json"
+SUBPROTOCOL_MSGPACK = "soundcore.msgpack"
+
+# Leading byte of a deflated frame; never the first byte of a msgpack map
+COMPRESSED_PREFIX = b"\x00"
+
+
+def encode_json(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"))
+
+
+def decode_json(raw: str | bytes) -> Any:
+    # Raises ValueError on malformed input with either backend
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def select_subprotocol(offered: List[str]) -> str | None:
+    # First protocol in the client's preference order that we can speak
+    for proto in offered:
+        if proto == SUBPROTOCOL_JSON or (proto == SUBPROTOCOL_MSGPACK and msgpack is not None):
+            return proto
+    return None
+
+
+def decode_message(text: str | None, data: bytes | None) -> Any:
+    # Text frames are JSON, binary frames MessagePack; raises ValueError when malformed
+    if text is not None:
+        return decode_json(text)
+    if data is None or msgpack is None:
+        raise ValueError("unsupported frame")
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise ValueError(str(e)) from e
+
+
+# MessagePack can carry values JSON cannot (bytes, non-string keys); signaling payloads relayed
+# to other peers must hold only what every framing can encode
+def is_sdp(value: Any) -> bool:
+    # {type, sdp} session description with string keys and values, or a bare SDP string
+    if isinstance(value, str):
+        return True
+    return isinstance(value, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in value.items())
+
+
+def is_candidate(value: Any) -> bool:
+    # RTCIceCandidateInit ({candidate, sdpMid, sdpMLineIndex, usernameFragment}) or a bare candidate string
+    if isinstance(value, str):
+        return True
+    return isinstance(value, dict) and all(
+        isinstance(k, str) and (v is None or isinstance(v, (str, int, float))) for k, v in value.items()
+    )
+
+
+def deflate(raw: bytes, level: int = 6) -> bytes:
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return COMPRESSED_PREFIX + c.compress(raw) + c.flush()
+
+
+class CompressionStats:
+    """Egress accounting for deflated frames, counted per recipient."""
+
+    def __init__(self):
+        self.frames = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def record(self, raw: int, wire: int):
+        self.frames += 1
+        self.raw_bytes += raw
+        self.wire_bytes += wire
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "frames": self.frames,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "saved_bytes": self.raw_bytes - self.wire_bytes,
+            "ratio": round(self.wire_bytes / self.raw_bytes, 4) if self.raw_bytes else None,
+        }
+
+
+class Frame:
+    """Outbound message, encoded lazily and at most once per format for all recipients."""
+
+    __slots__ = ("data", "_text", "_packed", "_deflated")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self._text: str | None = None
+        self._packed: bytes | None = None
+        # { binary: (raw_size, deflated or None) }
+        self._deflated: Dict[bool, Tuple[int, bytes | None]] | None = None
+
+    @property
+    def type(self) -> str | None:
+        return self.data.get("type")
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = encode_json(self.data)
+        return self._text
+
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb(self.data, use_bin_type=True)
+        return self._packed
+
+    def deflated(self, binary: bool, min_bytes: int, level: int = 6) -> Tuple[int, bytes | None]:
+        # (raw size, deflated frame); deflated is None below min_bytes or when it would not shrink
+        if self._deflated is None:
+            self._deflated = {}
+        cached = self._deflated.get(binary)
+        if cached is None:
+            raw = self.packed() if binary else self.text().encode()
+            packed = deflate(raw, level) if len(raw) >= min_bytes else None
+            if packed is not None and len(packed) >= len(raw):
+                packed = None
+            cached = self._deflated[binary] = (len(raw), packed)
+        return cached
@@ -0,0 +1,60 @@
+"""Lazily connected MongoDB handle for the REST API and chat history."""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class LazyMongo:
+    """Database handle whose Motor client is created on first use.
+
+    The /api/ws signaling path never touches Mongo, so a process that only
+    serves WebSockets neither imports the driver nor dials the server.
+    """
+
+    def __init__(self, url: str | None, name: str):
+        self._url = url
+        self._name = name
+        self._client = None
+        self._db = None
+        # Run once the client exists (index creation and the like)
+        self._on_connect: List[Callable[[], Awaitable[None]]] = []
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._url)
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    def on_connect(self, hook: Callable[[], Awaitable[None]]):
+        self._on_connect.append(hook)
+
+    def database(self):
+        if self._db is None:
+            if not self._url:
+                raise RuntimeError("MONGO_URL is not set")
+            started = time.perf_counter()
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self._client = AsyncIOMotorClient(self._url)
+            self._db = self._client[self._name]
+            logger.info(f"MongoDB client created on first use in {(time.perf_counter() - started) * 1000:.0f} ms")
+            for hook in self._on_connect:
+                asyncio.create_task(hook())
+        return self._db
+
+    def __getattr__(self, name: str):
+        # db.status_checks etc.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.database()[name]
+
+    def __getitem__(self, name: str):
+        return self.database()[name]
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
@@ -0,0 +1,144 @@
+"""Graceful drain of /api/ws before a restart or scale-in."""
+import asyncio
+import logging
+import random
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ws_drain_hints = Counter("signaling_ws_drain_hints_total", "'reconnect' frames sent while draining")
+ws_drain_closes = Counter("signaling_ws_drain_closes_total", "Sockets closed by a drain after their reconnect slot")
+
+
+class Drain:
+    """Graceful shutdown: turn new peers away, hint connected ones to move, close them gradually.
+
+    Every peer is told its slot up front and reconnects by itself; the server only
+    closes what is still open once a slot (plus grace) has passed. Peers of one
+    room share a slot, so rooms move whole instead of being split across instances.
+    """
+
+    def __init__(self, window_ms: int, grace_ms: int, target: str, admission, sessions, heartbeat,
+                 end_session: Callable[[Any], Awaitable[None]]):
+        self.window = window_ms / 1000
+        self.grace = grace_ms / 1000
+        self.target = target or None
+        # Admission (turned away while draining), SessionStore and Heartbeat (the open connections)
+        self.admission = admission
+        self.sessions = sessions
+        self.heartbeat = heartbeat
+        self.end_session = end_session
+        self.started: float | None = None
+        self.remaining = 0
+        self._task: asyncio.Task | None = None
+        # SIGTERM drains: exit once done
+        self._exit = False
+
+    def hint(self, delay: float | None = None, target: str | None = None) -> Dict[str, Any]:
+        # 'reconnect' frame; without a slot (a late arrival) a jittered retry delay
+        frame = {"type": "reconnect", "reason": "draining",
+                 "delayMs": self.admission.retry_ms() if delay is None else int(delay * 1000)}
+        target = target or self.target
+        if target:
+            frame["target"] = target
+        return frame
+
+    def plan(self, conns: List[Any], window: float) -> List[Tuple[float, Any]]:
+        # One slot per room (queued joiners go with their room, roomless sockets alone), spread
+        # evenly over the window in random order with jitter inside each slot
+        groups: Dict[str, List[Any]] = {}
+        for conn in conns:
+            groups.setdefault(conn.room or conn.queued_room or f"peer:{conn.user_id}", []).append(conn)
+        order = list(groups.values())
+        random.shuffle(order)
+        width = window / max(1, len(order))
+        slots = []
+        for i, members in enumerate(order):
+            delay = (i + random.random()) * width
+            slots.extend((delay, conn) for conn in members)
+        return slots
+
+    def start(self, window: float | None = None, target: str | None = None) -> bool:
+        if self.admission.draining:
+            return False
+        self.admission.draining = True
+        self.started = time.monotonic()
+        window = self.window if window is None else window
+        # Nothing can resume here anymore; peers waiting for it are gone for good
+        self.sessions.expire_parked()
+        slots = self.plan([conn for conn in self.heartbeat.connections if not conn.closed], window)
+        logger.warning(f"Draining {len(slots)} connections over {window:.1f}s")
+        for delay, conn in slots:
+            if conn.send(self.hint(delay, target)):
+                ws_drain_hints.inc()
+        self.remaining = len(slots)
+        self._task = asyncio.create_task(self._run(slots))
+        return True
+
+    async def _run(self, slots: List[Tuple[float, Any]]):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for delay, conn in sorted(slots, key=lambda slot: slot[0]):
+            wait = started + delay + self.grace - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.remaining -= 1
+            if conn.closed:
+                # Moved on by itself
+                continue
+            ws_drain_closes.inc()
+            self.heartbeat.connections.discard(conn)
+            conn.abort(1012, "service restart")
+            await self.end_session(conn)
+        logger.info(f"Drain finished after {loop.time() - started:.1f}s")
+
+    def cancel(self) -> bool:
+        # Back in service; hints already sent cannot be taken back
+        if not self.admission.draining or self._exit:
+            return False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.admission.draining = False
+        self.started = None
+        self.remaining = 0
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "draining": self.admission.draining,
+            "elapsedMs": int((time.monotonic() - self.started) * 1000) if self.started is not None else None,
+            "remaining": self.remaining,
+            "connections": self.admission.connections,
+        }
+
+    def install_signal_handler(self):
+        # Replaces uvicorn's SIGTERM handler; its SIGINT handler still does the actual shutdown
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._on_sigterm)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Windows, or not in the main thread (e.g. test clients)
+            pass
+
+    def _on_sigterm(self):
+        if self._exit:
+            logger.warning("Second SIGTERM, exiting without finishing the drain")
+            signal.raise_signal(signal.SIGINT)
+            return
+        self._exit = True
+        # Or joins a drain already started from the admin endpoint
+        self.start()
+        self._task.add_done_callback(self._exit_when_done)
+
+    def _exit_when_done(self, task: asyncio.Task):
+        if not task.cancelled():
+            signal.raise_signal(signal.SIGINT)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
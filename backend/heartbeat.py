@@ -0,0 +1,71 @@
+"""Heartbeat sweeper for /api/ws: pings every connection and evicts the silent ones."""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Set
+
+from codec import Frame
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ws_evictions = Counter("signaling_ws_evictions_total", "Connections evicted by the heartbeat sweeper", ["reason"])
+
+
+class Heartbeat:
+    """Background sweeper: pings every connection and evicts the ones that went silent.
+
+    The endpoint's receive loop never returns on a half-open TCP connection, so
+    eviction cleans up room membership itself instead of waiting for `finally`.
+    """
+
+    def __init__(self, interval_ms: int, timeout_ms: int, end_session: Callable[[Any], Awaitable[None]],
+                 housekeeping: List[Callable[[], Any]]):
+        self.interval = interval_ms / 1000
+        self.timeout = timeout_ms / 1000
+        # end_session(conn) tears down an evicted peer's room membership
+        self.end_session = end_session
+        # Run after every sweep to drop state of peers and rooms that are gone
+        self.housekeeping = housekeeping
+        self.connections: Set[Any] = set()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Heartbeat sweep failed: {e}")
+
+    async def sweep(self):
+        now = time.monotonic()
+        ping = Frame({"type": "ping"})
+        for conn in list(self.connections):
+            if conn.closed:
+                # Writer failed or the socket was aborted, but the endpoint has not noticed yet
+                await self.evict(conn, "closed")
+            elif self.timeout > 0 and conn.pongs and now - conn.last_seen > self.timeout:
+                await self.evict(conn, "idle")
+            else:
+                conn.send(ping)
+        for prune in self.housekeeping:
+            prune()
+
+    async def evict(self, conn, reason: str):
+        self.connections.discard(conn)
+        ws_evictions.labels(reason).inc()
+        logger.info(f"Evicting {conn.user_id} ({reason})")
+        conn.abort(1001, "heartbeat timeout")
+        await self.end_session(conn)
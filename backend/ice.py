@@ -0,0 +1,87 @@
+"""ICE plumbing: the /api/ice server list with TURN credentials, and candidate batching on /api/ws."""
+import asyncio
+import base64
+import hashlib
+import hmac
+from typing import Any, Dict, List, Tuple
+
+from codec import encode_json
+
+
+def split_urls(value: str) -> List[str]:
+    return [u.strip() for u in value.split(',') if u.strip()]
+
+
+class IceConfig:
+    """Pre-serialized /api/ice response, rebuilt only when ephemeral TURN credentials roll over."""
+
+    def __init__(self, stun_urls: str, turn_urls: str, turn_username: str, turn_credential: str,
+                 turn_secret: str = "", credential_ttl: int = 86400):
+        self.stun = split_urls(stun_urls) or [
+            "stun:stun.l.google.com:19302",
+            "stun:global.stun.twilio.com:3478"
+        ]
+        self.turn = split_urls(turn_urls)
+        self.turn_username = turn_username
+        self.turn_credential = turn_credential
+        self.secret = turn_secret.encode()
+        self.ttl = max(60, credential_ttl)
+        # Everyone asking within one window gets the same credential (and cacheable bytes);
+        # it expires ttl seconds after the window ends, so it is never handed out with less left
+        self.window = max(30, self.ttl // 4)
+        # (window index, body, etag)
+        self._cached: Tuple[int, bytes, str] | None = None
+
+    def _turn_entry(self, window: int) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {"urls": self.turn}
+        if self.secret:
+            expiry = (window + 1) * self.window + self.ttl
+            username = f"{expiry}:{self.turn_username or 'soundcore'}"
+            digest = hmac.new(self.secret, username.encode(), hashlib.sha1).digest()
+            entry["username"] = username
+            entry["credential"] = base64.b64encode(digest).decode()
+        else:
+            if self.turn_username:
+                entry["username"] = self.turn_username
+            if self.turn_credential:
+                entry["credential"] = self.turn_credential
+        return entry
+
+    def response(self, now: float) -> Tuple[bytes, str, int]:
+        # (body, etag, seconds the body stays valid)
+        minted = bool(self.secret and self.turn)
+        window = int(now // self.window) if minted else 0
+        if self._cached is None or self._cached[0] != window:
+            ice_servers: List[Dict[str, Any]] = [{"urls": self.stun}]
+            if self.turn:
+                ice_servers.append(self._turn_entry(window))
+            body = encode_json({"iceServers": ice_servers}).encode()
+            self._cached = (window, body, f'"{hashlib.sha1(body).hexdigest()[:20]}"')
+        _, body, etag = self._cached
+        max_age = int((window + 1) * self.window - now) if minted else 300
+        return body, etag, max(1, max_age)
+
+
+class IceBatcher:
+    """Coalesces ICE candidates per (from, to) pair into one 'ice-candidates' frame."""
+
+    def __init__(self, window_ms: int, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        # { (from_id, to_id): (target, candidates) }
+        self._pending: Dict[Tuple[str, str], Tuple[Any, List[Any]]] = {}
+
+    def add(self, from_id: str, target, candidates: List[Any], end: bool = False):
+        key = (from_id, target.user_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = (target, [])
+            asyncio.get_running_loop().call_later(self.window, self.flush, from_id, target.user_id)
+        entry[1].extend(candidates)
+        if end or len(entry[1]) >= self.max_batch:
+            self.flush(from_id, target.user_id)
+
+    def flush(self, from_id: str, to_id: str):
+        entry = self._pending.pop((from_id, to_id), None)
+        if entry and entry[1]:
+            entry[0].send({"type": "ice-candidates", "from": from_id, "candidates": entry[1]})
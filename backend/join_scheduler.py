@@ -0,0 +1,103 @@
+"""Join-storm pacing: caps how many joiners per room negotiate at once and queues the rest."""
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+
+class JoinScheduler:
+    """Per-room admission control for joiners during join storms."""
+
+    def __init__(self, max_negotiations: int, timeout_ms: int, join: Callable[[Any, str, str], Awaitable[None]]):
+        self.max_negotiations = max_negotiations
+        self.timeout = timeout_ms / 1000
+        # join(conn, room, name) runs the join of an admitted waiter
+        self.join = join
+        # { room: { joiner_id: [peers yet to answer (None until joined), timeout handle] } }
+        self._active: Dict[str, Dict[str, List[Any]]] = {}
+        # { room: deque[(conn, name)] } waiting for a slot
+        self._waiting: Dict[str, Deque[Tuple[Any, str]]] = {}
+
+    def request(self, conn, room: str, name: str) -> int:
+        # 0 when the joiner may proceed now, else its 1-based queue position
+        if self.max_negotiations <= 0:
+            return 0
+        waiting = self._waiting.get(room)
+        if not waiting and len(self._active.get(room, ())) < self.max_negotiations:
+            self._reserve(room, conn.user_id)
+            return 0
+        waiting = self._waiting.setdefault(room, deque())
+        waiting.append((conn, name))
+        conn.queued_room = room
+        return len(waiting)
+
+    def _reserve(self, room: str, joiner_id: str):
+        handle = asyncio.get_running_loop().call_later(self.timeout, self.finish, room, joiner_id)
+        self._active.setdefault(room, {})[joiner_id] = [None, handle]
+
+    def started(self, room: str, joiner_id: str, peers: List[str]):
+        entry = self._active.get(room, {}).get(joiner_id)
+        if entry is None:
+            return
+        entry[0] = set(peers)
+        if not peers:
+            # Nobody to negotiate with
+            self.finish(room, joiner_id)
+
+    def answered(self, from_id: str, joiner):
+        entry = self._active.get(joiner.room or "", {}).get(joiner.user_id)
+        if entry is None or entry[0] is None:
+            return
+        entry[0].discard(from_id)
+        if not entry[0]:
+            self.finish(joiner.room, joiner.user_id)
+
+    def finish(self, room: str, joiner_id: str):
+        active = self._active.get(room)
+        entry = active.pop(joiner_id, None) if active else None
+        if entry is None:
+            return
+        entry[1].cancel()
+        if not active:
+            del self._active[room]
+        self._admit_next(room)
+
+    def forget(self, conn):
+        # Connection left, switched rooms or disconnected
+        if conn.queued_room:
+            waiting = self._waiting.get(conn.queued_room)
+            if waiting:
+                self._waiting[conn.queued_room] = deque(w for w in waiting if w[0] is not conn)
+            conn.queued_room = None
+        room = conn.room
+        if not room or room not in self._active:
+            return
+        self.finish(room, conn.user_id)
+        # Joiners still waiting on this peer's answer stop waiting for it
+        for joiner_id, entry in list(self._active.get(room, {}).items()):
+            if entry[0] is not None and conn.user_id in entry[0]:
+                entry[0].discard(conn.user_id)
+                if not entry[0]:
+                    self.finish(room, joiner_id)
+
+    def prune(self):
+        # Drop waiters whose socket is gone so busy rooms do not accumulate dead entries
+        for room, waiting in list(self._waiting.items()):
+            alive = deque(w for w in waiting if not w[0].closed)
+            if alive:
+                self._waiting[room] = alive
+            else:
+                del self._waiting[room]
+
+    def waiting(self, room: str) -> int:
+        return len(self._waiting.get(room, ()))
+
+    def _admit_next(self, room: str):
+        waiting = self._waiting.get(room)
+        while waiting and len(self._active.get(room, ())) < self.max_negotiations:
+            conn, name = waiting.popleft()
+            if conn.closed or conn.queued_room != room:
+                continue
+            self._reserve(room, conn.user_id)
+            asyncio.create_task(self.join(conn, room, name))
+        if waiting is not None and not waiting:
+            del self._waiting[room]
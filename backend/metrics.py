@@ -0,0 +1,162 @@
+"""Minimal Prometheus-style metrics for the signaling server.
+
+Plain Python counters and fixed-bucket histograms: an update is an attribute
+increment (plus a bisect for histograms), cheap enough for the WebSocket hot
+path. `render()` produces the Prometheus text exposition format. Values are
+per process; with several workers, scrape each one.
+"""
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Seconds, tuned for in-process signaling work (tens of microseconds to a second)
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+_registry: List["_Metric"] = []
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labelstr(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        _registry.append(self)
+
+    def labels(self, *values: str):
+        # Cached child per label set; hold on to it in hot paths
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._value = _CounterValue()
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._value.value += amount
+
+    def _samples(self) -> List[str]:
+        if not self.labelnames:
+            return [f"{self.name} {_fmt(self._value.value)}"]
+        return [f"{self.name}{_labelstr(self.labelnames, k)} {_fmt(c.value)}" for k, c in self._children.items()]
+
+
+class Gauge(_Metric):
+    """Settable gauge, or computed at scrape time when `fn` is given."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float] | None = None, kind: str = "gauge"):
+        super().__init__(name, help)
+        self.kind = kind
+        self._fn = fn
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def _samples(self) -> List[str]:
+        value = self._fn() if self._fn is not None else self.value
+        return [f"{self.name} {_fmt(value)}"]
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._value = _HistogramValue(self.bounds)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self._value.observe(value)
+
+    def _samples(self) -> List[str]:
+        items = self._children.items() if self.labelnames else [((), self._value)]
+        lines: List[str] = []
+        for key, h in items:
+            cumulative = 0
+            for bound, n in zip(self.bounds + (math.inf,), h.counts):
+                cumulative += n
+                le = _labelstr(self.labelnames, key, f'le="{_fmt(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            base = _labelstr(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base} {_fmt(h.sum)}")
+            lines.append(f"{self.name}_count{base} {h.count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
@@ -0,0 +1,31 @@
+"""Keyset pagination cursors for collections ordered by (timestamp, id).
+
+A cursor is the URL-safe base64 of `isoformat timestamp|id`, without padding,
+so clients can pass X-Next-Cursor or a chat page's `next` back in a query
+string as-is. Cursors in the older raw `timestamp|id` form are still accepted.
+"""
+import base64
+from datetime import datetime, timezone
+from typing import Any, Dict, Tuple
+
+
+def as_utc(ts: datetime) -> datetime:
+    # Motor returns naive UTC datetimes
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    key = f"{as_utc(doc['timestamp']).isoformat()}|{doc['id']}"
+    return base64.urlsafe_b64encode(key.encode()).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    # Raises ValueError on a malformed cursor
+    if "|" in cursor:
+        key = cursor
+    else:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    ts, _, doc_id = key.partition("|")
+    if not doc_id:
+        raise ValueError("malformed cursor")
+    return as_utc(datetime.fromisoformat(ts)), doc_id
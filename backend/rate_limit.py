@@ -0,0 +1,110 @@
+"""Inbound rate limits for /api/ws: token buckets per connection and per room, keyed by message type."""
+import logging
+import time
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Signaling sent to each peer of the room: their limits scale with the sender's room size
+PER_PEER_RATE_TYPES = frozenset(("offer", "answer", "ice-candidate", "ice-candidates"))
+
+
+def parse_rate(spec: str) -> Tuple[float, float] | None:
+    # 'rate:burst' -> (tokens per second, bucket size); a bare rate uses it as the burst too
+    rate, _, burst = spec.partition(":")
+    try:
+        r = float(rate)
+        b = float(burst) if burst else r
+    except ValueError:
+        return None
+    return (r, max(1.0, b)) if r > 0 else None
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits: Dict[str, Tuple[float, float]] = {}
+    for item in spec.split(","):
+        mtype, _, rate = item.strip().partition("=")
+        parsed = parse_rate(rate.strip()) if mtype else None
+        if parsed:
+            limits[mtype.strip()] = parsed
+        elif item.strip():
+            logger.warning(f"Ignoring invalid rate limit '{item.strip()}'")
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now: float) -> float:
+        # 0 when a token was taken, else seconds until one is available
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per connection and per room, keyed by message type."""
+
+    def __init__(self, conn_limits: Dict[str, Tuple[float, float]], room_limits: Dict[str, Tuple[float, float]],
+                 strikes: Tuple[float, float] | None, registry):
+        self.conn_limits = conn_limits
+        self.room_limits = room_limits
+        self.strike_limit = strikes
+        # RoomRegistry, for room sizes
+        self.registry = registry
+        # { (room, type): bucket }
+        self._rooms: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def check(self, conn, mtype: str) -> Tuple[str, float] | None:
+        # None when the frame may proceed, else (scope, seconds until it would be allowed)
+        now = time.monotonic()
+        key = mtype if mtype in self.conn_limits else "*"
+        limit = self.conn_limits.get(key)
+        if limit is not None:
+            if key in PER_PEER_RATE_TYPES:
+                # Peers this connection negotiates with: everyone in the room when it joined
+                # (other nodes included) or now, whichever is more
+                peers = max(1, conn.room_peers, len(self.registry.members(conn.room)) - 1 if conn.room else 0)
+                limit = (limit[0] * peers, limit[1] * peers)
+            bucket = conn.buckets.get(key)
+            if bucket is None:
+                bucket = conn.buckets[key] = TokenBucket(*limit, now)
+            elif bucket.burst != limit[1]:
+                # Room grew or shrank; a bigger room's headroom is available at once
+                bucket.tokens = max(0.0, bucket.tokens + limit[1] - bucket.burst)
+                bucket.rate, bucket.burst = limit
+            wait = bucket.take(now)
+            if wait:
+                return "connection", wait
+        limit = self.room_limits.get(mtype)
+        if limit is not None and conn.room:
+            bucket = self._rooms.get((conn.room, mtype))
+            if bucket is None:
+                bucket = self._rooms[(conn.room, mtype)] = TokenBucket(*limit, now)
+            wait = bucket.take(now)
+            if wait:
+                return "room", wait
+        return None
+
+    def strike(self, conn) -> bool:
+        # Record a violation; False once the connection is out of strikes
+        if self.strike_limit is None:
+            return True
+        now = time.monotonic()
+        if conn.strikes is None:
+            conn.strikes = TokenBucket(*self.strike_limit, now)
+        return conn.strikes.take(now) == 0
+
+    def prune(self):
+        # Buckets of rooms that no longer exist on this worker
+        for key in [k for k in self._rooms if not self.registry.members(k[0])]:
+            del self._rooms[key]
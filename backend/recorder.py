@@ -0,0 +1,167 @@
+"""Opt-in recorder of /api/ws traffic, replayed by replay_ws.py.
+
+Every inbound frame and every outbound frame actually written to a socket is
+appended to an NDJSON log, one compact object per line:
+  {"t": ms since start, "c": connection, "d": "i"|"o"|"open"|"close", "r": room, "y": type, ...}
+Inbound entries carry the decoded message ("m"); outbound entries only name
+the peer the frame originates from ("f"), which is all latency analysis needs.
+Peer ids become small integers, resume tokens are never written, and with
+redaction on (the default) SDP bodies and ICE candidate strings are replaced
+by their length. Lines are buffered and appended by a background task, so the
+signaling path never waits on the disk.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from codec import Frame, encode_json
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+record_frames = Counter("signaling_record_frames_total", "Frames written to the traffic recording")
+record_dropped = Counter("signaling_record_frames_dropped_total", "Frames not recorded after WS_RECORD_MAX_MB was reached")
+
+LOG_VERSION = 1
+SDP_TYPES = ("offer", "answer", "sfu-publish", "sfu-answer")
+ICE_TYPES = ("ice-candidate", "ice-candidates")
+
+
+def origin_of(data: Dict[str, Any]) -> Optional[str]:
+    # Peer a delivered frame comes from or is about
+    sender = data.get("from")
+    if isinstance(sender, dict):
+        return sender.get("id")
+    if sender is not None:
+        return sender
+    if data.get("type") in ("new-peer", "leave"):
+        return data.get("id")
+    return None
+
+
+def _redact_candidate(candidate: Any) -> Any:
+    if isinstance(candidate, dict) and isinstance(candidate.get("candidate"), str):
+        return {**candidate, "candidate": len(candidate["candidate"])}
+    return candidate
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, redact: bool = True, max_bytes: int = 512 * 1024 * 1024, flush_ms: int = 500):
+        self.path = path
+        self.redact = redact
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_ms / 1000
+        self._started = time.perf_counter()
+        # Peer id -> short alias, stable for the whole recording
+        self._aliases: Dict[str, int] = {}
+        self._buffer: List[str] = []
+        self._written = 0
+        self._full = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._started = time.perf_counter()
+        self._emit({"d": "start", "v": LOG_VERSION, "at": datetime.now(timezone.utc).isoformat(),
+                    "sdp": "redacted" if self.redact else "kept"})
+        self._task = asyncio.create_task(self._writer())
+        logger.info(f"Recording /api/ws traffic to {self.path}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self._flush()
+
+    def alias(self, peer_id: str) -> int:
+        alias = self._aliases.get(peer_id)
+        if alias is None:
+            alias = self._aliases[peer_id] = len(self._aliases) + 1
+        return alias
+
+    def _now(self) -> float:
+        return round((time.perf_counter() - self._started) * 1000, 2)
+
+    def _emit(self, entry: Dict[str, Any]):
+        if self._full:
+            record_dropped.inc()
+            return
+        line = encode_json(entry) + "\n"
+        self._written += len(line)
+        if self._written > self.max_bytes:
+            self._full = True
+            record_dropped.inc()
+            logger.warning(f"Traffic recording reached {self.max_bytes} bytes; no longer recording")
+            return
+        self._buffer.append(line)
+        record_frames.inc()
+
+    def opened(self, conn):
+        self._emit({"t": self._now(), "c": self.alias(conn.user_id), "d": "open",
+                    "p": "msgpack" if conn.binary else "json", "z": conn.compress})
+
+    def closed(self, conn):
+        # Session over (left, evicted or resume window expired), not just one socket dropping
+        self._emit({"t": self._now(), "c": self.alias(conn.user_id), "d": "close", "r": conn.room})
+
+    def inbound(self, conn, msg: Dict[str, Any]):
+        self._emit({"t": self._now(), "c": self.alias(conn.user_id), "d": "i", "r": conn.room,
+                    "y": msg.get("type"), "m": self._scrub(msg)})
+
+    def outbound(self, conn, frame: Frame):
+        entry = {"t": self._now(), "c": self.alias(conn.user_id), "d": "o", "r": conn.room, "y": frame.type}
+        origin = origin_of(frame.data)
+        if origin is not None:
+            entry["f"] = self.alias(origin)
+        self._emit(entry)
+
+    def _scrub(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        msg = dict(msg)
+        if isinstance(msg.get("to"), str):
+            msg["to"] = self.alias(msg["to"])
+        if "token" in msg:
+            msg["token"] = ""
+        if not self.redact:
+            return msg
+        mtype = msg.get("type")
+        sdp = msg.get("sdp")
+        if mtype in SDP_TYPES and isinstance(sdp, dict) and isinstance(sdp.get("sdp"), str):
+            msg["sdp"] = {**sdp, "sdp": len(sdp["sdp"])}
+        elif mtype == "ice-candidate":
+            msg["candidate"] = _redact_candidate(msg.get("candidate"))
+        elif mtype == "ice-candidates" and isinstance(msg.get("candidates"), list):
+            msg["candidates"] = [_redact_candidate(c) for c in msg["candidates"]]
+        return msg
+
+    async def _writer(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        data, self._buffer = "".join(self._buffer), []
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._append, data)
+        except Exception as e:
+            logger.warning(f"Traffic recording write failed: {e}")
+
+    def _append(self, data: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+
+def create_recorder() -> Optional[TrafficRecorder]:
+    # WS_RECORD_PATH unset = off; '{pid}' in the path keeps workers' recordings apart
+    path = os.environ.get("WS_RECORD_PATH", "").strip()
+    if not path:
+        return None
+    return TrafficRecorder(
+        path.replace("{pid}", str(os.getpid())),
+        redact=os.environ.get("WS_RECORD_SDP", "redact").strip().lower() != "keep",
+        max_bytes=int(float(os.environ.get("WS_RECORD_MAX_MB", "512")) * 1024 * 1024),
+        flush_ms=int(os.environ.get("WS_RECORD_FLUSH_MS", "500")),
+    )
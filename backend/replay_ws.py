@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded /api/ws session against the in-process app.
+
+Input is a recording written with WS_RECORD_PATH (see recorder.py). Every
+recorded connection is reopened with its original framing and compression
+and reissues its inbound frames at the recorded offsets, divided by --speed
+(0 = back to back). Peer ids in 'to' fields are mapped onto the ids the
+replayed server hands out, and redacted SDPs/candidates are refilled with
+generated text of the original length.
+
+Recording and replay are reduced to the same latency profile: for each
+delivery, the time since the inbound frame that caused it:
+  join      join -> joined (includes join-queue wait)
+  fanout    text -> each room member's copy
+  signal    offer/answer/ICE -> the target peer
+  presence  join -> new-peer at each room member
+Recorded latencies are taken at the server (frame decoded to frame written),
+replayed ones at the in-process clients, so the two are not directly comparable:
+the report lists them side by side without a difference. --baseline compares the
+replay against the replay profile of an earlier --json result instead (same
+measurement point), e.g. before and after a change, and shows the deltas.
+
+Not replayed: resume (tokens are not recorded; the session simply stays on
+its socket), pong (answered live) and SFU negotiation (needs real media).
+
+Examples:
+  python backend/replay_ws.py ws-1234.ndjson
+  python backend/replay_ws.py ws-1234.ndjson --speed 10 --json before.json
+  python backend/replay_ws.py ws-1234.ndjson --speed 10 --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+# The in-memory store from bench_ws stands in for MongoDB; the URL is never dialled
+os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+
+from bench_ws import AsgiWebSocket, MemoryDatabase, decode_frame, summarize  # noqa: E402
+from codec import decode_json, encode_json  # noqa: E402
+from recorder import ICE_TYPES, SDP_TYPES, origin_of  # noqa: E402
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SKIPPED_TYPES = {"resume", "pong", "sfu-publish", "sfu-answer"}
+LATENCY_KINDS = ("join", "fanout", "signal", "presence")
+
+
+def load_session(path: str, index: int = -1) -> List[Dict[str, Any]]:
+    # A file holds one session per server start, each opened by a 'start' entry
+    sessions: List[List[Dict[str, Any]]] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = decode_json(line)
+            if entry.get("d") == "start" or not sessions:
+                sessions.append([])
+            if entry.get("d") != "start":
+                sessions[-1].append(entry)
+    if not sessions:
+        raise ValueError(f"{path}: empty recording")
+    return sessions[index]
+
+
+def latency_profile(entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    # Time from the inbound frame that caused each delivery; entries use the recorder's schema
+    last_in: Dict[Tuple[Any, Any], float] = {}
+    samples: Dict[str, List[float]] = {kind: [] for kind in LATENCY_KINDS}
+    for e in sorted(entries, key=lambda e: e["t"]):
+        direction, mtype = e.get("d"), e.get("y")
+        if direction == "i":
+            last_in[(e["c"], mtype)] = e["t"]
+            continue
+        if direction != "o":
+            continue
+        origin = e.get("f")
+        if mtype == "joined":
+            kind, cause = "join", last_in.get((e["c"], "join"))
+        elif mtype == "text":
+            kind, cause = "fanout", last_in.get((origin, "text"))
+        elif mtype in ("offer", "answer"):
+            kind, cause = "signal", last_in.get((origin, mtype))
+        elif mtype in ICE_TYPES:
+            # The server may batch single candidates and vice versa
+            causes = [last_in[(origin, t)] for t in ICE_TYPES if (origin, t) in last_in]
+            kind, cause = "signal", max(causes) if causes else None
+        elif mtype == "new-peer":
+            kind, cause = "presence", last_in.get((origin, "join"))
+        else:
+            continue
+        if cause is not None:
+            samples[kind].append((e["t"] - cause) / 1000)
+    return {kind: summarize(values) for kind, values in samples.items()}
+
+
+def frame_counts(entries: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "inbound": sum(1 for e in entries if e.get("d") == "i"),
+        "outbound": sum(1 for e in entries if e.get("d") == "o"),
+    }
+
+
+class ReplayPeer:
+    def __init__(self, alias: int, ws: AsgiWebSocket, binary: bool, replay: "Replay"):
+        self.alias = alias
+        self.ws = ws
+        self.binary = binary
+        self.replay = replay
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.ws.connect()
+        self.binary = self.binary and self.ws.subprotocol == "soundcore.msgpack"
+        self._reader = asyncio.create_task(self._read())
+
+    async def send(self, msg: Dict[str, Any]):
+        await self.ws.send(msgpack.packb(msg, use_bin_type=True) if self.binary else encode_json(msg))
+
+    async def _read(self):
+        try:
+            while True:
+                raw = await self.ws.recv()
+                self.replay.delivered(self, decode_frame(raw, self.binary))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def close(self):
+        await self.ws.close()
+        if self._reader:
+            self._reader.cancel()
+
+
+class Replay:
+    def __init__(self, app, speed: float, seed: int = 1):
+        self.app = app
+        self.speed = speed
+        self.rng = random.Random(seed)
+        # Replay's own log, in the recorder's schema
+        self.events: List[Dict[str, Any]] = []
+        # Recorded alias <-> id given out by the replayed server
+        self.ids: Dict[int, str] = {}
+        self.aliases: Dict[str, int] = {}
+        self.peers: Dict[int, ReplayPeer] = {}
+        # Recorded 'open' entries: framing and compression per connection
+        self.opened: Dict[int, Dict[str, Any]] = {}
+        self.skipped = 0
+        self._started = time.perf_counter()
+
+    def _now(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def delivered(self, peer: ReplayPeer, msg: Dict[str, Any]):
+        mtype = msg.get("type")
+        if mtype in ("joined", "resumed") and msg.get("selfId"):
+            self.ids[peer.alias] = msg["selfId"]
+            self.aliases[msg["selfId"]] = peer.alias
+        entry = {"t": self._now(), "c": peer.alias, "d": "o", "y": mtype}
+        origin = origin_of(msg)
+        if origin is not None:
+            entry["f"] = self.aliases.get(origin, origin)
+        self.events.append(entry)
+        if mtype == "ping":
+            asyncio.create_task(peer.send({"type": "pong"}))
+
+    def _filler(self, length: int) -> str:
+        # Stand-in for a redacted SDP or candidate: same length, SDP-like and not trivially compressible
+        lines = []
+        size = 0
+        while size < length:
+            line = (f"a=candidate:{self.rng.getrandbits(32)} 1 udp {self.rng.getrandbits(31)} "
+                    f"192.0.2.{self.rng.randrange(256)} {self.rng.randrange(1024, 65536)} typ host\r\n")
+            lines.append(line)
+            size += len(line)
+        return "".join(lines)[:length]
+
+    def _candidate(self, candidate: Any) -> Any:
+        if isinstance(candidate, dict) and isinstance(candidate.get("candidate"), int):
+            return {**candidate, "candidate": self._filler(candidate["candidate"])}
+        return candidate
+
+    def _restore(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        msg = dict(msg)
+        if isinstance(msg.get("to"), int):
+            # Target not (yet) joined in the replay: keep a dead id so the server answers peer-unavailable
+            msg["to"] = self.ids.get(msg["to"], f"replay-{msg['to']}")
+        mtype = msg.get("type")
+        sdp = msg.get("sdp")
+        if mtype in SDP_TYPES and isinstance(sdp, dict) and isinstance(sdp.get("sdp"), int):
+            msg["sdp"] = {**sdp, "sdp": self._filler(sdp["sdp"])}
+        elif mtype == "ice-candidate":
+            msg["candidate"] = self._candidate(msg.get("candidate"))
+        elif mtype == "ice-candidates" and isinstance(msg.get("candidates"), list):
+            msg["candidates"] = [self._candidate(c) for c in msg["candidates"]]
+        return msg
+
+    async def _peer(self, alias: int) -> ReplayPeer:
+        peer = self.peers.get(alias)
+        if peer is None:
+            opened = self.opened.get(alias, {})
+            binary = opened.get("p") == "msgpack" and msgpack is not None
+            path = "/api/ws" + ("?compress=deflate" if opened.get("z") else "")
+            ws = AsgiWebSocket(self.app, path, ["soundcore.msgpack"] if binary else [])
+            peer = self.peers[alias] = ReplayPeer(alias, ws, binary, self)
+            await peer.start()
+        return peer
+
+    async def run(self, entries: List[Dict[str, Any]]):
+        self._started = time.perf_counter()
+        for e in entries:
+            if self.speed > 0:
+                wait = e["t"] / self.speed - self._now()
+                if wait > 0:
+                    await asyncio.sleep(wait / 1000)
+            direction = e.get("d")
+            if direction == "open":
+                self.opened[e["c"]] = e
+            elif direction == "i":
+                msg = e.get("m")
+                if not isinstance(msg, dict) or msg.get("type") in SKIPPED_TYPES:
+                    self.skipped += 1
+                    continue
+                # Connections open lazily: one that only resumed another session never sends anything
+                peer = await self._peer(e["c"])
+                self.events.append({"t": self._now(), "c": e["c"], "d": "i", "y": msg.get("type")})
+                await peer.send(self._restore(msg))
+            elif direction == "close":
+                peer = self.peers.pop(e["c"], None)
+                if peer is not None:
+                    await peer.close()
+
+    async def close(self):
+        for peer in list(self.peers.values()):
+            await peer.close()
+        self.peers.clear()
+
+
+async def run(args) -> Dict[str, Any]:
+    entries = load_session(args.recording, args.session)
+    import server
+    server.db = MemoryDatabase()
+    await server.app.router.startup()
+
+    replay = Replay(server.app, args.speed, args.seed)
+    started = time.perf_counter()
+    await replay.run(entries)
+    # Let in-flight deliveries land
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+    await replay.close()
+    await server.app.router.shutdown()
+
+    recorded_s = entries[-1]["t"] / 1000 if entries else 0
+    return {
+        "config": {"recording": args.recording, "session": args.session, "speed": args.speed, "seed": args.seed},
+        "recorded": {"duration_s": round(recorded_s, 3), "frames": frame_counts(entries), "latency": latency_profile(entries)},
+        "replay": {
+            "duration_s": round(elapsed, 3),
+            "frames": frame_counts(replay.events),
+            "skipped": replay.skipped,
+            "latency": latency_profile(replay.events),
+        },
+    }
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    cfg, rec, rep = result["config"], result["recorded"], result["replay"]
+    speed = f"{cfg['speed']}x" if cfg["speed"] > 0 else "max speed"
+    print(f"=== replay of {cfg['recording']} ({rec['duration_s']}s recorded, {speed}) ===")
+    print(f"frames:    recorded in={rec['frames']['inbound']} out={rec['frames']['outbound']}  "
+          f"replay in={rep['frames']['inbound']} out={rep['frames']['outbound']} (skipped {rep['skipped']})")
+    # Deltas only between replays: recorded latencies are measured at the server, not the client
+    reference, label = (baseline["replay"]["latency"], "baseline") if baseline else (rec["latency"], "recorded@server")
+    for kind in LATENCY_KINDS:
+        a, b = reference[kind], rep["latency"][kind]
+        line = (f"{kind + ':':<10} {label} n={a['count']} p50={a['p50_ms']}ms p99={a['p99_ms']}ms | "
+                f"replay n={b['count']} p50={b['p50_ms']}ms p99={b['p99_ms']}ms")
+        if baseline and a["count"] and b["count"]:
+            line += f" | Δp50={b['p50_ms'] - a['p50_ms']:+.3f}ms Δp99={b['p99_ms'] - a['p99_ms']:+.3f}ms"
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded /api/ws session against the in-process app")
+    parser.add_argument("recording", help="NDJSON file written with WS_RECORD_PATH")
+    parser.add_argument("--session", type=int, default=-1, help="which server start in the file (default: last)")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression (1 = real time, 0 = no waits)")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds to wait for in-flight frames")
+    parser.add_argument("--seed", type=int, default=1, help="seed for refilled SDPs and candidates")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with the replay profile of an earlier --json result")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if args.speed < 0:
+        parser.error("--speed must not be negative")
+
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    logging.getLogger("server").setLevel(logging.WARNING)
+    # Replaying must not append to the recording being replayed
+    os.environ.pop("WS_RECORD_PATH", None)
+    result = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, baseline)
+        if args.json:
+            Path(args.json).write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
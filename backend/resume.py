@@ -0,0 +1,76 @@
+"""Session resume for /api/ws: tokens for joined peers and grace timers for disconnected ones."""
+import asyncio
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+class SessionStore:
+    """Resume tokens for joined peers and the grace timers of disconnected ones."""
+
+    def __init__(self, grace_ms: int, end_session: Callable[[Any], Awaitable[None]]):
+        self.grace = grace_ms / 1000
+        # end_session(conn) takes a peer whose grace ran out out of its room
+        self.end_session = end_session
+        # { token: [PeerConnection, expiry handle while parked, else None] }
+        self._sessions: Dict[str, List[Any]] = {}
+
+    def issue(self, conn) -> str | None:
+        # New token for `conn`, replacing any previous one
+        self.forget(conn)
+        if self.grace <= 0:
+            return None
+        token = secrets.token_urlsafe(18)
+        self._sessions[token] = [conn, None]
+        conn.resume_token = token
+        return token
+
+    def forget(self, conn):
+        entry = self._sessions.pop(conn.resume_token, None) if conn.resume_token else None
+        if entry and entry[1]:
+            entry[1].cancel()
+        conn.resume_token = None
+
+    def park(self, conn) -> bool:
+        # Socket gone: keep the peer in its room until the grace period runs out
+        entry = self._sessions.get(conn.resume_token) if conn.resume_token else None
+        if entry is None or conn.closed or not conn.room:
+            return False
+        conn.detach()
+        entry[1] = asyncio.get_running_loop().call_later(self.grace, self.expire, conn.resume_token)
+        return True
+
+    def claim(self, token: str):
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        conn = entry[0]
+        if conn.closed:
+            self.expire(token)
+            return None
+        if entry[1]:
+            entry[1].cancel()
+            entry[1] = None
+        return conn
+
+    def expire(self, token: str):
+        entry = self._sessions.pop(token, None)
+        if entry is None:
+            return
+        conn = entry[0]
+        conn.resume_token = None
+        conn.closed = True
+        conn.detach()
+        asyncio.create_task(self.end_session(conn))
+
+    def expire_parked(self) -> int:
+        # All sessions waiting for a resume, e.g. when nothing can reconnect here anymore
+        parked = [token for token, (_, handle) in self._sessions.items() if handle is not None]
+        for token in parked:
+            self.expire(token)
+        return len(parked)
+
+    def prune(self):
+        # Parked sessions whose buffer overflowed (slow consumer policy) cannot be resumed
+        for token, (conn, handle) in list(self._sessions.items()):
+            if handle is not None and conn.closed:
+                self.expire(token)
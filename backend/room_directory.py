@@ -0,0 +1,172 @@
+"""Room directory: occupancy and member names per room, kept up to date incrementally.
+
+The registry reports every join and leave (O(1) each); readers never touch the
+registry or its room locks. GET /api/rooms and /api/rooms/{room} serve cached,
+pre-serialized JSON tagged with the directory version, so polling dashboards
+cost a dict lookup and, at most once per refresh interval, one rebuild.
+Presence subscribers on /api/ws receive batched deltas of the rooms that
+changed, serialized once per flush for all subscribers that share a filter.
+
+Counts cover this worker's members, like the rest of the per-process state.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from codec import Frame, encode_json
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+presence_frames = Counter("signaling_presence_frames_total", "Presence updates queued for subscribers")
+directory_rebuilds = Counter("signaling_room_directory_rebuilds_total", "Rebuilds of the cached /api/rooms body")
+
+
+class RoomDirectory:
+    def __init__(self, refresh_ms: int = 1000, presence_ms: int = 250):
+        self.refresh_interval = refresh_ms / 1000
+        self.presence_interval = presence_ms / 1000
+        # { room: { user_id: name } }, changed only by joined()/left()
+        self._rooms: Dict[str, Dict[str, str]] = {}
+        self._room_versions: Dict[str, int] = {}
+        self.version = 0
+        # ETags carry a per-process epoch so workers and restarts never share one
+        self._epoch = uuid.uuid4().hex[:8]
+        # (version, built at, body, etag) for /api/rooms; { room: (version, body, etag) } for /api/rooms/{room}
+        self._listing: Tuple[int, float, bytes, str] | None = None
+        self._room_bodies: Dict[str, Tuple[int, bytes, str]] = {}
+        # Presence: subscriber -> room filter (None = every room), and rooms changed since the last flush
+        self._subscribers: Dict[Any, Optional[str]] = {}
+        self._changed: Set[str] = set()
+        self._send: Optional[Callable[[Any, Frame], bool]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, send: Callable[[Any, Frame], bool]):
+        # send(conn, frame) enqueues a frame on a connection
+        self._send = send
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    # ----------------------------
+    # Updates (called by the registry)
+    # ----------------------------
+    def _touch(self, room: str):
+        self.version += 1
+        self._room_versions[room] = self.version
+        self._changed.add(room)
+
+    def joined(self, room: str, user_id: str, name: str):
+        self._rooms.setdefault(room, {})[user_id] = name
+        self._touch(room)
+
+    def left(self, room: str, user_id: str):
+        members = self._rooms.get(room)
+        if members is None or members.pop(user_id, None) is None:
+            return
+        if not members:
+            del self._rooms[room]
+            self._room_bodies.pop(room, None)
+        self._touch(room)
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def _etag(self, version: int) -> str:
+        return f'W/"{self._epoch}-{version}"'
+
+    def listing(self) -> Tuple[bytes, str]:
+        # (body, etag) for every room; stale by up to the refresh interval while rooms churn
+        now = time.monotonic()
+        cached = self._listing
+        if cached is None or (cached[0] != self.version and now - cached[1] >= self.refresh_interval):
+            rooms = [{"room": name, "count": len(members)} for name, members in sorted(self._rooms.items())]
+            body = encode_json({
+                "version": self.version,
+                "rooms": rooms,
+                "total": {"rooms": len(rooms), "peers": sum(r["count"] for r in rooms)},
+            }).encode()
+            cached = self._listing = (self.version, now, body, self._etag(self.version))
+            directory_rebuilds.inc()
+        return cached[2], cached[3]
+
+    def room(self, room: str) -> Tuple[bytes, str] | None:
+        # (body, etag) for one room, None when it has no members
+        members = self._rooms.get(room)
+        if members is None:
+            return None
+        version = self._room_versions[room]
+        cached = self._room_bodies.get(room)
+        if cached is None or cached[0] != version:
+            body = encode_json({"version": version, **self._summary(room, members, True)}).encode()
+            cached = self._room_bodies[room] = (version, body, self._etag(version))
+        return cached[1], cached[2]
+
+    def _summary(self, room: str, members: Optional[Dict[str, str]], names: bool) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {"room": room, "count": len(members) if members else 0}
+        if names:
+            summary["members"] = sorted((members or {}).values())
+        return summary
+
+    # ----------------------------
+    # Presence subscriptions
+    # ----------------------------
+    def subscribe(self, conn, room: Optional[str] = None) -> Dict[str, Any]:
+        # Snapshot to send now; deltas follow. A room filter includes member names.
+        self._subscribers[conn] = room
+        if room is not None:
+            rooms = [self._summary(room, self._rooms.get(room), True)]
+        else:
+            rooms = [self._summary(name, members, False) for name, members in sorted(self._rooms.items())]
+        return {"type": "presence", "version": self.version, "room": room, "rooms": rooms}
+
+    def unsubscribe(self, conn):
+        self._subscribers.pop(conn, None)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.presence_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Presence flush failed: {e}")
+
+    def flush(self) -> int:
+        # One 'presence-update' per subscriber with the rooms changed since the last flush
+        changed, self._changed = self._changed, set()
+        if not changed or not self._subscribers:
+            return 0
+        rooms = sorted(changed)
+        frames: Dict[Optional[str], Frame | None] = {}
+        sent = 0
+        for conn, room in list(self._subscribers.items()):
+            if getattr(conn, "closed", False):
+                del self._subscribers[conn]
+                continue
+            if room not in frames:
+                if room is None:
+                    summaries = [self._summary(r, self._rooms.get(r), False) for r in rooms]
+                elif room in changed:
+                    summaries = [self._summary(room, self._rooms.get(room), True)]
+                else:
+                    summaries = []
+                frames[room] = Frame({"type": "presence-update", "version": self.version, "room": room,
+                                      "rooms": summaries}) if summaries else None
+            frame = frames[room]
+            if frame is not None and self._send(conn, frame):
+                sent += 1
+        presence_frames.inc(sent)
+        return sent
+
+
+def create_directory() -> RoomDirectory:
+    return RoomDirectory(
+        refresh_ms=int(os.environ.get("ROOM_DIRECTORY_REFRESH_MS", "1000")),
+        presence_ms=int(os.environ.get("PRESENCE_INTERVAL_MS", "250")),
+    )
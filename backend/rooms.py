@@ -0,0 +1,135 @@
+"""Room membership for /api/ws: per-room locks, copy-on-write member snapshots and a global peer index."""
+import asyncio
+import time
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Tuple
+
+from metrics import Histogram
+
+room_lock_wait_seconds = Histogram("signaling_room_lock_wait_seconds", "Time spent waiting for a room lock")
+room_lock_hold_seconds = Histogram("signaling_room_lock_hold_seconds", "Time a room lock is held")
+
+
+class Room:
+    __slots__ = ("name", "lock", "members")
+
+    def __init__(self, name: str):
+        self.name = name
+        # Serializes membership changes for this room only
+        self.lock = asyncio.Lock()
+        # Copy-on-write snapshot { user_id: PeerConnection }; replaced, never mutated,
+        # so readers (broadcasts, signaling lookups) need no lock
+        self.members: Mapping[str, Any] = MappingProxyType({})
+
+
+_EMPTY_MEMBERS: Mapping[str, Any] = MappingProxyType({})
+
+
+class RoomRegistry:
+    """Room membership with per-room locking.
+
+    Joins and leaves in unrelated rooms never wait on each other; reads go
+    through immutable member snapshots.
+    """
+
+    def __init__(self, directory=None):
+        self._rooms: Dict[str, Room] = {}
+        # Told about every membership change (RoomDirectory); never read back here
+        self.directory = directory
+        # Connection metadata: { user_id: { 'room': str, 'name': str } }
+        self.users_meta: Dict[str, Dict[str, Any]] = {}
+        # Global peer index: { user_id: (room, PeerConnection) } for O(1) signaling forwards
+        self._peers: Dict[str, Tuple[str, Any]] = {}
+
+    def room_count(self) -> int:
+        return len(self._rooms)
+
+    def members(self, room: str) -> Mapping[str, Any]:
+        r = self._rooms.get(room)
+        return r.members if r else _EMPTY_MEMBERS
+
+    def find_peer(self, user_id: str, room: str | None = None):
+        # room: only match a peer currently joined to that room
+        entry = self._peers.get(user_id)
+        if entry is None or (room is not None and entry[0] != room):
+            return None
+        return entry[1]
+
+    async def _locked_room(self, room: str) -> Room:
+        # The room may be retired (emptied and unlinked) while we wait on its lock; retry then
+        started = time.perf_counter()
+        while True:
+            r = self._rooms.get(room)
+            if r is None:
+                r = self._rooms[room] = Room(room)
+            await r.lock.acquire()
+            if self._rooms.get(room) is r:
+                room_lock_wait_seconds.observe(time.perf_counter() - started)
+                return r
+            r.lock.release()
+
+    async def join(self, room: str, user_id: str, conn, name: str) -> List[Dict[str, Any]]:
+        r = await self._locked_room(room)
+        acquired = time.perf_counter()
+        try:
+            # Build peers list before adding self
+            existing_peers = [
+                {"id": uid, "name": self.users_meta.get(uid, {}).get("name", f"User-{uid[:5]}")}
+                for uid in r.members.keys()
+            ]
+            for peer in existing_peers:
+                if r.members[peer["id"]].sfu:
+                    # Sends its audio through the SFU; an SFU joiner does not offer to it
+                    peer["sfu"] = True
+            members = dict(r.members)
+            members[user_id] = conn
+            r.members = MappingProxyType(members)
+            self.users_meta[user_id] = {"room": room, "name": name}
+            self._peers[user_id] = (room, conn)
+            if self.directory:
+                self.directory.joined(room, user_id, name)
+        finally:
+            r.lock.release()
+            room_lock_hold_seconds.observe(time.perf_counter() - acquired)
+        return existing_peers
+
+    async def leave(self, room: str, user_id: str) -> bool:
+        r = self._rooms.get(room)
+        if r is None:
+            self.users_meta.pop(user_id, None)
+            self._peers.pop(user_id, None)
+            return False
+        started = time.perf_counter()
+        await r.lock.acquire()
+        acquired = time.perf_counter()
+        room_lock_wait_seconds.observe(acquired - started)
+        try:
+            removed = user_id in r.members
+            if removed:
+                members = dict(r.members)
+                del members[user_id]
+                r.members = MappingProxyType(members)
+                if self.directory:
+                    self.directory.left(room, user_id)
+            # Metadata goes with membership in the same critical section
+            meta = self.users_meta.get(user_id)
+            if meta and meta.get("room") == room:
+                del self.users_meta[user_id]
+            entry = self._peers.get(user_id)
+            if entry and entry[0] == room:
+                del self._peers[user_id]
+            if not r.members and self._rooms.get(room) is r:
+                del self._rooms[room]
+        finally:
+            r.lock.release()
+            room_lock_hold_seconds.observe(time.perf_counter() - acquired)
+        return removed
+
+    def prune(self) -> int:
+        # Empty rooms are normally retired in leave(); drop any left behind, plus orphaned metadata
+        stale = [name for name, r in self._rooms.items() if not r.members and not r.lock.locked()]
+        for name in stale:
+            del self._rooms[name]
+        for user_id in [uid for uid in self.users_meta if uid not in self._peers]:
+            del self.users_meta[user_id]
+        return len(stale)
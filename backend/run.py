@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Entry point for the backend: uvicorn with the fastest event loop and parsers available.
+
+uvloop and httptools are used when installed and asyncio/h11 otherwise, so
+the same command works on every box; WebSockets use the `websockets`
+package, or wsproto when only that is installed. Equivalent to
+  uvicorn server:app --app-dir backend --loop uvloop --http httptools --ws-per-message-deflate false
+without failing when the extras are missing.
+
+Transport permessage-deflate is off while the server compresses large frames
+itself (WS_COMPRESSION=deflate, the default): browsers always negotiate it, so
+deflated frames would be compressed twice and every small ICE frame once.
+WS_PER_MESSAGE_DEFLATE=on|off overrides the choice.
+
+Examples:
+  python backend/run.py
+  HOST=127.0.0.1 PORT=8001 WEB_CONCURRENCY=4 python backend/run.py
+  python backend/run.py --profile   # print the selected runtime and exit
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def runtime_profile() -> Dict[str, str]:
+    return {
+        "loop": "uvloop" if available("uvloop") else "asyncio",
+        "http": "httptools" if available("httptools") else "h11",
+        "ws": "websockets" if available("websockets") else "wsproto",
+    }
+
+
+def per_message_deflate() -> bool:
+    # On (uvicorn's default) unless app-level deflate is opted into: frames would be compressed twice
+    setting = os.environ.get("WS_PER_MESSAGE_DEFLATE", "").strip().lower()
+    if setting:
+        return setting == "on"
+    return os.environ.get("WS_COMPRESSION", "off").strip().lower() != "deflate"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the FastAPI backend")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "info"))
+    parser.add_argument("--profile", action="store_true", help="print the selected runtime and exit")
+    args = parser.parse_args(argv)
+
+    profile = runtime_profile()
+    deflate = per_message_deflate()
+    print(f"runtime: loop={profile['loop']} http={profile['http']} ws={profile['ws']} "
+          f"permessage-deflate={'on' if deflate else 'off'}", file=sys.stderr)
+    if args.profile:
+        return 0
+
+    import uvicorn
+    uvicorn.run(
+        "server:app",
+        app_dir=str(Path(__file__).parent),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        ws_per_message_deflate=deflate,
+        **profile,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,46 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect
+import time
+# Import timing, reported at startup
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Dict, Set, Any
+from typing import List, Dict, Set, Any, Deque, Tuple
+from collections import deque
 import uuid
+import hmac
 from datetime import datetime, timezone
 import asyncio
-import json
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from admission import Admission
+from chat_log import ChatLog, new_message_id, utc_now
+from cluster_bus import create_bus
+from codec import (CompressionStats, Frame, decode_message, encode_json, is_candidate, is_sdp, select_subprotocol,
+                   SUBPROTOCOL_MSGPACK)
+from database import LazyMongo
+from drain import Drain
+from heartbeat import Heartbeat
+from ice import IceBatcher, IceConfig
+from join_scheduler import JoinScheduler
+from metrics import Counter, Gauge, Histogram, SIZE_BUCKETS, render as render_metrics
+from pagination import decode_cursor, encode_cursor
+from rate_limit import PER_PEER_RATE_TYPES, RateLimiter, TokenBucket, parse_rate, parse_rate_limits
+from recorder import create_recorder
+from resume import SessionStore
+from room_directory import create_directory
+from rooms import RoomRegistry
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection (kept intact per instructions)
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# MongoDB connection, created on first REST or chat history use; MONGO_URL is only needed then
 # DB name must come from environment only (no hardcoding)
-db_name = os.environ.get('DB_NAME', 'app')
-db = client[db_name]
+mongo = LazyMongo(os.environ.get('MONGO_URL'), os.environ.get('DB_NAME', 'app'))
+db = mongo
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -39,13 +59,37 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+# Status reads: oldest first by (timestamp, id), backed by an index of the same shape,
+# keyset-paginated and projected to the model's fields
+STATUS_SORT = [("timestamp", 1), ("id", 1)]
+STATUS_PROJECTION = {"_id": 0, "id": 1, "client_name": 1, "timestamp": 1}
+STATUS_PAGE_MAX = 1000
+STATUS_BULK_MAX = 1000
+STATUS_STREAM_BATCH = 500
+
+def status_filter(after: str | None) -> Dict[str, Any]:
+    if not after:
+        return {}
+    try:
+        ts, status_id = decode_cursor(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"$or": [{"timestamp": {"$gt": ts}}, {"timestamp": ts, "id": {"$gt": status_id}}]}
+
+def status_json(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # Plain dict instead of a StatusCheck per row; same JSON shape
+    return {"id": doc.get("id"), "client_name": doc.get("client_name"), "timestamp": doc["timestamp"].isoformat()}
+
 @api_router.get("/")
 async def root():
     return {"message": "Hello World"}
 
 @api_router.get("/health")
 async def health():
-    return {"ok": True, "time": datetime.now(timezone.utc).isoformat()}
+    # 503 while not ready (near capacity or event loop lagging) so load balancers steer new clients elsewhere
+    status = admission.status()
+    body = {"ok": True, "time": datetime.now(timezone.utc).isoformat(), **status}
+    return JSONResponse(body, status_code=200 if status["ready"] else 503)
 
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
@@ -54,44 +98,152 @@ async def create_status_check(input: StatusCheckCreate):
     await db.status_checks.insert_one(status_obj.model_dump())
     return status_obj
 
+@api_router.post("/status/bulk", response_model=List[StatusCheck])
+async def create_status_checks(inputs: List[StatusCheckCreate]):
+    # One insert_many round trip for a batch of checks (e.g. from a poller)
+    if len(inputs) > STATUS_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"at most {STATUS_BULK_MAX} status checks per request")
+    status_objs = [StatusCheck(client_name=i.client_name) for i in inputs]
+    if status_objs:
+        await db.status_checks.insert_many([s.model_dump() for s in status_objs], ordered=False)
+    return status_objs
+
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(limit: int = STATUS_PAGE_MAX, after: str | None = None):
+    # One page per call; when more rows follow, X-Next-Cursor holds the `after` for the next page
+    limit = max(1, min(limit, STATUS_PAGE_MAX))
+    cursor = db.status_checks.find(status_filter(after), STATUS_PROJECTION).sort(STATUS_SORT).limit(limit + 1)
+    docs = await cursor.to_list(limit + 1)
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return Response(encode_json([status_json(d) for d in docs]), media_type="application/json", headers=headers)
+
+@api_router.get("/status/stream")
+async def stream_status_checks(after: str | None = None, limit: int = 0):
+    # NDJSON, one status check per line, read off the cursor in batches so memory stays flat
+    cursor = db.status_checks.find(status_filter(after), STATUS_PROJECTION).sort(STATUS_SORT).batch_size(STATUS_STREAM_BATCH)
+    if limit > 0:
+        cursor = cursor.limit(limit)
+
+    async def lines():
+        chunk: List[str] = []
+        async for doc in cursor:
+            chunk.append(encode_json(status_json(doc)))
+            if len(chunk) >= STATUS_STREAM_BATCH:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+# ICE servers for clients, from env (comma-separated URLs for STUN/TURN). Parsed once at startup.
+# Example:
+# STUN_URLS=stun:stun.l.google.com:19302,stun:global.stun.twilio.com:3478
+# TURN_URLS=turn:turn.example.com:3478
+# TURN_USERNAME=user
+# TURN_CREDENTIAL=pass
+# With TURN_SECRET set, TURN credentials are minted per time window instead (coturn
+# use-auth-secret / REST API scheme) and stay valid for TURN_CREDENTIAL_TTL seconds;
+# TURN_USERNAME is then only the user part of "<expiry>:<user>".
+ice_servers_config = IceConfig(
+    os.environ.get("STUN_URLS", "").strip(),
+    os.environ.get("TURN_URLS", "").strip(),
+    os.environ.get("TURN_USERNAME", "").strip(),
+    os.environ.get("TURN_CREDENTIAL", "").strip(),
+    turn_secret=os.environ.get("TURN_SECRET", "").strip(),
+    credential_ttl=int(os.environ.get("TURN_CREDENTIAL_TTL", "86400")),
+)
 
-# Optional ICE servers endpoint for clients to fetch TURN/STUN from env
 @api_router.get("/ice")
-async def ice_config():
-    # Env options (comma-separated URLs for STUN/TURN)
-    # Example:
-    # STUN_URLS=stun:stun.l.google.com:19302,stun:global.stun.twilio.com:3478
-    # TURN_URLS=turn:turn.example.com:3478
-    # TURN_USERNAME=user
-    # TURN_CREDENTIAL=pass
-    stun_urls = os.environ.get("STUN_URLS", "").strip()
-    turn_urls = os.environ.get("TURN_URLS", "").strip()
-    turn_username = os.environ.get("TURN_USERNAME", "").strip()
-    turn_credential = os.environ.get("TURN_CREDENTIAL", "").strip()
-
-    ice_servers: List[Dict[str, Any]] = []
-    if stun_urls:
-        ice_servers.append({"urls": [u.strip() for u in stun_urls.split(',') if u.strip()]})
-    else:
-        # Default STUN
-        ice_servers.append({"urls": [
-            "stun:stun.l.google.com:19302",
-            "stun:global.stun.twilio.com:3478"
-        ]})
-
-    if turn_urls:
-        entry: Dict[str, Any] = {"urls": [u.strip() for u in turn_urls.split(',') if u.strip()]}
-        if turn_username:
-            entry["username"] = turn_username
-        if turn_credential:
-            entry["credential"] = turn_credential
-        ice_servers.append(entry)
-
-    return {"iceServers": ice_servers}
+async def ice_config(request: Request):
+    body, etag, max_age = ice_servers_config.response(time.time())
+    # Shared static config may sit in shared caches; minted credentials only in the browser's
+    visibility = "private" if ice_servers_config.secret else "public"
+    headers = {"ETag": etag, "Cache-Control": f"{visibility}, max-age={max_age}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@api_router.get("/ws/stats")
+async def ws_stats():
+    # Egress saved by app-level frame compression
+    return {"compression": compression_stats.snapshot()}
+
+def etag_response(request: Request, body: bytes, etag: str) -> Response:
+    # Clients revalidate every time; an unchanged body costs a 304
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@api_router.get("/rooms")
+async def list_rooms(request: Request):
+    # Active rooms and their occupancy on this worker, from the incrementally kept directory
+    body, etag = room_directory.listing()
+    return etag_response(request, body, etag)
+
+@api_router.get("/rooms/{room}")
+async def room_info(room: str, request: Request):
+    entry = room_directory.room(room)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="room not found")
+    return etag_response(request, *entry)
+
+@api_router.get("/rooms/{room}/messages")
+async def room_messages(room: str, limit: int = 50, before: str | None = None):
+    # Chat history, oldest first; pass `next` back as `before` for the previous page
+    limit = max(1, min(limit, CHAT_HISTORY_PAGE_MAX))
+    try:
+        messages, next_cursor = await chat_log.history(room, limit, before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"room": room, "messages": messages, "next": next_cursor}
+
+@api_router.get("/sfu/stats")
+async def sfu_stats():
+    # Per-room forwarding counters (SFU_MODE=on)
+    return {"enabled": sfu is not None, "rooms": sfu.stats() if sfu else {}}
+
+class DrainRequest(BaseModel):
+    window_ms: int | None = Field(None, ge=0)
+    target: str | None = None
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="unauthorized")
+
+@api_router.post("/admin/drain")
+async def start_drain(request: Request, body: DrainRequest | None = None):
+    # Drain without exiting (e.g. before taking the instance out of rotation); DELETE undoes it
+    require_admin(request)
+    body = body or DrainRequest()
+    window = body.window_ms / 1000 if body.window_ms is not None else None
+    if not drain.start(window, body.target):
+        return JSONResponse(drain.status(), status_code=409)
+    return JSONResponse(drain.status(), status_code=202)
+
+@api_router.get("/admin/drain")
+async def drain_status(request: Request):
+    require_admin(request)
+    return drain.status()
+
+@api_router.delete("/admin/drain")
+async def cancel_drain(request: Request):
+    require_admin(request)
+    if not drain.cancel():
+        return JSONResponse(drain.status(), status_code=409)
+    return drain.status()
+
+@api_router.get("/metrics")
+async def metrics():
+    # Prometheus text exposition; per process, so scrape every worker
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -105,6 +257,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -117,147 +270,843 @@ logger = logging.getLogger(__name__)
 # ----------------------------
 # WebSocket Signaling Server (/api/ws)
 # ----------------------------
-# Room structure: { room: { user_id: websocket } }
-rooms: Dict[str, Dict[str, WebSocket]] = {}
-# Connection metadata: { user_id: { 'room': str, 'name': str } }
-users_meta: Dict[str, Dict[str, Any]] = {}
-# Lock for concurrency
-rooms_lock = asyncio.Lock()
-
-async def send_json(ws: WebSocket, data: Dict[str, Any]):
+# Outbound queue settings (per connection)
+# WS_SEND_QUEUE_SIZE: max frames waiting to be written to one socket
+# WS_SEND_OVERFLOW_POLICY: drop_oldest | coalesce | disconnect
+WS_SEND_QUEUE_SIZE = max(1, int(os.environ.get("WS_SEND_QUEUE_SIZE", "256")))
+WS_SEND_OVERFLOW_POLICY = os.environ.get("WS_SEND_OVERFLOW_POLICY", "drop_oldest").strip().lower()
+# Chat can be shed under pressure; signaling frames never are
+DROPPABLE_TYPES = {"text"}
+# Where offer/answer/ice-candidate may be forwarded: any (cross-room) | room (same room only)
+WS_SIGNAL_SCOPE = os.environ.get("WS_SIGNAL_SCOPE", "any").strip().lower()
+# Opt-in app-level deflate of large frames (SDP offers/answers, big peer lists) for clients
+# that connect with ?compress=deflate. Unlike transport permessage-deflate (on by default)
+# it skips tiny ICE frames, trading egress for CPU: use it only where CPU is the bottleneck.
+WS_COMPRESSION = os.environ.get("WS_COMPRESSION", "off").strip().lower()
+WS_COMPRESS_MIN_BYTES = int(os.environ.get("WS_COMPRESS_MIN_BYTES", "1024"))
+WS_COMPRESS_LEVEL = int(os.environ.get("WS_COMPRESS_LEVEL", "6"))
+UNCOMPRESSED_TYPES = {"ice-candidate"}
+# Server-side ICE coalescing for clients that announce the 'ice-batch' feature:
+# candidates per (from, to) pair are held up to this long, then sent as one
+# 'ice-candidates' frame. 0 disables the window (batches are still passed through).
+ICE_BATCH_WINDOW_MS = int(os.environ.get("ICE_BATCH_WINDOW_MS", "0"))
+ICE_BATCH_MAX = int(os.environ.get("ICE_BATCH_MAX", "32"))
+# Join-storm pacing. JOIN_MAX_NEGOTIATIONS > 0 caps how many joiners per room may be
+# negotiating (offers out, answers pending) at once; later joiners wait in FIFO order
+# and get 'join-queued'. A slot frees when every peer has answered or after the timeout.
+JOIN_MAX_NEGOTIATIONS = int(os.environ.get("JOIN_MAX_NEGOTIATIONS", "0"))
+JOIN_NEGOTIATION_TIMEOUT_MS = int(os.environ.get("JOIN_NEGOTIATION_TIMEOUT_MS", "10000"))
+# JOIN_STAGGER_MS > 0 sends new-peer to JOIN_STAGGER_BATCH members per interval and
+# passes the interval to the joiner ('paceMs') to space out its offers
+JOIN_STAGGER_MS = int(os.environ.get("JOIN_STAGGER_MS", "0"))
+JOIN_STAGGER_BATCH = int(os.environ.get("JOIN_STAGGER_BATCH", "4"))
+# Heartbeat: every WS_HEARTBEAT_INTERVAL_MS the sweeper pings all sockets ({'type':'ping'},
+# answered with 'pong') and evicts peers silent for longer than WS_IDLE_TIMEOUT_MS.
+# Any inbound frame counts as a sign of life. Only sockets that have answered a ping are
+# evicted: older clients never pong and go quiet once their call is set up, and must not
+# be dropped for it. 0 disables the sweeper / the eviction.
+WS_HEARTBEAT_INTERVAL_MS = int(os.environ.get("WS_HEARTBEAT_INTERVAL_MS", "20000"))
+WS_IDLE_TIMEOUT_MS = int(os.environ.get("WS_IDLE_TIMEOUT_MS", "60000"))
+# Session resume: 'joined' carries a resumeToken. For WS_RESUME_GRACE_MS after a disconnect
+# the peer stays in its room and frames for it are buffered (bounded by the send queue);
+# a reconnect sending {type:'resume', token} reattaches to the same user_id and receives
+# the backlog, without leave/new-peer broadcasts. 0 disables resume.
+WS_RESUME_GRACE_MS = int(os.environ.get("WS_RESUME_GRACE_MS", "10000"))
+# Chat history in Mongo (collection chat_messages): on | off. Writes are buffered and
+# inserted in batches of up to CHAT_HISTORY_BATCH every CHAT_HISTORY_FLUSH_MS.
+# A join with history:N gets the last N (<= CHAT_HISTORY_PAGE_MAX) messages in a 'history'
+# frame sent after 'joined', so the join never waits on the database.
+CHAT_HISTORY = os.environ.get("CHAT_HISTORY", "on").strip().lower() == "on"
+CHAT_HISTORY_FLUSH_MS = int(os.environ.get("CHAT_HISTORY_FLUSH_MS", "200"))
+CHAT_HISTORY_BATCH = int(os.environ.get("CHAT_HISTORY_BATCH", "100"))
+CHAT_HISTORY_BUFFER = int(os.environ.get("CHAT_HISTORY_BUFFER", "10000"))
+CHAT_HISTORY_PAGE_MAX = int(os.environ.get("CHAT_HISTORY_PAGE_MAX", "100"))
+# Inbound rate limits as 'type=rate:burst,...' (messages per second, bucket size); '*' covers
+# every other type. WS_RATE_LIMITS is per connection, WS_ROOM_RATE_LIMITS per room (summed
+# over all members on this worker). Empty disables. A throttled frame is answered with an
+# error frame; over its own (per-connection) limit it also costs a strike, and a connection
+# out of strikes (WS_RATE_LIMIT_STRIKES, refilled at the given rate) is closed with 1008.
+# Signaling limits (PER_PEER_RATE_TYPES) are per peer in the sender's room: a joiner offering
+# to 49 peers gets 49 times the rate and burst, so the defaults hold at any WS_MAX_ROOM_SIZE.
+WS_RATE_LIMITS = os.environ.get(
+    "WS_RATE_LIMITS",
+    "text=5:20,offer=0.5:3,answer=0.5:3,ice-candidate=5:30,ice-candidates=1:6,join=1:5,*=20:50",
+)
+WS_ROOM_RATE_LIMITS = os.environ.get("WS_ROOM_RATE_LIMITS", "text=30:60")
+WS_RATE_LIMIT_STRIKES = os.environ.get("WS_RATE_LIMIT_STRIKES", "0.1:10")
+# Inbound frames larger than this are rejected before decoding
+WS_MAX_FRAME_BYTES = int(os.environ.get("WS_MAX_FRAME_BYTES", "65536"))
+# Admission control per process (0 = unlimited). Over the limit a socket gets a 'server-busy'
+# error and is closed with 1013, a join gets 'room-full' / 'server-busy'; both carry retryMs
+# (WS_BUSY_RETRY_MS, jittered). /api/health turns 503 once load (the highest of
+# connections/max, rooms/max) reaches WS_READY_LOAD or the event loop lags more than
+# WS_READY_MAX_LAG_MS.
+WS_MAX_CONNECTIONS = int(os.environ.get("WS_MAX_CONNECTIONS", "0"))
+WS_MAX_ROOMS = int(os.environ.get("WS_MAX_ROOMS", "0"))
+WS_MAX_ROOM_SIZE = int(os.environ.get("WS_MAX_ROOM_SIZE", "0"))
+WS_BUSY_RETRY_MS = int(os.environ.get("WS_BUSY_RETRY_MS", "5000"))
+WS_READY_LOAD = float(os.environ.get("WS_READY_LOAD", "0.9"))
+WS_READY_MAX_LAG_MS = int(os.environ.get("WS_READY_MAX_LAG_MS", "200"))
+# Graceful drain, on SIGTERM (WS_DRAIN_ON_SIGTERM) or POST /api/admin/drain: /api/health turns 503,
+# new sockets and joins get a 'reconnect' hint, and every connected peer is sent
+# {type:'reconnect', delayMs, target?}. Rooms get staggered slots across WS_DRAIN_WINDOW_MS and
+# members of a room share one, so each room re-forms on the next instance in one go; sockets
+# still open WS_DRAIN_CLOSE_GRACE_MS after their slot are closed with 1012. WS_DRAIN_TARGET is an
+# optional WebSocket URL to reconnect to (default: the same URL, i.e. the load balancer).
+# After a SIGTERM drain the process exits; a second SIGTERM exits right away.
+WS_DRAIN_WINDOW_MS = int(os.environ.get("WS_DRAIN_WINDOW_MS", "20000"))
+WS_DRAIN_CLOSE_GRACE_MS = int(os.environ.get("WS_DRAIN_CLOSE_GRACE_MS", "2000"))
+WS_DRAIN_TARGET = os.environ.get("WS_DRAIN_TARGET", "").strip()
+WS_DRAIN_ON_SIGTERM = os.environ.get("WS_DRAIN_ON_SIGTERM", "on").strip().lower() == "on"
+# Bearer token for /api/admin/*; the admin endpoints answer 404 while unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "").strip()
+compression_stats = CompressionStats()
+chat_log = ChatLog(CHAT_HISTORY_FLUSH_MS, CHAT_HISTORY_BATCH, CHAT_HISTORY_BUFFER)
+
+# ----------------------------
+# Metrics (/api/metrics)
+# ----------------------------
+# Inbound types are labelled from a fixed set so clients cannot blow up label cardinality
+MESSAGE_TYPES = ("join", "resume", "offer", "answer", "ice-candidate", "ice-candidates", "text", "leave", "ping", "pong",
+                 "sfu-publish", "sfu-answer", "presence-subscribe", "presence-unsubscribe", "invalid", "other")
+ws_connections = Gauge("signaling_ws_connections", "Open /api/ws connections")
+ws_messages = Counter("signaling_ws_messages_received_total", "Inbound /api/ws messages by type", ["type"])
+ws_messages_by_type = {t: ws_messages.labels(t) for t in MESSAGE_TYPES}
+ws_handle_seconds = Histogram("signaling_ws_message_handle_seconds", "Time to handle one inbound message")
+ws_frames_enqueued = Counter("signaling_ws_frames_enqueued_total", "Outbound frames accepted into send queues")
+ws_frames_sent = Counter("signaling_ws_frames_sent_total", "Outbound frames written to sockets")
+ws_frames_dropped = Counter("signaling_ws_frames_dropped_total", "Outbound frames shed by the overflow policy or not encodable",
+                            ["reason"])
+ws_dropped_coalesced = ws_frames_dropped.labels("coalesced")
+ws_dropped_overflow = ws_frames_dropped.labels("overflow")
+ws_dropped_unencodable = ws_frames_dropped.labels("unencodable")
+ws_slow_consumers = Counter("signaling_ws_slow_consumer_disconnects_total", "Connections closed for a full send queue")
+ws_resumes = Counter("signaling_ws_resumes_total", "Resume attempts by outcome", ["outcome"])
+ws_throttled = Counter("signaling_ws_throttled_total", "Inbound frames rejected by rate or size limits", ["scope"])
+ws_throttled_connection = ws_throttled.labels("connection")
+ws_throttled_room = ws_throttled.labels("room")
+ws_throttled_size = ws_throttled.labels("size")
+ws_rate_limit_disconnects = Counter("signaling_ws_rate_limit_disconnects_total", "Connections closed after running out of strikes")
+ws_rejected = Counter("signaling_ws_admission_rejected_total", "Connections and joins refused by admission control", ["reason"])
+ws_send_errors = Counter("signaling_ws_send_errors_total", "Socket writes that failed")
+ws_queue_depth = Histogram("signaling_ws_send_queue_depth", "Send queue depth seen by each enqueue", SIZE_BUCKETS)
+ws_send_seconds = Histogram("signaling_ws_send_seconds", "Time to write one frame to a socket")
+broadcast_seconds = Histogram("signaling_broadcast_seconds", "Time to fan a room broadcast out to local send queues")
+broadcast_recipients = Histogram("signaling_broadcast_recipients", "Local recipients per room broadcast", SIZE_BUCKETS)
+Gauge("signaling_rooms", "Rooms with members on this worker", fn=lambda: registry.room_count())
+Gauge("signaling_event_loop_lag_seconds", "Smoothed event loop scheduling delay", fn=lambda: admission.lag)
+Gauge("signaling_ready", "1 while /api/health reports ready", fn=lambda: int(admission.status()["ready"]))
+Gauge("signaling_draining", "1 while the process is draining connections", fn=lambda: int(admission.draining))
+Gauge("signaling_compression_raw_bytes_total", "Payload bytes of deflated frames before compression",
+      fn=lambda: compression_stats.raw_bytes, kind="counter")
+Gauge("signaling_compression_wire_bytes_total", "Bytes of deflated frames on the wire",
+      fn=lambda: compression_stats.wire_bytes, kind="counter")
+import_seconds = Gauge("signaling_import_seconds", "Time to import the server module")
+startup_seconds = Gauge("signaling_startup_seconds", "Time spent in startup hooks")
+
+class PeerConnection:
+    """Accepted socket plus a bounded outbound queue drained by its own writer task.
+
+    Senders only enqueue, so a slow consumer delays nobody but itself.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, binary: bool = False, compress: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        # MessagePack binary frames instead of JSON text (negotiated subprotocol)
+        self.binary = binary
+        # Client accepts deflated binary frames above WS_COMPRESS_MIN_BYTES
+        self.compress = compress
+        # Client understands batched 'ice-candidates' frames (announced in join)
+        self.ice_batch = False
+        # Client applies the lower-id-offers rule to peers flagged for it (features: ['offer-order'])
+        self.offer_order = False
+        # Chat messages to send after 'joined' (join option history:N)
+        self.history_limit = 0
+        # Audio goes through the server's SFU instead of the mesh (features: ['sfu'])
+        self.sfu = False
+        # Room members (all nodes) when this peer joined; scales its signaling rate limits
+        self.room_peers = 0
+        # Session state: current room and display name; queued_room while waiting for admission
+        self.room: str | None = None
+        self.name: str | None = None
+        self.queued_room: str | None = None
+        self.dropped = 0
+        self.closed = False
+        # Monotonic time of the last inbound frame (heartbeat deadline)
+        self.last_seen = time.monotonic()
+        # Answered a heartbeat ping at least once; only such clients are evicted for silence
+        self.pongs = False
+        # Set while the session can be resumed from another socket
+        self.resume_token: str | None = None
+        # Inbound rate limiting: { message type or '*': bucket } and the strike bucket
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.strikes: TokenBucket | None = None
+        self._queue: Deque[Tuple[str | None, Frame]] = deque()
+        self._wakeup = asyncio.Event()
+        self._writer: asyncio.Task | None = None
+        self._aborting: asyncio.Task | None = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._drain())
+
+    def send(self, data: Dict[str, Any] | Frame, key: str | None = None) -> bool:
+        # key: frames sharing a key supersede each other under the coalesce policy
+        if self.closed:
+            return False
+        frame = data if isinstance(data, Frame) else Frame(data)
+        if len(self._queue) >= WS_SEND_QUEUE_SIZE and not self._make_room(frame, key):
+            return False
+        self._queue.append((key, frame))
+        self._wakeup.set()
+        ws_frames_enqueued.inc()
+        ws_queue_depth.observe(len(self._queue))
+        return True
+
+    def _make_room(self, frame: Frame, key: str | None) -> bool:
+        policy = WS_SEND_OVERFLOW_POLICY
+        if policy == "coalesce" and key is not None:
+            for i, (queued_key, _) in enumerate(self._queue):
+                if queued_key == key:
+                    del self._queue[i]
+                    self.dropped += 1
+                    ws_dropped_coalesced.inc()
+                    return True
+        if policy in ("drop_oldest", "coalesce"):
+            for i, (_, queued) in enumerate(self._queue):
+                if queued.type in DROPPABLE_TYPES:
+                    del self._queue[i]
+                    self.dropped += 1
+                    ws_dropped_overflow.inc()
+                    return True
+            if frame.type in DROPPABLE_TYPES:
+                # Queue is all signaling; shed the new chat frame instead
+                self.dropped += 1
+                ws_dropped_overflow.inc()
+                return False
+        logger.warning(f"Disconnecting slow consumer {self.user_id} ({len(self._queue)} frames queued)")
+        ws_slow_consumers.inc()
+        self.abort(1013, "slow consumer")
+        return False
+
+    async def _drain(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                # Popped only once written: a frame cut off by a disconnect stays queued for a resume
+                frame = self._queue[0][1]
+                started = time.perf_counter()
+                try:
+                    wire = self._encode(frame)
+                except (TypeError, ValueError, OverflowError) as e:
+                    # One bad frame must not stop the writer (it would stay at the head of the queue)
+                    if self._queue and self._queue[0][1] is frame:
+                        self._queue.popleft()
+                    ws_dropped_unencodable.inc()
+                    logger.warning(f"Dropping unencodable '{frame.type}' frame for {self.user_id}: {e}")
+                    continue
+                if isinstance(wire, bytes):
+                    await self.websocket.send_bytes(wire)
+                else:
+                    await self.websocket.send_text(wire)
+                if self._queue and self._queue[0][1] is frame:
+                    self._queue.popleft()
+                ws_send_seconds.observe(time.perf_counter() - started)
+                ws_frames_sent.inc()
+                if recorder:
+                    recorder.outbound(self, frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ws_send_errors.inc()
+            if self.resume_token is not None:
+                # Keep the backlog; it is replayed if the client resumes
+                logger.info(f"Socket of {self.user_id} failed, holding {len(self._queue)} frames for resume: {e}")
+                return
+            logger.warning(f"Failed to send WS message: {e}")
+            self.closed = True
+            self._queue.clear()
+
+    def _encode(self, frame: Frame) -> str | bytes:
+        # Wire form of `frame` for this connection's framing and compression
+        if self.compress and frame.type not in UNCOMPRESSED_TYPES:
+            raw_size, deflated = frame.deflated(self.binary, WS_COMPRESS_MIN_BYTES, WS_COMPRESS_LEVEL)
+            if deflated is not None:
+                compression_stats.record(raw_size, len(deflated))
+                return deflated
+        return frame.packed() if self.binary else frame.text()
+
+    def abort(self, code: int = 1000, reason: str = ""):
+        # Close from outside the receive loop; the endpoint sees the disconnect and cleans up
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        if self._writer:
+            self._writer.cancel()
+        self._aborting = asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int = 1000, reason: str = "", websocket: WebSocket | None = None):
+        try:
+            await (websocket or self.websocket).close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def detach(self):
+        # Stop writing but keep the queue; frames keep buffering until attach()
+        if self._writer:
+            self._writer.cancel()
+            self._writer = None
+
+    def attach(self, websocket: WebSocket, binary: bool, compress: bool, greeting: Dict[str, Any]):
+        # Move the session onto a new socket; `greeting` goes out ahead of the buffered frames
+        previous = self.websocket
+        self.detach()
+        self.websocket, self.binary, self.compress = websocket, binary, compress
+        self.last_seen = time.monotonic()
+        self._queue.appendleft((None, Frame(greeting)))
+        self.start()
+        if previous is not websocket:
+            # The old socket may still look open (half-open TCP); its endpoint loop exits without cleanup
+            asyncio.create_task(self._close_socket(1000, "resumed", previous))
+
+    async def close(self):
+        self.closed = True
+        self._queue.clear()
+        if self._writer:
+            self._writer.cancel()
+        if self._aborting:
+            # Keep the abort's close code
+            await self._aborting
+        else:
+            await self._close_socket()
+
+# Occupancy for /api/rooms and presence subscribers, updated by the registry on every change
+room_directory = create_directory()
+registry = RoomRegistry(room_directory)
+# Relays membership, broadcasts and forwards between workers/hosts (CLUSTER_BUS)
+bus = create_bus()
+# Server-side audio forwarding for clients that opt in (SFU_MODE=on); None in mesh-only mode.
+# aiortc is slow to import, so only SFU_MODE=on loads it.
+if os.environ.get("SFU_MODE", "off").strip().lower() == "on":
+    from sfu import create_sfu
+    sfu = create_sfu()
+else:
+    sfu = None
+# Opt-in capture of /api/ws traffic for replay_ws.py (WS_RECORD_PATH); None when off
+recorder = create_recorder()
+
+def send_json(conn: PeerConnection, data: Dict[str, Any] | Frame, key: str | None = None) -> bool:
+    return conn.send(data, key)
+
+def fanout_local(room: str, data: Dict[str, Any], exclude: Set[str] | None = None, key: str | None = None) -> int:
+    exclude = exclude or set()
+    # Lock-free: members() is an immutable snapshot
+    targets = [conn for uid, conn in registry.members(room).items() if uid not in exclude]
+    # Enqueue only; each connection's writer task does the actual send.
+    # One Frame for all targets, so the payload is serialized once.
+    frame = Frame(data)
+    for conn in targets:
+        send_json(conn, frame, key)
+    return len(targets)
+
+def deliver_to_peer(user_id: str, data: Dict[str, Any]):
+    # Targeted frame relayed by the cluster bus for a peer on this node
+    conn = registry.find_peer(user_id)
+    if conn is not None:
+        send_json(conn, data)
+        if data.get("type") == "answer" and data.get("from"):
+            join_scheduler.answered(data["from"], conn)
+
+ice_batcher = IceBatcher(ICE_BATCH_WINDOW_MS, ICE_BATCH_MAX)
+
+def ice_candidates_of(msg: Dict[str, Any]) -> Tuple[List[Any], bool]:
+    # (candidates, end-of-candidates) from an 'ice-candidate' or 'ice-candidates' message;
+    # a null candidate or end:true marks the end of gathering
+    if msg.get("type") == "ice-candidate":
+        candidate = msg.get("candidate")
+        return ([candidate] if candidate else []), not candidate
+    candidates = msg.get("candidates")
+    if not isinstance(candidates, list):
+        candidates = []
+    return [c for c in candidates if c], bool(msg.get("end"))
+
+def forward_ice(from_id: str, target: PeerConnection, candidates: List[Any], end: bool):
+    if not target.ice_batch:
+        for candidate in candidates:
+            send_json(target, {"type": "ice-candidate", "from": from_id, "candidate": candidate})
+    elif ICE_BATCH_WINDOW_MS > 0:
+        ice_batcher.add(from_id, target, candidates, end)
+    elif candidates:
+        send_json(target, {"type": "ice-candidates", "from": from_id, "candidates": candidates})
+
+async def broadcast_room(room: str, data: Dict[str, Any], exclude: Set[str] | None = None, key: str | None = None,
+                         remote: Dict[str, Any] | None = None):
+    # remote: what members on other nodes get instead of `data`, when it differs
+    started = time.perf_counter()
+    broadcast_recipients.observe(fanout_local(room, data, exclude, key))
+    bus.publish_room(room, data if remote is None else remote, exclude or (), key)
+    broadcast_seconds.observe(time.perf_counter() - started)
+
+async def join_room(conn: PeerConnection, room: str, name: str):
+    user_id = conn.user_id
+    conn.room, conn.name, conn.queued_room = room, name, None
+    existing_peers = await registry.join(room, user_id, conn, name)
+    if conn.room != room:
+        # Disconnected or moved on while we waited for the room lock (queued admissions run as tasks)
+        await registry.leave(room, user_id)
+        return
+    # Register before reading remote members: of two peers joining on different nodes at once,
+    # at least one then sees the other. Both may, so for remote pairs where both clients
+    # follow the offer-order rule, the lower id offers and the other waits ('offer': false)
+    await bus.register(room, user_id, name, conn.offer_order)
+    for peer in await bus.remote_members(room):
+        if peer.pop("offerOrder", False) and conn.offer_order:
+            peer["offer"] = user_id < peer["id"]
+        existing_peers.append(peer)
+    conn.room_peers = len(existing_peers)
+    # SFU joiners still offer to mesh members (including every member on other nodes), just not to SFU ones
+    offers = [p["id"] for p in existing_peers if p.get("offer", True) and not (conn.sfu and p.get("sfu"))]
+    join_scheduler.started(room, user_id, offers)
+    # Ack self with peer list and selfId
+    joined = {"type": "joined", "selfId": user_id, "peers": existing_peers}
+    token = sessions.issue(conn)
+    if token:
+        joined["resumeToken"] = token
+        joined["resumeWindowMs"] = WS_RESUME_GRACE_MS
+    if JOIN_STAGGER_MS > 0:
+        # Hint for the joiner to space out its offers
+        joined["paceMs"] = JOIN_STAGGER_MS
+    if conn.sfu:
+        # Publish one upstream track to the server; mesh peers ('sfu' unset) still get offers
+        joined["sfu"] = True
+    send_json(conn, joined)
+    if conn.history_limit and chat_log.enabled:
+        # Follow-up frame: a slow database must not hold up the join or the new-peer broadcast
+        asyncio.create_task(send_history(conn, room, conn.history_limit))
+    # Notify others in room about new peer
+    new_peer = {"type": "new-peer", "id": user_id, "name": name}
+    # Members on other nodes may have raced this join; 'offerOrder' tells them to offer if their id is lower.
+    # The SFU is per node, so only local members see the 'sfu' flag: remote pairs always use the mesh
+    remote_new_peer = {**new_peer, "offerOrder": True} if conn.offer_order else new_peer
+    if conn.sfu:
+        new_peer = {**new_peer, "sfu": True}
+    if JOIN_STAGGER_MS > 0:
+        bus.publish_room(room, remote_new_peer, (user_id,), f"peer:{user_id}")
+        asyncio.create_task(stagger_new_peer(conn, room, new_peer))
+    else:
+        await broadcast_room(room, new_peer, exclude={user_id}, key=f"peer:{user_id}", remote=remote_new_peer)
+    if conn.sfu:
+        # Downstream tracks of the room's current publishers
+        await sfu.join(room, user_id, lambda data: send_json(conn, data))
+
+async def send_history(conn: PeerConnection, room: str, limit: int):
+    # {type:'history', room, messages (oldest first), next}, same shape as GET /api/rooms/{room}/messages
     try:
-        await ws.send_text(json.dumps(data))
+        messages, next_cursor = await chat_log.history(room, limit)
     except Exception as e:
-        logger.warning(f"Failed to send WS message: {e}")
+        logger.warning(f"Chat history for join failed: {e}")
+        messages, next_cursor = [], None
+    if conn.room != room:
+        # Left while history loaded
+        return
+    send_json(conn, {"type": "history", "room": room, "messages": messages, "next": next_cursor})
 
-async def broadcast_room(room: str, data: Dict[str, Any], exclude: Set[str] | None = None):
-    exclude = exclude or set()
-    async with rooms_lock:
-        peers = rooms.get(room, {})
-        targets = [(uid, ws) for uid, ws in peers.items() if uid not in exclude]
-    for uid, ws in targets:
-        await send_json(ws, data)
+async def stagger_new_peer(conn: PeerConnection, room: str, data: Dict[str, Any]):
+    # Announce the joiner to local members a few at a time instead of all at once
+    frame = Frame(data)
+    targets = [c for uid, c in registry.members(room).items() if uid != conn.user_id]
+    for i in range(0, len(targets), max(1, JOIN_STAGGER_BATCH)):
+        if registry.find_peer(conn.user_id, room) is not conn:
+            # Joiner already left; a late new-peer would follow its leave
+            return
+        for target in targets[i:i + JOIN_STAGGER_BATCH]:
+            send_json(target, frame, f"peer:{conn.user_id}")
+        await asyncio.sleep(JOIN_STAGGER_MS / 1000)
+
+async def leave_room(conn: PeerConnection):
+    sessions.forget(conn)
+    join_scheduler.forget(conn)
+    room = conn.room
+    if not room:
+        return
+    conn.room, conn.room_peers = None, 0
+    if conn.sfu:
+        await sfu.leave(room, conn.user_id)
+    await registry.leave(room, conn.user_id)
+    await bus.unregister(room, conn.user_id)
+    await broadcast_room(room, {"type": "leave", "id": conn.user_id}, key=f"peer:{conn.user_id}")
+
+# Admitted waiters run join_room themselves
+join_scheduler = JoinScheduler(JOIN_MAX_NEGOTIATIONS, JOIN_NEGOTIATION_TIMEOUT_MS, join_room)
+
+async def end_session(conn: PeerConnection):
+    if recorder:
+        recorder.closed(conn)
+    room_directory.unsubscribe(conn)
+    await leave_room(conn)
+    registry.users_meta.pop(conn.user_id, None)
+
+admission = Admission(WS_MAX_CONNECTIONS, WS_MAX_ROOMS, WS_MAX_ROOM_SIZE, WS_BUSY_RETRY_MS,
+                      WS_READY_LOAD, WS_READY_MAX_LAG_MS, registry, join_scheduler)
+
+rate_limiter = RateLimiter(
+    parse_rate_limits(WS_RATE_LIMITS), parse_rate_limits(WS_ROOM_RATE_LIMITS), parse_rate(WS_RATE_LIMIT_STRIKES),
+    registry,
+)
+
+sessions = SessionStore(WS_RESUME_GRACE_MS, end_session)
+
+def prune_state():
+    # After each heartbeat sweep; looks the components up at call time, so a replaced one is pruned
+    sessions.prune()
+    registry.prune()
+    join_scheduler.prune()
+    rate_limiter.prune()
+
+heartbeat = Heartbeat(WS_HEARTBEAT_INTERVAL_MS, WS_IDLE_TIMEOUT_MS, end_session, [prune_state])
+
+drain = Drain(WS_DRAIN_WINDOW_MS, WS_DRAIN_CLOSE_GRACE_MS, WS_DRAIN_TARGET, admission, sessions, heartbeat, end_session)
+
+def reject(conn: PeerConnection, code: str, reason: str, retry: float = 0, strike: bool = True,
+           frame: Dict[str, Any] | None = None) -> bool:
+    # Error frame for a dropped inbound frame; False (and the socket closed) when out of strikes.
+    # strike=False when the sender is not at fault (a room-wide limit hit by everyone's traffic).
+    # frame: echoed back so the client can send it again after retryMs
+    if strike and not rate_limiter.strike(conn):
+        ws_rate_limit_disconnects.inc()
+        logger.warning(f"Disconnecting {conn.user_id}: {reason}, out of strikes")
+        conn.abort(1008, "rate limit exceeded")
+        return False
+    error = {"type": "error", "code": code, "message": reason}
+    if retry:
+        error["retryMs"] = int(retry * 1000) + 1
+    if frame is not None:
+        error["frame"] = frame
+    send_json(conn, error)
+    return True
 
 @app.websocket("/api/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    # Accept connection
-    await websocket.accept()
+    # Accept connection; framing is negotiated via subprotocol (JSON unless the client asks otherwise)
+    subprotocol = select_subprotocol(websocket.scope.get("subprotocols") or [])
+    await websocket.accept(subprotocol=subprotocol)
+    if not admission.admit_connection():
+        # Accept-then-close so the client can read the reason and retry hint
+        if admission.draining:
+            ws_rejected.labels("draining").inc()
+            busy, code, reason = Frame(drain.hint()), 1012, "service restart"
+        else:
+            ws_rejected.labels("connections").inc()
+            busy = Frame({"type": "error", "code": "server-busy", "message": "server at capacity",
+                          "retryMs": admission.retry_ms()})
+            code, reason = 1013, "server busy"
+        try:
+            if subprotocol == SUBPROTOCOL_MSGPACK:
+                await websocket.send_bytes(busy.packed())
+            else:
+                await websocket.send_text(busy.text())
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+        return
+    admission.connections += 1
     user_id = str(uuid.uuid4())
-    joined_room = None
-    display_name = None
+    compress = WS_COMPRESSION == "deflate" and websocket.query_params.get("compress") == "deflate"
+    binary = subprotocol == SUBPROTOCOL_MSGPACK
+    conn = PeerConnection(websocket, user_id, binary=binary, compress=compress)
+    conn.start()
+    heartbeat.connections.add(conn)
+    ws_connections.inc()
+    if recorder:
+        recorder.opened(conn)
+    handling = None
     try:
         while True:
-            msg_text = await websocket.receive_text()
+            if handling is not None:
+                # Previous message handled (including any `continue` above)
+                ws_handle_seconds.observe(time.perf_counter() - handling)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            handling = time.perf_counter()
+            conn.last_seen = time.monotonic()
+            text, data = message.get("text"), message.get("bytes")
+            # Enforced before decoding; len(text) counts characters, so encode only when it could matter
+            if (data is not None and len(data) > WS_MAX_FRAME_BYTES) or (
+                text is not None and len(text) * 4 > WS_MAX_FRAME_BYTES and len(text.encode()) > WS_MAX_FRAME_BYTES
+            ):
+                ws_throttled_size.inc()
+                if not reject(conn, "frame-too-large", f"frame exceeds {WS_MAX_FRAME_BYTES} bytes"):
+                    break
+                continue
             try:
-                msg = json.loads(msg_text)
-            except json.JSONDecodeError:
-                await send_json(websocket, {"type": "error", "message": "Invalid JSON"})
+                msg = decode_message(text, data)
+            except ValueError:
+                msg = None
+            if not isinstance(msg, dict):
+                invalid = "Invalid JSON" if message.get("text") is not None else "Invalid message"
+                ws_messages_by_type["invalid"].inc()
+                send_json(conn, {"type": "error", "message": invalid})
                 continue
 
+            # Anything but a string (a list would not even hash) falls through to "Unknown message type"
             mtype = msg.get("type")
+            if not isinstance(mtype, str):
+                mtype = None
+            ws_messages_by_type.get(mtype, ws_messages_by_type["other"]).inc()
+            if recorder:
+                # Before rate limiting: a replay should offer the same load, throttled frames included
+                recorder.inbound(conn, msg)
+            throttled = rate_limiter.check(conn, str(mtype))
+            if throttled is not None:
+                scope, wait = throttled
+                (ws_throttled_room if scope == "room" else ws_throttled_connection).inc()
+                # Dropped signaling would leave a pair unconnected, so it goes back for a retry
+                retry_frame = msg if mtype in PER_PEER_RATE_TYPES else None
+                if not reject(conn, "rate-limited", f"rate limit exceeded for '{mtype}' ({scope})", wait,
+                              strike=scope == "connection", frame=retry_frame):
+                    break
+                continue
 
             if mtype == "join":
                 # {type:'join', room:'room', name:'Alice'}
-                joined_room = str(msg.get("room", "")).strip()
+                # Switching rooms: leave the old one so the peer index never points at two rooms
+                await leave_room(conn)
+                room = str(msg.get("room", "")).strip()
                 display_name = str(msg.get("name") or f"User-{user_id[:5]}")
-                if not joined_room:
-                    await send_json(websocket, {"type": "error", "message": "room required"})
+                # Optional client capabilities, e.g. features: ['ice-batch']; anything but a list of strings is ignored
+                features = msg.get("features")
+                if not isinstance(features, list):
+                    features = []
+                features = {f for f in features if isinstance(f, str)}
+                conn.ice_batch = "ice-batch" in features
+                conn.offer_order = "offer-order" in features
+                conn.sfu = sfu is not None and "sfu" in features
+                try:
+                    conn.history_limit = max(0, min(int(msg.get("history") or 0), CHAT_HISTORY_PAGE_MAX))
+                except (TypeError, ValueError):
+                    conn.history_limit = 0
+                if not room:
+                    send_json(conn, {"type": "error", "message": "room required"})
+                    continue
+                if admission.draining:
+                    # Joins go to the next instance
+                    ws_rejected.labels("draining").inc()
+                    send_json(conn, drain.hint())
+                    continue
+                rejection = admission.check_join(room)
+                if rejection:
+                    ws_rejected.labels(rejection[0]).inc()
+                    send_json(conn, {"type": "error", "code": rejection[0], "message": rejection[1],
+                                     "retryMs": admission.retry_ms()})
+                    continue
+                position = join_scheduler.request(conn, room, display_name)
+                if position:
+                    # Room is busy negotiating; join_room runs when a slot frees up
+                    send_json(conn, {"type": "join-queued", "room": room, "position": position})
                     continue
-                async with rooms_lock:
-                    if joined_room not in rooms:
-                        rooms[joined_room] = {}
-                    # Build peers list before adding self
-                    existing_peers = [
-                        {"id": uid, "name": users_meta.get(uid, {}).get("name", f"User-{uid[:5]}")}
-                        for uid in rooms[joined_room].keys()
-                    ]
-                    rooms[joined_room][user_id] = websocket
-                    users_meta[user_id] = {"room": joined_room, "name": display_name}
-                # Ack self with peer list and selfId
-                await send_json(websocket, {"type": "joined", "selfId": user_id, "peers": existing_peers})
-                # Notify others in room about new peer
-                await broadcast_room(joined_room, {"type": "new-peer", "id": user_id, "name": display_name}, exclude={user_id})
-
-            elif mtype in ("offer", "answer", "ice-candidate"):
+                await join_room(conn, room, display_name)
+
+            elif mtype == "resume":
+                # {type:'resume', token:'...'} instead of join on a reconnect
+                session = None
+                if conn.room is None and not conn.queued_room:
+                    session = sessions.claim(str(msg.get("token") or ""))
+                if session is None:
+                    # Unknown or expired; the client falls back to a full join
+                    ws_resumes.labels("failed").inc()
+                    send_json(conn, {"type": "resume-failed"})
+                    continue
+                ws_resumes.labels("resumed").inc()
+                # Drop this socket's fresh connection and carry on as the resumed one
+                heartbeat.connections.discard(conn)
+                conn.closed = True
+                conn.detach()
+                conn, user_id = session, session.user_id
+                backlog = len(conn._queue)
+                conn.attach(websocket, binary, compress, {
+                    "type": "resumed",
+                    "selfId": user_id,
+                    "room": conn.room,
+                    "resumeToken": sessions.issue(conn),
+                    "replayed": backlog,
+                })
+                heartbeat.connections.add(conn)
+
+            elif mtype in ("offer", "answer", "ice-candidate", "ice-candidates"):
                 # Forward to target peer by id
                 to_id = msg.get("to")
                 if not to_id:
-                    await send_json(websocket, {"type": "error", "message": "missing 'to'"})
-                    continue
-                async with rooms_lock:
-                    target_ws = None
-                    # Find target in any room (or restrict to same room if known)
-                    if joined_room and to_id in rooms.get(joined_room, {}):
-                        target_ws = rooms[joined_room][to_id]
-                    else:
-                        # Fallback: search all rooms
-                        for rmap in rooms.values():
-                            if to_id in rmap:
-                                target_ws = rmap[to_id]
-                                break
-                if target_ws is None:
-                    await send_json(websocket, {"type": "peer-unavailable", "to": to_id})
+                    send_json(conn, {"type": "error", "message": "missing 'to'"})
                     continue
                 payload = {"type": mtype, "from": user_id}
                 if mtype in ("offer", "answer"):
                     payload["sdp"] = msg.get("sdp")
-                else:
+                    valid = is_sdp(payload["sdp"])
+                elif mtype == "ice-candidate":
                     payload["candidate"] = msg.get("candidate")
-                await send_json(target_ws, payload)
+                    valid = payload["candidate"] is None or is_candidate(payload["candidate"])
+                else:
+                    candidates = msg.get("candidates")
+                    valid = candidates is None or (
+                        isinstance(candidates, list) and all(c is None or is_candidate(c) for c in candidates)
+                    )
+                if not valid or not isinstance(to_id, str):
+                    # Relayed as is to peers on any framing, so it must be plain JSON-compatible data
+                    send_json(conn, {"type": "error", "message": f"invalid '{mtype}' payload"})
+                    continue
+                if WS_SIGNAL_SCOPE == "room" and not conn.room:
+                    send_json(conn, {"type": "peer-unavailable", "to": to_id})
+                    continue
+                # Constant-time lookup in the peer index, scoped per WS_SIGNAL_SCOPE
+                scope_room = conn.room if WS_SIGNAL_SCOPE == "room" else None
+                target_conn = registry.find_peer(to_id, scope_room)
+                if target_conn is not None:
+                    if mtype in ("offer", "answer"):
+                        # Candidates buffered for this pair must not arrive after the new description
+                        ice_batcher.flush(user_id, to_id)
+                        send_json(target_conn, payload)
+                        if mtype == "answer":
+                            join_scheduler.answered(user_id, target_conn)
+                    elif mtype == "ice-candidate" and not target_conn.ice_batch:
+                        send_json(target_conn, payload)
+                    else:
+                        candidates, end = ice_candidates_of(msg)
+                        forward_ice(user_id, target_conn, candidates, end)
+                    continue
+                if mtype == "ice-candidates":
+                    # Remote peers get plain frames; their batching capability is not known here
+                    candidates, _ = ice_candidates_of(msg)
+                    frames = [{"type": "ice-candidate", "from": user_id, "candidate": c} for c in candidates]
+                else:
+                    frames = [payload]
+                if frames and not await bus.forward(to_id, frames, scope_room):
+                    # Neither on this node nor on any other
+                    send_json(conn, {"type": "peer-unavailable", "to": to_id})
 
             elif mtype == "text":
                 # Broadcast chat message to room
-                if not joined_room:
+                if not conn.room:
                     continue
                 text = str(msg.get("message", ""))
-                ts = datetime.now(timezone.utc).isoformat()
-                from_name = display_name or f"User-{user_id[:5]}"
-                await broadcast_room(joined_room, {
+                ts = utc_now()
+                message_id = new_message_id()
+                sender = {"id": user_id, "name": conn.name or f"User-{user_id[:5]}"}
+                await broadcast_room(conn.room, {
                     "type": "text",
-                    "from": {"id": user_id, "name": from_name},
+                    "id": message_id,
+                    "from": sender,
                     "message": text,
-                    "timestamp": ts,
+                    "timestamp": ts.isoformat(),
                 })
+                # Buffered; persisted by the chat log's writer task
+                chat_log.add({"id": message_id, "room": conn.room, "from": sender, "message": text, "timestamp": ts})
 
             elif mtype == "leave":
                 # Voluntary leave
-                if joined_room:
-                    async with rooms_lock:
-                        rmap = rooms.get(joined_room, {})
-                        if user_id in rmap:
-                            del rmap[user_id]
-                    await broadcast_room(joined_room, {"type": "leave", "id": user_id})
-                    joined_room = None
-                await send_json(websocket, {"type": "left"})
+                await leave_room(conn)
+                send_json(conn, {"type": "left"})
+
+            elif mtype in ("sfu-publish", "sfu-answer"):
+                # {type:'sfu-publish'|'sfu-answer', sdp:{type, sdp}} on the client's SFU connections
+                sdp = msg.get("sdp")
+                if not (conn.sfu and conn.room) or not isinstance(sdp, dict) or not sdp.get("sdp"):
+                    send_json(conn, {"type": "error", "message": "SFU not active"})
+                    continue
+                try:
+                    if mtype == "sfu-publish":
+                        answer = await sfu.publish(conn.room, user_id, sdp)
+                        send_json(conn, {"type": "sfu-published", "sdp": answer})
+                    else:
+                        await sfu.answer(conn.room, user_id, sdp)
+                except Exception as e:
+                    logger.warning(f"SFU {mtype} from {user_id} failed: {e}")
+                    send_json(conn, {"type": "error", "message": f"{mtype} failed"})
+
+            elif mtype == "presence-subscribe":
+                # {type:'presence-subscribe', room?:'name'}: snapshot now, batched 'presence-update' deltas after.
+                # Without a room: counts for every room; with one: that room's member names too
+                room_filter = msg.get("room")
+                send_json(conn, room_directory.subscribe(conn, str(room_filter) if room_filter else None))
+
+            elif mtype == "presence-unsubscribe":
+                room_directory.unsubscribe(conn)
+
+            elif mtype == "ping":
+                # Client-side liveness check
+                send_json(conn, {"type": "pong"})
+
+            elif mtype == "pong":
+                # Heartbeat answer; last_seen is already updated. From now on silence means gone
+                conn.pongs = True
 
             else:
-                await send_json(websocket, {"type": "error", "message": "Unknown message type"})
+                send_json(conn, {"type": "error", "message": "Unknown message type"})
 
     except WebSocketDisconnect:
         pass
     except Exception as e:
         logger.exception(f"WebSocket error: {e}")
     finally:
-        # Cleanup on disconnect
-        if joined_room:
-            async with rooms_lock:
-                rmap = rooms.get(joined_room, {})
-                if user_id in rmap:
-                    del rmap[user_id]
-            await broadcast_room(joined_room, {"type": "leave", "id": user_id})
-        users_meta.pop(user_id, None)
-        try:
-            await websocket.close()
-        except Exception:
-            pass
+        # Cleanup on disconnect, unless the session moved to another socket or waits for a resume
+        ws_connections.dec()
+        admission.connections -= 1
+        if conn.websocket is websocket:
+            heartbeat.connections.discard(conn)
+            # While draining, nothing can come back to resume
+            if admission.draining or not sessions.park(conn):
+                await end_session(conn)
+                await conn.close()
+
+async def ensure_indexes():
+    # In the background: a slow or unreachable database must not hold up startup
+    try:
+        await db.status_checks.create_index(STATUS_SORT, name="timestamp_id")
+    except Exception as e:
+        logger.warning(f"Status index creation failed: {e}")
 
 @app.on_event("startup")
 async def startup_event():
+    started = time.perf_counter()
     logger.info("FastAPI application starting up...")
     logger.info("Available routes:")
     for route in app.routes:
         logger.info(f"  {route}")
+    await bus.start(fanout_local, deliver_to_peer)
+    heartbeat.start()
+    admission.start()
+    room_directory.start(send_json)
+    if WS_DRAIN_ON_SIGTERM:
+        drain.install_signal_handler()
+    if recorder:
+        await recorder.start()
+    # Indexes are created once the database is first used, not here
+    mongo.on_connect(ensure_indexes)
+    if CHAT_HISTORY and mongo.configured:
+        # Resolved on the first chat message or history read
+        await chat_log.start(lambda: db.chat_messages)
+    elif CHAT_HISTORY:
+        logger.warning("Chat history disabled: MONGO_URL is not set")
+    startup_seconds.set(time.perf_counter() - started)
+    loop = type(asyncio.get_running_loop())
+    logger.info(f"Ready: import {import_seconds.value * 1000:.0f} ms, startup {startup_seconds.value * 1000:.0f} ms "
+                f"(event loop {loop.__module__}.{loop.__name__})")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await drain.stop()
+    await heartbeat.stop()
+    if sfu:
+        await sfu.close()
+    await admission.stop()
+    await room_directory.stop()
+    await chat_log.stop()
+    if recorder:
+        await recorder.stop()
+    await bus.stop()
+    mongo.close()
+
+import_seconds.set(time.perf_counter() - _import_started)
@@ -0,0 +1,349 @@
+"""Optional selective forwarding (SFU) mode for /api/ws rooms.
+
+In mesh mode every client sends its audio to every other peer. In SFU mode a
+client keeps two peer connections with the server instead:
+- publish: the client's one upstream audio track (client offers)
+- subscribe: one downstream track per other publisher in the room (server offers)
+
+Signaling rides on the room's WebSocket:
+  client -> {type:'sfu-publish', sdp}      server -> {type:'sfu-published', sdp}
+  server -> {type:'sfu-offer', sdp, tracks} client -> {type:'sfu-answer', sdp}
+  server -> {type:'sfu-tracks', tracks}    mid -> publisher id after a slot is reused
+SDPs carry all ICE candidates (no trickle). Downstream slots freed by a leaving
+publisher are reused for the next one with replaceTrack, without renegotiating.
+
+Built on aiortc, but without its media pipeline: each publisher's Opus frames
+are taken from the receiver's jitter buffer before decoding and handed to every
+subscriber's sender as encoded packets, which aiortc packetizes as they are.
+Nothing is decoded or re-encoded; the per-subscriber cost is RTP and SRTP only.
+Both connections are restricted to Opus so the frames fit every sender.
+"""
+import asyncio
+import fractions
+import logging
+import os
+import queue
+from typing import Any, Callable, Dict, List, Optional, Set
+
+try:
+    import av
+    from aiortc import (MediaStreamTrack, RTCConfiguration, RTCIceServer, RTCPeerConnection, RTCRtpSender,
+                        RTCSessionDescription)
+    from aiortc.mediastreams import MediaStreamError
+except ImportError:  # optional dependency, only needed for SFU_MODE=on
+    MediaStreamTrack = object
+    RTCPeerConnection = None
+
+logger = logging.getLogger(__name__)
+
+# send(data) delivers a signaling frame to one client
+Send = Callable[[Dict[str, Any]], None]
+
+# RTP clock of Opus
+OPUS_TIME_BASE = fractions.Fraction(1, 48000)
+# Frames a subscriber's sender may fall behind (20 ms each) before the oldest are dropped
+FORWARD_QUEUE_FRAMES = 25
+
+
+def opus_only(transceiver):
+    codecs = [c for c in RTCRtpSender.getCapabilities("audio").codecs if c.mimeType.lower() == "audio/opus"]
+    transceiver.setCodecPreferences(codecs)
+
+
+class RoomStats:
+    __slots__ = ("frames_forwarded", "renegotiations")
+
+    def __init__(self):
+        self.frames_forwarded = 0
+        self.renegotiations = 0
+
+
+class EncodedTap:
+    """Stands in for an aiortc receiver's decoder queue.
+
+    The receiver puts (codec, encoded frame) here once the jitter buffer has a
+    complete frame; they go to `on_frame` instead of the decoder thread, which
+    only ever sees the shutdown sentinel.
+    """
+
+    def __init__(self, on_frame: Callable[[Any, Any], None]):
+        self.on_frame = on_frame
+        self._control: queue.Queue = queue.Queue()
+
+    def put(self, item):
+        if item is None:
+            self._control.put(None)
+        else:
+            self.on_frame(*item)
+
+    def get(self, *args, **kwargs):
+        return self._control.get(*args, **kwargs)
+
+
+class EncodedSource:
+    """A publisher's upstream audio as encoded packets, fanned out to its subscribers."""
+
+    def __init__(self, stats: RoomStats):
+        self.stats = stats
+        self.subscribers: Set["ForwardedTrack"] = set()
+
+    def tap(self, receiver):
+        # aiortc has no public hook for encoded frames; swap the receiver's decoder queue
+        # before receive() hands it to the decoder thread
+        attr = "_RTCRtpReceiver__decoder_queue"
+        if not hasattr(receiver, attr) or getattr(receiver, "_RTCRtpReceiver__decoder_thread", None) is not None:
+            raise RuntimeError("unsupported aiortc version: cannot tap encoded frames")
+        setattr(receiver, attr, EncodedTap(self.on_frame))
+
+    def on_frame(self, codec, frame):
+        if codec.name.lower() != "opus":
+            return
+        packet = av.Packet(frame.data)
+        packet.pts = frame.timestamp
+        packet.time_base = OPUS_TIME_BASE
+        for track in self.subscribers:
+            track.push(packet)
+
+    def subscribe(self) -> "ForwardedTrack":
+        track = ForwardedTrack(self)
+        self.subscribers.add(track)
+        return track
+
+    def close(self):
+        for track in list(self.subscribers):
+            track.stop()
+
+
+class ForwardedTrack(MediaStreamTrack):
+    """One subscriber's feed of a publisher's encoded packets; counts them for the room's stats."""
+
+    kind = "audio"
+
+    def __init__(self, source: EncodedSource):
+        super().__init__()
+        self.source = source
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def push(self, packet):
+        if self._queue.qsize() >= FORWARD_QUEUE_FRAMES:
+            # Sender stalled: late audio is useless, keep the newest
+            self._queue.get_nowait()
+        self._queue.put_nowait(packet)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        packet = await self._queue.get()
+        if packet is None:
+            raise MediaStreamError
+        self.source.stats.frames_forwarded += 1
+        return packet
+
+    def stop(self):
+        if self.readyState == "live":
+            self.source.subscribers.discard(self)
+            self._queue.put_nowait(None)
+        super().stop()
+
+
+class SfuPeer:
+    def __init__(self, peer_id: str, send: Send):
+        self.peer_id = peer_id
+        self.send = send
+        self.publish_pc: Optional[RTCPeerConnection] = None
+        self.subscribe_pc: Optional[RTCPeerConnection] = None
+        # Upstream audio once the publish connection delivers a track
+        self.source: Optional[EncodedSource] = None
+        # Downstream slots: [transceiver, publisher id or None when free]
+        self.slots: List[List[Any]] = []
+        self.negotiating = False
+        # Slots changed while an offer was outstanding; offer again after the answer
+        self.dirty = False
+
+
+class SfuRoom:
+    def __init__(self, name: str):
+        self.name = name
+        self.peers: Dict[str, SfuPeer] = {}
+        self.stats = RoomStats()
+
+
+class Sfu:
+    def __init__(self, ice_urls: Optional[List[str]] = None):
+        if RTCPeerConnection is None:
+            raise RuntimeError("SFU_MODE=on requires the 'aiortc' package (pip install -r requirements-sfu.txt)")
+        # No ICE servers by default: the server usually has a reachable address of its own
+        self.ice_servers = [RTCIceServer(urls=u) for u in (ice_urls or [])]
+        self.rooms: Dict[str, SfuRoom] = {}
+
+    def _pc(self) -> RTCPeerConnection:
+        return RTCPeerConnection(RTCConfiguration(iceServers=self.ice_servers))
+
+    async def join(self, room: str, peer_id: str, send: Send):
+        r = self.rooms.get(room)
+        if r is None:
+            r = self.rooms[room] = SfuRoom(room)
+        peer = r.peers[peer_id] = SfuPeer(peer_id, send)
+        changed = False
+        for other in list(r.peers.values()):
+            if other is not peer and other.source is not None:
+                changed |= self._attach(peer, other.peer_id, other.source)
+        if changed:
+            await self._negotiate(r, peer)
+
+    async def publish(self, room: str, peer_id: str, sdp: Dict[str, Any]) -> Dict[str, Any]:
+        # Upstream offer from the client; returns the answer
+        r = self.rooms.get(room)
+        peer = r.peers.get(peer_id) if r else None
+        if peer is None:
+            raise ValueError("not in an SFU room")
+        if peer.publish_pc is not None:
+            await self._unpublish(r, peer)
+            await peer.publish_pc.close()
+        pc = peer.publish_pc = self._pc()
+
+        @pc.on("track")
+        def on_track(track):
+            if track.kind != "audio" or peer.source is not None:
+                return
+            receiver = next(t.receiver for t in pc.getTransceivers() if t.receiver.track is track)
+            source = EncodedSource(r.stats)
+            try:
+                source.tap(receiver)
+            except RuntimeError as e:
+                logger.error(f"SFU cannot forward {peer.peer_id}: {e}")
+                return
+            peer.source = source
+            asyncio.create_task(self._fan_out(r, peer))
+
+        @pc.on("connectionstatechange")
+        async def on_state():
+            if pc.connectionState in ("failed", "closed") and peer.publish_pc is pc:
+                await self._unpublish(r, peer)
+
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp["sdp"], type=sdp["type"]))
+        for transceiver in pc.getTransceivers():
+            if transceiver.kind == "audio":
+                opus_only(transceiver)
+        await pc.setLocalDescription(await pc.createAnswer())
+        return {"type": pc.localDescription.type, "sdp": pc.localDescription.sdp}
+
+    async def answer(self, room: str, peer_id: str, sdp: Dict[str, Any]):
+        # Client's answer to our last subscribe offer
+        r = self.rooms.get(room)
+        peer = r.peers.get(peer_id) if r else None
+        if peer is None or peer.subscribe_pc is None or not peer.negotiating:
+            return
+        await peer.subscribe_pc.setRemoteDescription(RTCSessionDescription(sdp=sdp["sdp"], type=sdp["type"]))
+        peer.negotiating = False
+        if peer.dirty:
+            await self._negotiate(r, peer)
+
+    async def leave(self, room: str, peer_id: str):
+        r = self.rooms.get(room)
+        peer = r.peers.pop(peer_id, None) if r else None
+        if peer is None:
+            return
+        await self._unpublish(r, peer)
+        for slot in peer.slots:
+            if slot[0].sender.track is not None:
+                slot[0].sender.track.stop()
+        for pc in (peer.publish_pc, peer.subscribe_pc):
+            if pc is not None:
+                await pc.close()
+        # Another leave may have emptied and dropped the room while we awaited
+        if not r.peers and self.rooms.get(room) is r:
+            del self.rooms[room]
+
+    async def close(self):
+        for room, r in list(self.rooms.items()):
+            for peer_id in list(r.peers):
+                await self.leave(room, peer_id)
+
+    def _attach(self, sub: SfuPeer, publisher_id: str, source: EncodedSource) -> bool:
+        # Route `source` to `sub`; True when a new transceiver needs a renegotiation
+        if any(slot[1] == publisher_id for slot in sub.slots):
+            # Already routed (joined between the publisher's track arriving and its fan-out)
+            return False
+        forwarded = source.subscribe()
+        for slot in sub.slots:
+            if slot[1] is None:
+                slot[0].sender.replaceTrack(forwarded)
+                slot[1] = publisher_id
+                self._tracks_changed(sub)
+                return False
+        if sub.subscribe_pc is None:
+            sub.subscribe_pc = self._pc()
+        transceiver = sub.subscribe_pc.addTransceiver(forwarded, direction="sendonly")
+        opus_only(transceiver)
+        sub.slots.append([transceiver, publisher_id])
+        return True
+
+    async def _fan_out(self, r: SfuRoom, publisher: SfuPeer):
+        for sub in list(r.peers.values()):
+            if sub is not publisher and publisher.source is not None and \
+                    self._attach(sub, publisher.peer_id, publisher.source):
+                await self._negotiate(r, sub)
+
+    async def _unpublish(self, r: SfuRoom, publisher: SfuPeer):
+        if publisher.source is None:
+            return
+        publisher.source.close()
+        publisher.source = None
+        for sub in r.peers.values():
+            for slot in sub.slots:
+                if slot[1] == publisher.peer_id:
+                    old = slot[0].sender.track
+                    slot[0].sender.replaceTrack(None)
+                    if old is not None:
+                        old.stop()
+                    slot[1] = None
+                    self._tracks_changed(sub)
+
+    def _tracks_changed(self, sub: SfuPeer):
+        if sub.negotiating:
+            sub.dirty = True
+        elif sub.subscribe_pc is not None and sub.subscribe_pc.remoteDescription is not None:
+            sub.send({"type": "sfu-tracks", "tracks": self._track_map(sub)})
+
+    def _track_map(self, sub: SfuPeer) -> Dict[str, str]:
+        return {slot[0].mid: slot[1] for slot in sub.slots if slot[1] is not None and slot[0].mid is not None}
+
+    async def _negotiate(self, r: SfuRoom, sub: SfuPeer):
+        if sub.negotiating:
+            sub.dirty = True
+            return
+        sub.negotiating = True
+        sub.dirty = False
+        r.stats.renegotiations += 1
+        pc = sub.subscribe_pc
+        try:
+            # aiortc gathers every ICE candidate here, so the SDP is complete
+            await pc.setLocalDescription(await pc.createOffer())
+        except Exception as e:
+            sub.negotiating = False
+            logger.warning(f"SFU offer for {sub.peer_id} failed: {e}")
+            return
+        sub.send({
+            "type": "sfu-offer",
+            "sdp": {"type": pc.localDescription.type, "sdp": pc.localDescription.sdp},
+            "tracks": self._track_map(sub),
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "peers": len(r.peers),
+                "publishers": sum(1 for p in r.peers.values() if p.source is not None),
+                "forwarded_tracks": sum(1 for p in r.peers.values() for s in p.slots if s[1] is not None),
+                "frames_forwarded": r.stats.frames_forwarded,
+                "renegotiations": r.stats.renegotiations,
+            }
+            for name, r in self.rooms.items()
+        }
+
+
+def create_sfu() -> Sfu:
+    # Only imported and called with SFU_MODE=on; clients opt in per join with features:['sfu']
+    urls = [u.strip() for u in os.environ.get("SFU_ICE_URLS", "").split(",") if u.strip()]
+    return Sfu(urls)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Loopback check for SFU mode (SFU_MODE=on) on a single machine.
+
+Runs the FastAPI app in-process with SFU_MODE=on and joins --peers aiortc
+clients to one room over the ASGI transport from bench_ws. Every client
+publishes a generated audio track and subscribes to the others; media flows
+over real ICE/DTLS/SRTP on the loopback interface. After --duration seconds
+the tool checks that each client receives frames on N-1 tracks and prints
+/api/sfu/stats for the room.
+
+Server and clients share one event loop in-process. The server only forwards
+encoded frames, but every client decodes its N-1 tracks, so a 20-peer room
+needs more CPU than one core offers on the client side alone. With --url the
+clients drive a live server (SFU_MODE=on) instead, which puts the two sides in
+separate processes.
+
+Requires aiortc (pip install -r backend/requirements-sfu.txt). Examples:
+  python backend/sfu_loopback.py --peers 8 --duration 10
+  SFU_MODE=on uvicorn server:app --app-dir backend --port 8001 &
+  python backend/sfu_loopback.py --url ws://localhost:8001/api/ws --peers 20
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ["SFU_MODE"] = "on"
+os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+
+from aiortc import RTCPeerConnection, RTCSessionDescription  # noqa: E402
+from aiortc.mediastreams import AudioStreamTrack  # noqa: E402
+
+from bench_ws import AsgiWebSocket, MemoryDatabase, NetWebSocket  # noqa: E402
+from codec import decode_message, encode_json  # noqa: E402
+
+
+def description(pc: RTCPeerConnection) -> Dict[str, str]:
+    return {"type": pc.localDescription.type, "sdp": pc.localDescription.sdp}
+
+
+class LoopbackPeer:
+    def __init__(self, idx: int, room: str, ws):
+        self.idx = idx
+        self.room = room
+        self.ws = ws
+        self.self_id: Optional[str] = None
+        self.publish_pc: Optional[RTCPeerConnection] = None
+        self.subscribe_pc: Optional[RTCPeerConnection] = None
+        # mid -> publisher id, as last announced by the server
+        self.tracks: Dict[str, str] = {}
+        # mid -> audio frames received
+        self.frames: Dict[str, int] = {}
+        self.errors: List[str] = []
+        self.joined = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+        self._consumers: List[asyncio.Task] = []
+
+    async def send(self, msg: Dict[str, Any]):
+        await self.ws.send(encode_json(msg))
+
+    async def join(self):
+        self._reader = asyncio.create_task(self._read())
+        await self.send({"type": "join", "room": self.room, "name": f"loopback-{self.idx}", "features": ["sfu"]})
+
+    async def _read(self):
+        try:
+            while True:
+                msg = decode_message(await self.ws.recv(), None)
+                await self._handle(msg)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            self.errors.append(repr(e))
+
+    async def _handle(self, msg: Dict[str, Any]):
+        mtype = msg.get("type")
+        if mtype == "joined":
+            self.self_id = msg.get("selfId")
+            if not msg.get("sfu"):
+                raise RuntimeError("server did not enable SFU mode for this peer")
+            self.joined.set()
+            await self._publish()
+        elif mtype == "sfu-published":
+            await self.publish_pc.setRemoteDescription(RTCSessionDescription(**msg["sdp"]))
+        elif mtype == "sfu-offer":
+            await self._subscribe(msg)
+        elif mtype == "sfu-tracks":
+            self.tracks = msg.get("tracks") or {}
+        elif mtype == "ping":
+            await self.send({"type": "pong"})
+        elif mtype == "error":
+            self.errors.append(msg.get("message", "error"))
+
+    async def _publish(self):
+        pc = self.publish_pc = RTCPeerConnection()
+        pc.addTransceiver(AudioStreamTrack(), direction="sendonly")
+        await pc.setLocalDescription(await pc.createOffer())
+        await self.send({"type": "sfu-publish", "sdp": description(pc)})
+
+    async def _subscribe(self, msg: Dict[str, Any]):
+        if self.subscribe_pc is None:
+            pc = self.subscribe_pc = RTCPeerConnection()
+
+            @pc.on("track")
+            def on_track(track):
+                mid = next((t.mid for t in pc.getTransceivers() if t.receiver.track is track), None)
+                self._consumers.append(asyncio.create_task(self._consume(mid, track)))
+
+        pc = self.subscribe_pc
+        await pc.setRemoteDescription(RTCSessionDescription(**msg["sdp"]))
+        await pc.setLocalDescription(await pc.createAnswer())
+        self.tracks = msg.get("tracks") or {}
+        await self.send({"type": "sfu-answer", "sdp": description(pc)})
+
+    async def _consume(self, mid: Optional[str], track):
+        try:
+            while True:
+                await track.recv()
+                self.frames[mid] = self.frames.get(mid, 0) + 1
+        except Exception:
+            pass
+
+    def receiving(self) -> int:
+        # Announced tracks that actually delivered audio
+        return sum(1 for mid in self.tracks if self.frames.get(mid, 0) > 0)
+
+    async def close(self):
+        for task in self._consumers:
+            task.cancel()
+        for pc in (self.publish_pc, self.subscribe_pc):
+            if pc is not None:
+                await pc.close()
+        await self.ws.close()
+        if self._reader:
+            self._reader.cancel()
+
+
+def fetch_stats(ws_url: str) -> Dict[str, Any]:
+    # ws://host/api/ws -> http://host/api/sfu/stats
+    url = ws_url.replace("ws", "http", 1).split("?")[0].rsplit("/ws", 1)[0] + "/sfu/stats"
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        return json.load(resp)
+
+
+async def run(args) -> Dict[str, Any]:
+    server = None
+    if not args.url:
+        import server as server_module
+        server = server_module
+        server.db = MemoryDatabase()
+        await server.app.router.startup()
+
+    peers: List[LoopbackPeer] = []
+    for i in range(args.peers):
+        ws = NetWebSocket(args.url, []) if args.url else AsgiWebSocket(server.app, "/api/ws", [])
+        await ws.connect()
+        peer = LoopbackPeer(i, args.room, ws)
+        peers.append(peer)
+        await peer.join()
+    await asyncio.wait_for(asyncio.gather(*(p.joined.wait() for p in peers)), 30)
+
+    # Wait until everyone hears everyone (or the duration runs out), then keep media flowing
+    started = time.perf_counter()
+    expected = args.peers - 1
+    while time.perf_counter() - started < args.duration:
+        if all(p.receiving() >= expected for p in peers):
+            break
+        await asyncio.sleep(0.5)
+    connected_s = time.perf_counter() - started
+    await asyncio.sleep(max(0.0, args.duration - connected_s))
+
+    if server is not None:
+        stats = await server.sfu_stats()
+    else:
+        stats = await asyncio.get_running_loop().run_in_executor(None, fetch_stats, args.url)
+    stats = stats["rooms"].get(args.room, {})
+    receiving = [p.receiving() for p in peers]
+    frames = sum(n for p in peers for n in p.frames.values())
+    errors = [e for p in peers for e in p.errors]
+
+    for p in peers:
+        await p.close()
+    if server is not None:
+        await server.app.router.shutdown()
+    return {
+        "peers": args.peers,
+        "expected_tracks_per_peer": expected,
+        "receiving_min": min(receiving),
+        "receiving_max": max(receiving),
+        "all_connected_s": round(connected_s, 2) if min(receiving) >= expected else None,
+        # 50 for 20 ms Opus frames at full rate; lower means the box is out of CPU
+        "frames_per_track_s": round(frames / max(1, args.peers * expected) / args.duration, 1),
+        "errors": errors,
+        "sfu": stats,
+        "ok": min(receiving) >= expected and not errors,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Loopback check of the SFU forwarding mode")
+    parser.add_argument("--url", help="ws:// URL of a live server with SFU_MODE=on (default: in-process app)")
+    parser.add_argument("--peers", type=int, default=20)
+    parser.add_argument("--room", default="sfu-loopback")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of audio to forward")
+    args = parser.parse_args(argv)
+    if args.peers < 2:
+        parser.error("--peers must be at least 2")
+
+    for name in ("server", "aioice", "aiortc"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import React, { useCallback, useEffect, useMemo, useRef, useState } from 'react';
+import { encode as msgpackEncode, decode as msgpackDecode } from '@msgpack/msgpack';
 import './App.css';
 
 // Helper: build WS URL from REACT_APP_BACKEND_URL without hardcoding
@@ -12,8 +13,65 @@ function buildWsUrl() {
   const base = getBackendBase();
   if (!base) return '';
   const wsBase = base.startsWith('https') ? base.replace('https', 'wss') : base.replace('http', 'ws');
-  return `${wsBase}/ws`;
+  // Ask for deflated large frames (SDP) when the browser can inflate them
+  return typeof DecompressionStream === 'function' ? `${wsBase}/ws?compress=deflate` : `${wsBase}/ws`;
 }
+// A drain's target hint is another instance's WebSocket URL; keep our query options on it
+const withQuery = (target, url) => (target.includes('?') || !url.includes('?') ? target : target + url.slice(url.indexOf('?')));
+
+// Signaling framing, negotiated per connection via WebSocket subprotocol.
+// The server picks the first one it supports; with none selected it speaks JSON.
+const WS_PROTOCOLS = ['soundcore.msgpack', 'soundcore.json'];
+// RTCSessionDescription / RTCIceCandidate expose fields as getters; flatten before encoding
+const plain = (v) => (v && typeof v.toJSON === 'function' ? v.toJSON() : v);
+const encodeSignal = (ws, msg) => (ws.protocol === 'soundcore.msgpack' ? msgpackEncode(msg) : JSON.stringify(msg));
+const inflateRaw = async (bytes) => {
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate-raw'));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+};
+// Binary frames starting with 0x00 are deflated; the payload inside uses the connection's framing
+const decodeSignal = async (ws, data) => {
+  if (typeof data === 'string') return JSON.parse(data);
+  let bytes = new Uint8Array(data);
+  if (bytes[0] === 0) {
+    bytes = await inflateRaw(bytes.subarray(1));
+    if (ws.protocol !== 'soundcore.msgpack') return JSON.parse(new TextDecoder().decode(bytes));
+  }
+  return msgpackDecode(bytes);
+};
+const sendSignal = (ws, msg) => {
+  if (ws && ws.readyState === WebSocket.OPEN) ws.send(encodeSignal(ws, msg));
+};
+
+// Recent chat to load with 'joined'; older pages come from GET /api/rooms/{room}/messages
+const CHAT_HISTORY = 50;
+// Opt in to the server's SFU: one upstream track instead of one connection per peer
+const SFU_ENABLED = (import.meta?.env?.REACT_APP_SFU_MODE || process.env.REACT_APP_SFU_MODE) === 'on';
+const joinMessage = (room, name) => ({
+  type: 'join', room, name: name || undefined,
+  features: SFU_ENABLED ? ['ice-batch', 'offer-order', 'sfu'] : ['ice-batch', 'offer-order'],
+  history: CHAT_HISTORY,
+});
+
+// SFU connections live in pcMapRef next to mesh peers under these keys
+const SFU_PUBLISH = 'sfu:publish';
+const SFU_SUBSCRIBE = 'sfu:subscribe';
+// The SFU takes no trickled candidates: wait for gathering before sending an SDP
+const SFU_GATHER_TIMEOUT_MS = 3000;
+const gatheringComplete = (pc) => new Promise((resolve) => {
+  if (pc.iceGatheringState === 'complete') return resolve();
+  const timer = setTimeout(resolve, SFU_GATHER_TIMEOUT_MS);
+  pc.addEventListener('icegatheringstatechange', () => {
+    if (pc.iceGatheringState === 'complete') { clearTimeout(timer); resolve(); }
+  });
+});
+
+// After an unexpected close, reconnect with the resume token (backoff doubles per attempt)
+const RESUME_ATTEMPTS = 5;
+const RESUME_DELAY_MS = 500;
+
+// Outgoing ICE candidates per peer are held this long and sent as one 'ice-candidates' frame
+const ICE_BATCH_MS = 20;
 
 const defaultIce = [
   { urls: ['stun:stun.l.google.com:19302', 'stun:global.stun.twilio.com:3478'] }
@@ -45,6 +103,7 @@ function App() {
   const [muted, setMuted] = useState(false);
   const [iceServers, setIceServers] = useState(defaultIce);
   const [listenOnly, setListenOnly] = useState(false);
+  const [queuePos, setQueuePos] = useState(0); // >0 while waiting for admission to a busy room
 
   // Audio settings state
   const [devices, setDevices] = useState({ inputs: [], outputs: [] });
@@ -58,6 +117,11 @@ function App() {
   const [peerVolumes, setPeerVolumes] = useState({}); // id -> 0-100
 
   const wsRef = useRef(null);
+  const resumeRef = useRef(null); // resume token of the current session
+  const moveRef = useRef(null); // (url) => reconnect the current session's room elsewhere
+  const movingRef = useRef(false); // a drain's 'reconnect' is pending: a close is not the end of the session
+  const selfIdRef = useRef(null); // selfId for use inside signaling handlers
+  const iceOutRef = useRef(new Map()); // peerId -> { candidates, timer }
   const pcMapRef = useRef(new Map()); // peerId -> RTCPeerConnection
   const remoteAudioRefs = useRef(new Map()); // peerId -> HTMLAudioElement
   const localStreamRef = useRef(null); // raw mic
@@ -202,6 +266,41 @@ function App() {
     applySpeakerSink();
   }, [applySpeakerSink]);
 
+  const flushIce = useCallback((peerId, end = false) => {
+    const entry = iceOutRef.current.get(peerId);
+    iceOutRef.current.delete(peerId);
+    if (entry) clearTimeout(entry.timer);
+    if ((entry && entry.candidates.length) || end) {
+      sendSignal(wsRef.current, { type: 'ice-candidates', to: peerId, candidates: entry ? entry.candidates : [], end });
+    }
+  }, []);
+
+  const queueIce = useCallback((peerId, candidate) => {
+    let entry = iceOutRef.current.get(peerId);
+    if (!entry) {
+      entry = { candidates: [], timer: setTimeout(() => flushIce(peerId), ICE_BATCH_MS) };
+      iceOutRef.current.set(peerId, entry);
+    }
+    entry.candidates.push(candidate);
+  }, [flushIce]);
+
+  const attachRemoteAudio = useCallback((peerId, stream) => {
+    let audio = remoteAudioRefs.current.get(peerId);
+    if (!audio) {
+      audio = new Audio();
+      audio.autoplay = true;
+      audio.playsInline = true;
+      remoteAudioRefs.current.set(peerId, audio);
+    }
+    audio.srcObject = stream;
+    // Set sink and volume
+    if (typeof audio.setSinkId === 'function' && selectedSpeakerId) {
+      audio.setSinkId(selectedSpeakerId).catch(() => {});
+    }
+    const vol = (peerVolumes[peerId] != null ? peerVolumes[peerId] : defaultRemoteVol);
+    audio.volume = Math.max(0, Math.min(1, (vol || 100) / 100));
+  }, [defaultRemoteVol, peerVolumes, selectedSpeakerId]);
+
   const createPeerConnection = useCallback((peerId, isOfferer) => {
     if (pcMapRef.current.has(peerId)) return pcMapRef.current.get(peerId);
     const pc = new RTCPeerConnection({ iceServers });
@@ -211,27 +310,13 @@ function App() {
     srcStream?.getTracks().forEach((t) => pc.addTrack(t, srcStream));
 
     pc.onicecandidate = (e) => {
-      if (e.candidate && wsRef.current) {
-        wsRef.current.send(JSON.stringify({ type: 'ice-candidate', to: peerId, candidate: e.candidate }));
-      }
+      if (!wsRef.current) return;
+      // A null candidate marks end of gathering: send what is left right away
+      if (e.candidate) queueIce(peerId, plain(e.candidate));
+      else flushIce(peerId, true);
     };
 
-    pc.ontrack = (e) => {
-      let audio = remoteAudioRefs.current.get(peerId);
-      if (!audio) {
-        audio = new Audio();
-        audio.autoplay = true;
-        audio.playsInline = true;
-        remoteAudioRefs.current.set(peerId, audio);
-      }
-      audio.srcObject = e.streams[0];
-      // Set sink and volume
-      if (typeof audio.setSinkId === 'function' && selectedSpeakerId) {
-        audio.setSinkId(selectedSpeakerId).catch(() => {});
-      }
-      const vol = (peerVolumes[peerId] != null ? peerVolumes[peerId] : defaultRemoteVol);
-      audio.volume = Math.max(0, Math.min(1, (vol || 100) / 100));
-    };
+    pc.ontrack = (e) => attachRemoteAudio(peerId, e.streams[0]);
 
     pc.onconnectionstatechange = () => {
       if (["failed", "closed", "disconnected"].includes(pc.connectionState)) {
@@ -245,7 +330,8 @@ function App() {
         try {
           const offer = await pc.createOffer({ offerToReceiveAudio: true });
           await pc.setLocalDescription(offer);
-          wsRef.current?.send(JSON.stringify({ type: 'offer', to: peerId, sdp: offer }));
+          flushIce(peerId);
+          sendSignal(wsRef.current, { type: 'offer', to: peerId, sdp: plain(offer) });
         } catch (e) {
           console.error('Offer error', e);
         }
@@ -253,29 +339,127 @@ function App() {
     })();
 
     return pc;
-  }, [defaultRemoteVol, iceServers, peerVolumes, selectedSpeakerId, selfId]);
+  }, [attachRemoteAudio, flushIce, iceServers, queueIce]);
+
+  // SFU mode: publish the mic once to the server (skipped in listen-only mode)
+  const publishToSfu = useCallback(async (ws) => {
+    const src = processedStreamRef.current || localStreamRef.current;
+    const track = src?.getAudioTracks()[0];
+    if (!track) return;
+    const pc = new RTCPeerConnection({ iceServers });
+    pcMapRef.current.set(SFU_PUBLISH, pc);
+    pc.addTransceiver(track, { direction: 'sendonly', streams: [src] });
+    await pc.setLocalDescription(await pc.createOffer());
+    await gatheringComplete(pc);
+    sendSignal(ws, { type: 'sfu-publish', sdp: plain(pc.localDescription) });
+  }, [iceServers]);
+
+  // Play each downstream SFU track as its publisher; tracks maps transceiver mid -> peer id
+  const routeSfuTracks = useCallback((tracks) => {
+    const pc = pcMapRef.current.get(SFU_SUBSCRIBE);
+    if (!pc) return;
+    pc.getTransceivers().forEach((t) => {
+      const peerId = (tracks || {})[t.mid];
+      if (peerId) attachRemoteAudio(peerId, new MediaStream([t.receiver.track]));
+    });
+  }, [attachRemoteAudio]);
 
   const handleWsMessage = useCallback(async (ev) => {
-    const msg = JSON.parse(ev.data);
-    if (msg.type === 'joined') {
+    const msg = await decodeSignal(ev.target, ev.data);
+    if (msg.type === 'ping') {
+      // Server heartbeat; peers that stop answering are evicted
+      sendSignal(ev.target, { type: 'pong' });
+    } else if (msg.type === 'resumed') {
+      // Same id and room as before the drop; peer connections stay up, missed frames follow
+      resumeRef.current = msg.resumeToken || null;
+      setJoined(true);
+    } else if (msg.type === 'resume-failed') {
+      // Session expired on the server: drop stale peer connections and join from scratch
+      resumeRef.current = null;
+      pcMapRef.current.forEach((pc) => pc.close());
+      pcMapRef.current.clear();
+      remoteAudioRefs.current.clear();
+      setParticipants({});
+      sendSignal(ev.target, joinMessage(room, name));
+    } else if (msg.type === 'reconnect') {
+      // Server is draining: at our slot, rejoin through another instance. Peer connections
+      // keep carrying audio until the new 'joined' replaces them
+      const ws = ev.target;
+      movingRef.current = true;
+      setTimeout(() => {
+        if (wsRef.current !== ws) return;
+        resumeRef.current = null;
+        moveRef.current?.(msg.target);
+      }, msg.delayMs || 0);
+    } else if (msg.type === 'joined') {
+      resumeRef.current = msg.resumeToken || null;
+      // Fresh session (e.g. after a drain): connections from the previous one are stale
+      pcMapRef.current.forEach((pc) => pc.close());
+      pcMapRef.current.clear();
+      remoteAudioRefs.current.clear();
+      setParticipants({});
       setSelfId(msg.selfId);
+      selfIdRef.current = msg.selfId;
+      setMessages([]);
       // Add self participant shell (show even in listen-only)
       setParticipants((prev) => ({ ...prev, [msg.selfId]: { name: name || 'Me', level: 0 } }));
-      // Create offers to existing peers
-      for (const p of msg.peers || []) {
+      setQueuePos(0);
+      // Create offers to existing peers, spaced by the server's pacing hint in large rooms
+      const ws = ev.target;
+      (msg.peers || []).forEach((p, i) => {
         setParticipants((prev) => ({ ...prev, [p.id]: { name: p.name || `Peer ${p.id.slice(0,5)}`, level: 0 } }));
-        createPeerConnection(p.id, true);
-      }
+        // Both on the SFU: audio goes through the server. Mesh peers still get an offer
+        if (msg.sfu && p.sfu) return;
+        // offer: false = a peer on another server node whose id is lower; it offers to us
+        if (p.offer === false) return;
+        if (!msg.paceMs) createPeerConnection(p.id, true);
+        else setTimeout(() => { if (wsRef.current === ws) createPeerConnection(p.id, true); }, i * msg.paceMs);
+      });
       setJoined(true);
+      if (msg.sfu) publishToSfu(ws).catch((e) => console.error('SFU publish error', e));
+    } else if (msg.type === 'sfu-published') {
+      const pc = pcMapRef.current.get(SFU_PUBLISH);
+      if (pc) await pc.setRemoteDescription(new RTCSessionDescription(msg.sdp));
+    } else if (msg.type === 'sfu-offer') {
+      // Server (re)offers whenever the room gains publishers; one connection carries all of them
+      let pc = pcMapRef.current.get(SFU_SUBSCRIBE);
+      if (!pc) {
+        pc = new RTCPeerConnection({ iceServers });
+        pcMapRef.current.set(SFU_SUBSCRIBE, pc);
+      }
+      await pc.setRemoteDescription(new RTCSessionDescription(msg.sdp));
+      await pc.setLocalDescription(await pc.createAnswer());
+      await gatheringComplete(pc);
+      sendSignal(wsRef.current, { type: 'sfu-answer', sdp: plain(pc.localDescription) });
+      routeSfuTracks(msg.tracks);
+    } else if (msg.type === 'sfu-tracks') {
+      // A freed downstream slot now carries another publisher
+      routeSfuTracks(msg.tracks);
+    } else if (msg.type === 'error' && msg.code === 'rate-limited' && msg.frame) {
+      // Signaling the server throttled comes back; resend it once the bucket has refilled
+      const ws = ev.target;
+      setTimeout(() => { if (wsRef.current === ws) sendSignal(ws, msg.frame); }, msg.retryMs || 0);
+    } else if (msg.type === 'error' && (msg.code === 'room-full' || msg.code === 'server-busy')) {
+      // Admission control turned us away; the server suggests when to retry
+      alert(`${msg.message}. Please try again in ${Math.ceil((msg.retryMs || 0) / 1000)}s.`);
+    } else if (msg.type === 'join-queued') {
+      // Room is busy with other joiners; the server sends 'joined' when it is our turn
+      setQueuePos(msg.position || 0);
     } else if (msg.type === 'new-peer') {
       setParticipants((prev) => ({ ...prev, [msg.id]: { name: msg.name || `Peer ${msg.id.slice(0,5)}`, level: 0 } }));
-      // New peer will initiate offer; nothing to do here
+      // The new peer offers, unless it joined through another server node and our id is lower
+      // (offerOrder): then it was told to wait for us. A connection already set up is reused.
+      // Peers on other nodes are never on our SFU, so this holds in SFU mode too
+      if (msg.offerOrder && selfIdRef.current && selfIdRef.current < msg.id) {
+        createPeerConnection(msg.id, true);
+      }
     } else if (msg.type === 'offer') {
       const pc = createPeerConnection(msg.from, false);
       await pc.setRemoteDescription(new RTCSessionDescription(msg.sdp));
       const answer = await pc.createAnswer();
       await pc.setLocalDescription(answer);
-      wsRef.current?.send(JSON.stringify({ type: 'answer', to: msg.from, sdp: answer }));
+      flushIce(msg.from);
+      sendSignal(wsRef.current, { type: 'answer', to: msg.from, sdp: plain(answer) });
     } else if (msg.type === 'answer') {
       const pc = pcMapRef.current.get(msg.from);
       if (pc) await pc.setRemoteDescription(new RTCSessionDescription(msg.sdp));
@@ -284,8 +468,20 @@ function App() {
       if (pc && msg.candidate) {
         try { await pc.addIceCandidate(new RTCIceCandidate(msg.candidate)); } catch {}
       }
+    } else if (msg.type === 'ice-candidates') {
+      const pc = pcMapRef.current.get(msg.from);
+      for (const c of (pc && msg.candidates) || []) {
+        try { await pc.addIceCandidate(new RTCIceCandidate(c)); } catch {}
+      }
+    } else if (msg.type === 'history') {
+      // Arrives after 'joined'; live messages received meanwhile stay after it (ids dedupe)
+      setMessages((prev) => {
+        const live = new Set(prev.map((m) => m.id));
+        const older = (msg.messages || []).filter((m) => !live.has(m.id));
+        return [...older.map((m) => ({ id: m.id, from: m.from, message: m.message, timestamp: m.timestamp })), ...prev];
+      });
     } else if (msg.type === 'text') {
-      setMessages((prev) => [...prev, { from: msg.from, message: msg.message, timestamp: msg.timestamp }]);
+      setMessages((prev) => [...prev, { id: msg.id, from: msg.from, message: msg.message, timestamp: msg.timestamp }]);
     } else if (msg.type === 'leave') {
       const pc = pcMapRef.current.get(msg.id);
       if (pc) pc.close();
@@ -293,7 +489,7 @@ function App() {
       remoteAudioRefs.current.delete(msg.id);
       setParticipants((prev) => { const p = { ...prev }; delete p[msg.id]; return p; });
     }
-  }, [createPeerConnection, name]);
+  }, [createPeerConnection, flushIce, iceServers, name, publishToSfu, room, routeSfuTracks]);
 
   const buildConstraints = useCallback(() => ({
     audio: {
@@ -340,36 +536,72 @@ function App() {
       console.warn('Mic denied or unavailable. Joining in listen-only mode.', e);
     }
 
-    const ws = new WebSocket(wsUrl);
-    wsRef.current = ws;
-    ws.onopen = () => {
-      ws.send(JSON.stringify({ type: 'join', room, name: name || undefined }));
+    const connect = (resumeToken, attempt, url = wsUrl) => {
+      const ws = new WebSocket(url, WS_PROTOCOLS);
+      ws.binaryType = 'arraybuffer';
+      wsRef.current = ws;
+      ws.onopen = () => {
+        attempt = 0;
+        if (resumeToken) sendSignal(ws, { type: 'resume', token: resumeToken });
+        else sendSignal(ws, joinMessage(room, name));
+      };
+      // Handle frames strictly in arrival order; decoding a deflated offer is async and
+      // its ICE candidates must not overtake it
+      let inbound = Promise.resolve();
+      ws.onmessage = (ev) => {
+        inbound = inbound.then(() => handleWsMessage(ev)).catch((e) => console.error('WS message error', e));
+      };
+      ws.onclose = () => {
+        if (wsRef.current !== ws) return; // left the room or already replaced
+        // Draining server closed us before our slot: the pending move rejoins with the mic still live
+        if (movingRef.current) return;
+        if (resumeRef.current && attempt < RESUME_ATTEMPTS) {
+          // Network blip: reattach to the same session instead of rejoining, so peers keep their connections
+          setTimeout(() => {
+            if (wsRef.current === ws) connect(resumeRef.current, attempt + 1);
+          }, RESUME_DELAY_MS * 2 ** attempt);
+          return;
+        }
+        setJoined(false);
+        if (gotStream && localStreamRef.current) {
+          localStreamRef.current.getTracks().forEach((t) => t.stop());
+          localStreamRef.current = null;
+          processedStreamRef.current = null;
+        }
+      };
     };
-    ws.onmessage = handleWsMessage;
-    ws.onclose = () => {
-      setJoined(false);
-      if (gotStream && localStreamRef.current) {
-        localStreamRef.current.getTracks().forEach((t) => t.stop());
-        localStreamRef.current = null;
-        processedStreamRef.current = null;
-      }
+    moveRef.current = (target) => {
+      const old = wsRef.current;
+      movingRef.current = false;
+      connect(null, 0, target ? withQuery(target, wsUrl) : wsUrl);
+      try { old?.close(); } catch {}
     };
+    resumeRef.current = null;
+    movingRef.current = false;
+    connect(null, 0);
     // Save settings for this name
     saveCurrentProfile();
   }, [buildConstraints, buildProcessedStream, handleWsMessage, name, room, wsUrl, saveCurrentProfile]);
 
   const leaveRoom = useCallback(() => {
-    try { wsRef.current?.send(JSON.stringify({ type: 'leave' })); } catch {}
+    try { sendSignal(wsRef.current, { type: 'leave' }); } catch {}
     try { wsRef.current?.close(); } catch {}
     wsRef.current = null;
+    resumeRef.current = null;
+    moveRef.current = null;
+    movingRef.current = false;
     pcMapRef.current.forEach((pc) => pc.close());
     pcMapRef.current.clear();
+    iceOutRef.current.forEach((entry) => clearTimeout(entry.timer));
+    iceOutRef.current.clear();
     remoteAudioRefs.current.clear();
     setParticipants({});
     setMessages([]);
     setSelfId(null);
+    selfIdRef.current = null;
     setJoined(false);
     setListenOnly(false);
+    setQueuePos(0);
     stopLevelsLoop();
     localStreamRef.current?.getTracks().forEach((t) => t.stop());
     localStreamRef.current = null;
@@ -388,7 +620,7 @@ function App() {
   const sendMessage = useCallback(() => {
     const text = msgText.trim();
     if (!text) return;
-    wsRef.current?.send(JSON.stringify({ type: 'text', message: text }));
+    sendSignal(wsRef.current, { type: 'text', message: text });
     setMsgText('');
   }, [msgText]);
 
@@ -449,7 +681,7 @@ function App() {
       <div className="max-w-6xl mx-auto space-y-6">
         <header className="flex items-center justify-between">
           <h1 className="text-2xl font-semibold tracking-tight">Ultra-low-latency Voice + Chat</h1>
-          <div className="badge">WebRTC + WS{listenOnly ? ' • Listen-only' : ''}</div>
+          <div className="badge">WebRTC + WS{listenOnly ? ' • Listen-only' : ''}{queuePos ? ` • Queued #${queuePos}` : ''}</div>
         </header>
 
         {/* Controls */}
@@ -0,0 +1,82 @@
+from starlette.testclient import TestClient
+
+import server
+
+
+class Rooms:
+    """Registry and join scheduler stand-in: { room: (members, queued joiners) }."""
+
+    def __init__(self, rooms: dict):
+        self.rooms = rooms
+
+    def members(self, room: str) -> dict:
+        return dict.fromkeys(range(self.rooms.get(room, (0, 0))[0]))
+
+    def room_count(self) -> int:
+        return sum(1 for members, _ in self.rooms.values() if members)
+
+    def waiting(self, room: str) -> int:
+        return self.rooms.get(room, (0, 0))[1]
+
+
+def admission(rooms: dict, max_connections: int = 0, max_rooms: int = 0, max_room_size: int = 0):
+    state = Rooms(rooms)
+    return server.Admission(max_connections, max_rooms, max_room_size, 1000, 0.9, 200, state, state)
+
+
+def test_room_size_counts_queued_joiners():
+    limits = admission({"a": (3, 0), "b": (2, 1), "c": (2, 0)}, max_room_size=3)
+    assert limits.check_join("a") == ("room-full", "room is full (3 peers)")
+    # Two members plus one joiner waiting for a negotiation slot fill it too
+    assert limits.check_join("b")[0] == "room-full"
+    assert limits.check_join("c") is None
+    assert limits.check_join("new") is None
+
+
+def test_room_cap_only_turns_away_new_rooms():
+    limits = admission({"a": (1, 0), "b": (5, 0)}, max_rooms=2)
+    assert limits.check_join("a") is None
+    assert limits.check_join("new") == ("server-busy", "no capacity for new rooms")
+    assert limits.load() == 1.0
+
+
+def test_zero_limits_admit_everything():
+    limits = admission({"a": (500, 50)})
+    limits.connections = 10000
+    assert limits.check_join("a") is None and limits.check_join("new") is None
+    assert limits.admit_connection()
+    assert limits.load() == 0.0
+
+
+def test_readiness_follows_load_and_drain():
+    limits = admission({"a": (1, 0)}, max_connections=10, max_rooms=4)
+    limits.connections = 8
+    assert limits.status()["ready"] and limits.admit_connection()
+    limits.connections = 9
+    status = limits.status()
+    assert not status["ready"] and status["load"] == 0.9 and status["rooms"] == 1
+    limits.connections = 10
+    assert not limits.admit_connection()
+    limits.connections = 0
+    limits.draining = True
+    assert not limits.status()["ready"] and not limits.admit_connection()
+
+
+def test_retry_hint_is_jittered_around_the_configured_delay():
+    limits = admission({})
+    delays = {limits.retry_ms() for _ in range(50)}
+    assert all(500 <= d <= 1500 for d in delays) and len(delays) > 1
+
+
+def test_full_room_rejects_the_join_with_a_retry_hint(monkeypatch):
+    monkeypatch.setattr(server.admission, "max_room_size", 1)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b:
+            a.send_json({"type": "join", "room": "full", "name": "A"})
+            assert a.receive_json()["type"] == "joined"
+            b.send_json({"type": "join", "room": "full", "name": "B"})
+            error = b.receive_json()
+            assert error["code"] == "room-full" and error["retryMs"] > 0
+            b.send_json({"type": "join", "room": "other", "name": "B"})
+            assert b.receive_json()["type"] == "joined"
+            assert len(server.registry.members("full")) == 1
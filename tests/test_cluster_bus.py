@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+from cluster_bus import RedisBus
+
+pytestmark = pytest.mark.anyio
+
+
+async def eventually(check, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not check():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.02)
+
+
+async def start_node(url: str, node_id: str, node_ttl: int = 15):
+    bus = RedisBus(url, node_id=node_id, node_ttl=node_ttl)
+    rooms, peers = [], []
+    await bus.start(lambda *args: rooms.append(args), lambda *args: peers.append(args))
+    return bus, rooms, peers
+
+
+async def test_members_broadcasts_and_forwards_cross_nodes(redis_url):
+    n1, _, _ = await start_node(redis_url, "n1")
+    n2, rooms2, peers2 = await start_node(redis_url, "n2")
+    try:
+        await n1.register("r", "a", "Alice", offer_order=True)
+        await n2.register("r", "b", "Bob")
+        assert await n1.remote_members("r") == [{"id": "b", "name": "Bob"}]
+        assert await n2.remote_members("r") == [{"id": "a", "name": "Alice", "offerOrder": True}]
+
+        n1.publish_room("r", {"type": "text", "message": "hi"}, exclude=("a",), key="k")
+        await eventually(lambda: rooms2)
+        assert rooms2[0] == ("r", {"type": "text", "message": "hi"}, {"a"}, "k")
+
+        assert await n1.forward("b", {"type": "offer", "from": "a"}, room="r")
+        await eventually(lambda: peers2)
+        assert peers2[0] == ("b", {"type": "offer", "from": "a"})
+        assert not await n1.forward("b", {"type": "offer"}, room="other")
+        assert not await n1.forward("a", {"type": "offer"})
+
+        # A batch costs one lookup and arrives in order
+        lookups = []
+        hget = n1._redis.hget
+        n1._redis.hget = lambda *args: lookups.append(args) or hget(*args)
+        batch = [{"type": "ice-candidate", "from": "a", "candidate": f"c{i}"} for i in range(3)]
+        assert await n1.forward("b", batch, room="r")
+        await eventually(lambda: len(peers2) == 4)
+        assert [data for _, data in peers2[1:]] == batch
+        assert len(lookups) == 1
+
+        await n2.unregister("r", "b")
+        assert await n1.remote_members("r") == []
+    finally:
+        await n1.stop()
+        await n2.stop()
+
+
+async def test_departed_node_is_skipped_reaped_and_restored(redis_url):
+    n1, _, _ = await start_node(redis_url, "n1")
+    n2, _, _ = await start_node(redis_url, "n2", node_ttl=3)
+    try:
+        await n2.register("r", "b", "Bob")
+        # As if n2 had stopped heartbeating
+        await n1._redis.delete("soundcore:node:n2")
+        assert await n1.remote_members("r") == []
+        assert await n1.reap() == 1
+        assert await n1._redis.hgetall("soundcore:room:r") == {}
+        assert await n1._redis.hgetall("soundcore:peers") == {}
+
+        # n2 is alive after all: its next heartbeat finds its key gone and re-registers
+        async def members():
+            n1._alive_cache.clear()
+            return await n1.remote_members("r")
+        deadline = asyncio.get_running_loop().time() + 5
+        while not await members():
+            assert asyncio.get_running_loop().time() < deadline, "n2 did not re-register"
+            await asyncio.sleep(0.1)
+        assert await members() == [{"id": "b", "name": "Bob"}]
+    finally:
+        await n1.stop()
+        await n2.stop()
+
+
+def test_cross_node_join_race_has_one_offerer(redis_url, monkeypatch):
+    # Peers already on n2 that this node's join may have raced with
+    import server
+
+    monkeypatch.setattr(server, "bus", RedisBus(redis_url, node_id="n1"))
+    remote = RedisBus(redis_url, node_id="n2")
+    rooms = []
+    with TestClient(server.app) as client:
+        client.portal.call(remote.start, lambda *args: rooms.append(args), lambda *args: None)
+        try:
+            client.portal.call(remote.register, "r", "0", "Low", True)
+            client.portal.call(remote.register, "r", "zzz", "High", True)
+            client.portal.call(remote.register, "r", "~old", "Legacy", False)
+            with client.websocket_connect("/api/ws") as ws:
+                ws.send_json({"type": "join", "room": "r", "name": "Joiner", "features": ["offer-order"]})
+                joined = ws.receive_json()
+            peers = {p["id"]: p for p in joined["peers"]}
+            # The lower id offers: "0" offers to the joiner, the joiner offers to "zzz";
+            # clients without the rule keep the joiner-offers default
+            assert peers["0"] == {"id": "0", "name": "Low", "offer": False}
+            assert peers["zzz"] == {"id": "zzz", "name": "High", "offer": True}
+            assert peers["~old"] == {"id": "~old", "name": "Legacy"}
+
+            for _ in range(250):
+                if rooms:
+                    break
+                client.portal.call(asyncio.sleep, 0.02)
+            _, new_peer, exclude, _ = rooms[0]
+            assert new_peer == {"type": "new-peer", "id": joined["selfId"], "name": "Joiner", "offerOrder": True}
+            assert exclude == {joined["selfId"]}
+        finally:
+            client.portal.call(remote.stop)
@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import server
+from drain import Drain
+
+
+class Conn:
+    def __init__(self, user_id: str, room: str | None = None, queued_room: str | None = None, closed: bool = False):
+        self.user_id = user_id
+        self.room = room
+        self.queued_room = queued_room
+        self.closed = closed
+        self.sent = []
+        self.close_code = None
+
+    def send(self, data) -> bool:
+        self.sent.append(data)
+        return not self.closed
+
+    def abort(self, code: int, reason: str):
+        self.closed, self.close_code = True, code
+
+
+def stand_in_drain(conns, window_ms: int = 1000, grace_ms: int = 0):
+    ended = []
+
+    async def end_session(conn):
+        ended.append(conn.user_id)
+
+    admission = SimpleNamespace(draining=False, connections=len(conns), retry_ms=lambda: 1234)
+    sessions = SimpleNamespace(expire_parked=lambda: 0)
+    heartbeat = SimpleNamespace(connections=set(conns))
+    return Drain(window_ms, grace_ms, "", admission, sessions, heartbeat, end_session), ended
+
+
+def test_plan_gives_each_room_one_slot_within_the_window():
+    conns = [Conn("a1", "a"), Conn("a2", "a"), Conn("aq", queued_room="a"), Conn("b1", "b"), Conn("x"), Conn("y")]
+    drain, _ = stand_in_drain(conns)
+    for _ in range(20):
+        slots = dict((conn.user_id, delay) for delay, conn in drain.plan(conns, 10.0))
+        assert len(slots) == len(conns)
+        # Queued joiners move with their room; roomless sockets get a slot each
+        assert slots["a1"] == slots["a2"] == slots["aq"]
+        groups = sorted({slots["a1"], slots["b1"], slots["x"], slots["y"]})
+        assert len(groups) == 4
+        # Four groups, one 2.5 s stretch each
+        assert [int(delay // 2.5) for delay in groups] == [0, 1, 2, 3]
+
+
+@pytest.mark.anyio
+async def test_run_closes_whatever_is_left_after_each_slot_and_grace():
+    stay, moved, late = Conn("stay", "a"), Conn("moved", "b"), Conn("late", "c")
+    drain, ended = stand_in_drain([stay, moved, late], grace_ms=20)
+    drain.remaining = 3
+    run = asyncio.create_task(drain._run([(0.0, stay), (0.0, moved), (0.2, late)]))
+    moved.closed = True
+    await asyncio.sleep(0.1)
+    # First slot plus grace passed: the socket still open is closed, the one that moved on is left alone
+    assert stay.close_code == 1012 and moved.close_code is None
+    assert ended == ["stay"] and late.close_code is None
+    await run
+    assert ended == ["stay", "late"] and drain.remaining == 0
+    assert drain.heartbeat.connections == {moved}
+
+
+@pytest.mark.anyio
+async def test_start_hints_every_peer_once_and_cancel_reopens():
+    a1, a2, gone = Conn("a1", "a"), Conn("a2", "a"), Conn("gone", "b", closed=True)
+    drain, _ = stand_in_drain([a1, a2, gone], window_ms=60000)
+    assert drain.start()
+    assert drain.admission.draining and not drain.start()
+    assert a1.sent == [{"type": "reconnect", "reason": "draining", "delayMs": a1.sent[0]["delayMs"]}]
+    assert a1.sent == a2.sent and gone.sent == []
+    assert drain.remaining == 2 and drain.status()["draining"]
+    # Late arrivals get a retry delay instead of a slot
+    assert drain.hint()["delayMs"] == 1234
+    assert drain.cancel()
+    assert not drain.admission.draining and drain.status()["remaining"] == 0
+    assert not drain.cancel()
+
+
+def test_drain_moves_a_room_together_and_closes_it_with_1012(monkeypatch):
+    monkeypatch.setattr(server.drain, "grace", 0.05)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b:
+            a.send_json({"type": "join", "room": "moving", "name": "A"})
+            a.receive_json()
+            b.send_json({"type": "join", "room": "moving", "name": "B"})
+            b.receive_json()
+            assert a.receive_json()["type"] == "new-peer"
+            try:
+                assert client.portal.call(server.drain.start, 0.1)
+                assert client.get("/api/health").status_code == 503
+                hint = a.receive_json()
+                assert hint["type"] == "reconnect" and b.receive_json() == hint
+                for ws in (a, b):
+                    with pytest.raises(WebSocketDisconnect) as closed:
+                        while True:
+                            ws.receive_json()
+                    assert closed.value.code == 1012
+                assert not server.registry.members("moving")
+            finally:
+                client.portal.call(server.drain.cancel)
+            assert client.get("/api/health").status_code == 200
@@ -0,0 +1,35 @@
+from starlette.testclient import TestClient
+
+import server
+
+
+def connection(name: str) -> "server.PeerConnection":
+    return next(c for c in server.heartbeat.connections if c.name == name)
+
+
+def test_silent_clients_are_evicted_only_once_they_answer_pings():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b:
+            a.send_json({"type": "join", "room": "hb", "name": "A"})
+            a.receive_json()
+            b.send_json({"type": "join", "room": "hb", "name": "B"})
+            b_id = b.receive_json()["selfId"]
+            assert a.receive_json()["type"] == "new-peer"
+
+            # B has never answered a ping (an older client): silence is not a reason to drop it
+            connection("B").last_seen -= 3600
+            client.portal.call(server.heartbeat.sweep)
+            assert b_id in server.registry.members("hb")
+            assert a.receive_json() == {"type": "ping"}
+            assert b.receive_json() == {"type": "ping"}
+
+            # A client ping is answered in order, so the pong before it has been handled
+            b.send_json({"type": "pong"})
+            b.send_json({"type": "ping"})
+            assert b.receive_json() == {"type": "pong"}
+            connection("B").last_seen -= 3600
+            client.portal.call(server.heartbeat.sweep)
+            assert b_id not in server.registry.members("hb")
+            # The sweep pings A too, before or after B's leave
+            frames = [a.receive_json(), a.receive_json()]
+            assert {"type": "leave", "id": b_id} in frames
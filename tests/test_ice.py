@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+import server
+
+
+def turn_entry(body: bytes) -> dict:
+    return json.loads(body)["iceServers"][1]
+
+
+def test_minted_credentials_are_coturn_hmacs_shared_within_a_window():
+    config = server.IceConfig("", "turn:turn.example.com:3478", "alice", "", turn_secret="s3cret", credential_ttl=3600)
+    assert config.window == 900
+    body, etag, max_age = config.response(1000.0)
+    entry = turn_entry(body)
+    # Valid for the full TTL after the window ends
+    assert entry["username"] == f"{2 * 900 + 3600}:alice"
+    digest = hmac.new(b"s3cret", entry["username"].encode(), hashlib.sha1).digest()
+    assert entry["credential"] == base64.b64encode(digest).decode()
+    assert max_age == 800
+
+    assert config.response(1799.0)[:2] == (body, etag)
+    later_body, later_etag, _ = config.response(1800.0)
+    assert later_etag != etag
+    assert turn_entry(later_body)["username"] == f"{3 * 900 + 3600}:alice"
+
+
+def test_static_credentials_pass_through():
+    config = server.IceConfig("stun:stun.example.com", "turn:turn.example.com", "user", "pass")
+    body, _, max_age = config.response(1000.0)
+    assert json.loads(body)["iceServers"] == [
+        {"urls": ["stun:stun.example.com"]},
+        {"urls": ["turn:turn.example.com"], "username": "user", "credential": "pass"},
+    ]
+    assert max_age == 300
+
+
+def test_endpoint_revalidates_with_etag():
+    with TestClient(server.app) as client:
+        first = client.get("/api/ice")
+        assert first.status_code == 200 and first.json()["iceServers"]
+        again = client.get("/api/ice", headers={"If-None-Match": first.headers["etag"]})
+        assert again.status_code == 304 and not again.content
+        assert again.headers["etag"] == first.headers["etag"]
+        assert client.get("/api/ice", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+class Target:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.sent = []
+
+    def send(self, data: dict) -> bool:
+        self.sent.append(data)
+        return True
+
+
+@pytest.mark.anyio
+async def test_batcher_coalesces_per_pair_until_window_size_or_end():
+    batcher = server.IceBatcher(30, 3)
+    b, c = Target("b"), Target("c")
+    batcher.add("a", b, ["c1"])
+    batcher.add("a", b, ["c2"])
+    batcher.add("x", b, ["x1"])
+    batcher.add("a", c, ["c1"], end=True)
+    # End of gathering flushes its pair at once; the others wait for the window
+    assert c.sent == [{"type": "ice-candidates", "from": "a", "candidates": ["c1"]}]
+    assert b.sent == []
+    batcher.add("a", b, ["c3", "c4"])
+    # Size limit reached
+    assert b.sent == [{"type": "ice-candidates", "from": "a", "candidates": ["c1", "c2", "c3", "c4"]}]
+    await asyncio.sleep(0.06)
+    assert b.sent[1:] == [{"type": "ice-candidates", "from": "x", "candidates": ["x1"]}]
+    # Window timers of pairs flushed early find nothing left to send
+    assert len(b.sent) == 2 and len(c.sent) == 1
+
+
+def test_endpoint_batches_for_capable_peers_and_flushes_before_an_offer(monkeypatch):
+    monkeypatch.setattr(server, "ICE_BATCH_WINDOW_MS", 10000)
+    monkeypatch.setattr(server, "ice_batcher", server.IceBatcher(10000, 32))
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b, \
+                client.websocket_connect("/api/ws") as legacy:
+            a.send_json({"type": "join", "room": "ice", "name": "A"})
+            a_id = a.receive_json()["selfId"]
+            b.send_json({"type": "join", "room": "ice", "name": "B", "features": ["ice-batch"]})
+            b_id = b.receive_json()["selfId"]
+            legacy.send_json({"type": "join", "room": "ice", "name": "L"})
+            legacy_id = legacy.receive_json()["selfId"]
+            for _ in range(2):
+                assert a.receive_json()["type"] == "new-peer"
+            assert b.receive_json()["type"] == "new-peer"
+
+            for n in range(2):
+                a.send_json({"type": "ice-candidate", "to": b_id, "candidate": {"candidate": f"c{n}"}})
+            a.send_json({"type": "offer", "to": b_id, "sdp": {"type": "offer", "sdp": "v=0"}})
+            assert b.receive_json() == {"type": "ice-candidates", "from": a_id,
+                                        "candidates": [{"candidate": "c0"}, {"candidate": "c1"}]}
+            assert b.receive_json()["type"] == "offer"
+
+            # A batch for a peer without the feature is split into single candidates
+            a.send_json({"type": "ice-candidates", "to": legacy_id, "candidates": ["l0", "l1"]})
+            assert legacy.receive_json() == {"type": "ice-candidate", "from": a_id, "candidate": "l0"}
+            assert legacy.receive_json() == {"type": "ice-candidate", "from": a_id, "candidate": "l1"}
@@ -0,0 +1,57 @@
+import pytest
+from starlette.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    scheduler = server.JoinScheduler(1, 10000, server.join_room)
+    monkeypatch.setattr(server, "join_scheduler", scheduler)
+    # Without resume a closed socket leaves at once instead of being parked
+    monkeypatch.setattr(server.sessions, "grace", 0)
+    return scheduler
+
+
+def join(ws, name: str) -> dict:
+    ws.send_json({"type": "join", "room": "storm", "name": name})
+    return ws.receive_json()
+
+
+def test_slot_frees_when_every_peer_answered_or_the_joiner_left(one_slot):
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b, \
+                client.websocket_connect("/api/ws") as d, client.websocket_connect("/api/ws") as e:
+            a_id = join(a, "A")["selfId"]
+            # A had nobody to negotiate with; B takes the slot until A answers it
+            b_id = join(b, "B")["selfId"]
+            assert a.receive_json()["type"] == "new-peer"
+            assert join(d, "D") == {"type": "join-queued", "room": "storm", "position": 1}
+            assert join(e, "E") == {"type": "join-queued", "room": "storm", "position": 2}
+
+            b.send_json({"type": "offer", "to": a_id, "sdp": {"type": "offer", "sdp": ""}})
+            assert a.receive_json()["type"] == "offer"
+            a.send_json({"type": "answer", "to": b_id, "sdp": {"type": "answer", "sdp": ""}})
+            assert b.receive_json()["type"] == "answer"
+            joined = d.receive_json()
+            assert joined["type"] == "joined" and len(joined["peers"]) == 2
+
+            # D never offers and disconnects instead; its slot goes to E
+            d.close()
+            joined = e.receive_json()
+            assert joined["type"] == "joined" and {p["name"] for p in joined["peers"]} >= {"A", "B"}
+            assert list(one_slot._active["storm"]) == [joined["selfId"]]
+            assert one_slot.waiting("storm") == 0
+
+
+def test_slot_frees_after_the_negotiation_timeout(monkeypatch):
+    scheduler = server.JoinScheduler(1, 100, server.join_room)
+    monkeypatch.setattr(server, "join_scheduler", scheduler)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b, \
+                client.websocket_connect("/api/ws") as d:
+            join(a, "A")
+            join(b, "B")
+            assert join(d, "D")["type"] == "join-queued"
+            # B never offers: D gets in once the timeout releases B's slot
+            assert d.receive_json()["type"] == "joined"
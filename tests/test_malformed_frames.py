@@ -0,0 +1,69 @@
+import pytest
+from starlette.testclient import TestClient
+
+import server
+
+
+def test_non_string_type_is_an_unknown_message():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as ws:
+            ws.send_json({"type": ["offer"]})
+            assert ws.receive_json() == {"type": "error", "message": "Unknown message type"}
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+        assert 'signaling_ws_messages_received_total{type="other"}' in client.get("/api/metrics").text
+
+
+def test_features_must_be_a_list_of_strings():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as ws:
+            for features in (5, "sfu-ice-batch", {"ice-batch": 1}, [["ice-batch"]]):
+                ws.send_json({"type": "join", "room": "features", "name": "A", "features": features})
+                joined = ws.receive_json()
+                assert joined["type"] == "joined"
+                conn = server.registry.members("features")[joined["selfId"]]
+                assert not conn.ice_batch
+            ws.send_json({"type": "join", "room": "features", "name": "A", "features": ["ice-batch", 5]})
+            conn = server.registry.members("features")[ws.receive_json()["selfId"]]
+            assert conn.ice_batch
+
+
+def test_msgpack_only_values_are_not_relayed_to_json_peers():
+    msgpack = pytest.importorskip("msgpack")
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as victim, \
+                client.websocket_connect("/api/ws", subprotocols=["soundcore.msgpack"]) as sender:
+            victim_id = join(victim, "packed")["selfId"]
+            sender.send_bytes(msgpack.packb({"type": "join", "room": "packed", "name": "S"}))
+            assert msgpack.unpackb(sender.receive_bytes())["type"] == "joined"
+            assert victim.receive_json()["type"] == "new-peer"
+
+            for bad in ({"type": "offer", "sdp": {"type": "offer", "sdp": b"\x01"}},
+                        {"type": "ice-candidate", "candidate": {"candidate": b"\x01"}},
+                        {"type": "ice-candidates", "candidates": [{"candidate": "c", "sdpMid": b"0"}]}):
+                sender.send_bytes(msgpack.packb({**bad, "to": victim_id}, use_bin_type=True))
+                assert msgpack.unpackb(sender.receive_bytes())["message"] == f"invalid '{bad['type']}' payload"
+
+            sender.send_bytes(msgpack.packb({"type": "offer", "to": victim_id, "sdp": {"type": "offer", "sdp": "v=0"}}))
+            assert victim.receive_json()["sdp"] == {"type": "offer", "sdp": "v=0"}
+
+
+def test_unencodable_frame_is_dropped_and_the_writer_keeps_going():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as ws:
+            self_id = join(ws, "drop")["selfId"]
+            conn = server.registry.members("drop")[self_id]
+            client.portal.call(sync_send, conn, {"type": "offer", "sdp": b"\x01"})
+            client.portal.call(sync_send, conn, {"type": "pong"})
+            assert ws.receive_json() == {"type": "pong"}
+            assert not conn._queue and not conn._writer.done()
+        assert 'signaling_ws_frames_dropped_total{reason="unencodable"} 1' in client.get("/api/metrics").text
+
+
+async def sync_send(conn, data):
+    conn.send(data)
+
+
+def join(ws, room: str) -> dict:
+    ws.send_json({"type": "join", "room": room, "name": "A"})
+    return ws.receive_json()
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+import pytest
+from starlette.testclient import TestClient
+
+import bench_ws
+import server
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_survives_an_unescaped_query_string():
+    ts = datetime(2024, 5, 1, 12, 30, 45, 123000, tzinfo=timezone.utc)
+    cursor = encode_cursor({"timestamp": ts, "id": "id+with/odd chars"})
+    assert parse_qs(f"after={cursor}")["after"] == [cursor]
+    assert decode_cursor(cursor) == (ts, "id+with/odd chars")
+
+
+def test_malformed_cursor_raises():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_status_pages_follow_next_cursor(monkeypatch):
+    monkeypatch.setattr(server, "db", bench_ws.MemoryDatabase())
+    with TestClient(server.app) as client:
+        created = client.post("/api/status/bulk", json=[{"client_name": f"c{i}"} for i in range(7)]).json()
+        seen, url = [], "/api/status?limit=3"
+        while url:
+            response = client.get(url)
+            seen += [d["id"] for d in response.json()]
+            after = response.headers.get("x-next-cursor")
+            # Pasted into the URL as is, the way clients build the next request
+            url = f"/api/status?limit=3&after={after}" if after else None
+        assert seen == [d["id"] for d in created]
+        assert client.get("/api/status?after=bogus").status_code == 400
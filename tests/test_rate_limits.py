@@ -0,0 +1,91 @@
+from contextlib import ExitStack
+
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import server
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    # Texts: 5 per connection, 2 per room, one strike; nothing refills during the test
+    limiter = server.RateLimiter({"text": (0.001, 5), "*": (100, 100)}, {"text": (0.001, 2)}, (0.001, 1),
+                                 server.registry)
+    monkeypatch.setattr(server, "rate_limiter", limiter)
+    return limiter
+
+
+def text(ws, message: str) -> dict:
+    ws.send_json({"type": "text", "message": message})
+    return ws.receive_json()
+
+
+def test_room_limit_rejects_without_strikes_and_connection_limit_disconnects(limits):
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as a, client.websocket_connect("/api/ws") as b:
+            a.send_json({"type": "join", "room": "limits", "name": "A"})
+            a.receive_json()
+            b.send_json({"type": "join", "room": "limits", "name": "B"})
+            b.receive_json()
+            a.receive_json()
+
+            # A uses up the room's burst
+            for message in ("1", "2"):
+                assert text(a, message)["type"] == "text"
+                assert b.receive_json()["message"] == message
+
+            # B did nothing wrong: throttled by the room, but never struck off
+            for _ in range(3):
+                error = text(b, "b")
+                assert error["code"] == "rate-limited" and "(room)" in error["message"]
+                assert error["retryMs"] > 0
+            conn_b = next(c for c in server.registry.members("limits").values() if c.name == "B")
+            assert conn_b.strikes is None
+
+            for _ in range(3):
+                assert "(room)" in text(a, "a")["message"]
+            # A's own burst is spent: the first violation costs its only strike, the next closes
+            assert "(connection)" in text(a, "a")["message"]
+            a.send_json({"type": "text", "message": "a"})
+            with pytest.raises(WebSocketDisconnect) as closed:
+                a.receive_json()
+            assert closed.value.code == 1008
+
+
+def test_default_signaling_limits_scale_with_the_room(monkeypatch):
+    # Built from the shipped defaults, not whatever the environment set
+    defaults = "text=5:20,offer=0.5:3,answer=0.5:3,ice-candidate=5:30,ice-candidates=1:6,join=1:5,*=20:50"
+    limiter = server.RateLimiter(server.parse_rate_limits(defaults), {}, (0.1, 10), server.registry)
+    monkeypatch.setattr(server, "rate_limiter", limiter)
+    with TestClient(server.app) as client, ExitStack() as stack:
+        members = [stack.enter_context(client.websocket_connect("/api/ws")) for _ in range(25)]
+        ids = []
+        for i, ws in enumerate(members):
+            ws.send_json({"type": "join", "room": "big", "name": f"M{i}"})
+            ids.append(ws.receive_json()["selfId"])
+        joiner = stack.enter_context(client.websocket_connect("/api/ws"))
+        joiner.send_json({"type": "join", "room": "big", "name": "J", "features": ["ice-batch"]})
+        assert len(joiner.receive_json()["peers"]) == 25
+        # What App.js sends per peer: an offer, a candidate batch and the end-of-candidates flush
+        for peer_id in ids:
+            joiner.send_json({"type": "offer", "to": peer_id, "sdp": {"type": "offer", "sdp": "v=0"}})
+            joiner.send_json({"type": "ice-candidates", "to": peer_id, "candidates": ["c1", "c2"]})
+            joiner.send_json({"type": "ice-candidates", "to": peer_id, "candidates": [], "end": True})
+        joiner.send_json({"type": "ping"})
+        assert joiner.receive_json() == {"type": "pong"}
+        conn = next(c for c in server.registry.members("big").values() if c.name == "J")
+        assert (conn.buckets["offer"].burst, conn.buckets["ice-candidates"].burst) == (75, 150)
+        assert conn.strikes is None
+
+
+def test_throttled_signaling_is_echoed_for_a_retry(monkeypatch):
+    monkeypatch.setattr(server, "rate_limiter", server.RateLimiter({"offer": (0.001, 1)}, {}, None, server.registry))
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as ws:
+            offer = {"type": "offer", "to": "nobody", "sdp": {"type": "offer", "sdp": "v=0"}}
+            ws.send_json(offer)
+            assert ws.receive_json()["type"] == "peer-unavailable"
+            ws.send_json(offer)
+            error = ws.receive_json()
+            assert error["code"] == "rate-limited" and error["frame"] == offer and error["retryMs"] > 0
@@ -0,0 +1,60 @@
+import time
+
+from starlette.testclient import TestClient
+
+import server
+
+
+def wait_until(check, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.02)
+
+
+def join(ws, room: str, name: str) -> dict:
+    ws.send_json({"type": "join", "room": room, "name": name})
+    joined = ws.receive_json()
+    assert joined["type"] == "joined"
+    return joined
+
+
+def test_resume_keeps_id_and_room_and_replays_missed_frames():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as b:
+            with client.websocket_connect("/api/ws") as a:
+                joined = join(a, "resume", "A")
+                join(b, "resume", "B")
+                assert a.receive_json()["type"] == "new-peer"
+            a_id, token = joined["selfId"], joined["resumeToken"]
+
+            # Parked: still a member, and B sees no leave
+            wait_until(lambda: server.registry.members("resume")[a_id]._writer is None)
+            b.send_json({"type": "text", "message": "while away"})
+            assert b.receive_json()["message"] == "while away"
+
+            with client.websocket_connect("/api/ws") as a2:
+                a2.send_json({"type": "resume", "token": token})
+                resumed = a2.receive_json()
+                assert resumed["type"] == "resumed"
+                assert (resumed["selfId"], resumed["room"], resumed["replayed"]) == (a_id, "resume", 1)
+                assert a2.receive_json()["message"] == "while away"
+                # Tokens are single use
+                assert resumed["resumeToken"] != token
+                with client.websocket_connect("/api/ws") as other:
+                    other.send_json({"type": "resume", "token": token})
+                    assert other.receive_json() == {"type": "resume-failed"}
+
+
+def test_parked_session_expires_after_grace(monkeypatch):
+    monkeypatch.setattr(server.sessions, "grace", 0.2)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as b:
+            with client.websocket_connect("/api/ws") as a:
+                joined = join(a, "expire", "A")
+                join(b, "expire", "B")
+            assert b.receive_json() == {"type": "leave", "id": joined["selfId"]}
+            assert joined["selfId"] not in server.registry.members("expire")
+            with client.websocket_connect("/api/ws") as a2:
+                a2.send_json({"type": "resume", "token": joined["resumeToken"]})
+                assert a2.receive_json() == {"type": "resume-failed"}
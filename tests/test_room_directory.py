@@ -0,0 +1,112 @@
+import json
+
+from starlette.testclient import TestClient
+
+import server
+from room_directory import RoomDirectory
+
+
+class Subscriber:
+    def __init__(self, closed: bool = False):
+        self.closed = closed
+        self.frames = []
+
+
+def deliver(conn, frame) -> bool:
+    conn.frames.append(frame)
+    return True
+
+
+def test_etags_change_with_membership_only():
+    directory = RoomDirectory(refresh_ms=0)
+    directory.joined("a", "1", "Ann")
+    directory.joined("b", "2", "Bob")
+    body, etag = directory.listing()
+    assert json.loads(body)["total"] == {"rooms": 2, "peers": 2}
+    assert directory.listing() == (body, etag)
+    a_body, a_etag = directory.room("a")
+    assert json.loads(a_body)["members"] == ["Ann"]
+
+    directory.joined("b", "3", "Cid")
+    assert directory.listing()[1] != etag
+    # Other rooms keep their tag, so their pollers keep getting 304s
+    assert directory.room("a") == (a_body, a_etag)
+
+    directory.left("b", "2")
+    directory.left("b", "3")
+    assert directory.room("b") is None
+    # Leaving twice is not a change
+    version = directory.version
+    directory.left("b", "3")
+    assert directory.version == version
+
+
+def test_listing_is_rebuilt_at_most_once_per_refresh_interval():
+    directory = RoomDirectory(refresh_ms=60000)
+    directory.joined("a", "1", "Ann")
+    body, etag = directory.listing()
+    directory.joined("a", "2", "Bob")
+    # Stale until the interval passes, and then only if something changed
+    assert directory.listing() == (body, etag)
+    directory.refresh_interval = 0
+    assert json.loads(directory.listing()[0])["rooms"] == [{"room": "a", "count": 2}]
+
+
+def test_etags_differ_across_processes():
+    first, second = RoomDirectory(), RoomDirectory()
+    first.joined("a", "1", "Ann")
+    second.joined("a", "1", "Ann")
+    assert first.listing()[0] == second.listing()[0]
+    assert first.listing()[1] != second.listing()[1]
+
+
+def test_presence_updates_share_one_frame_per_filter():
+    directory = RoomDirectory()
+    directory._send = deliver
+    everyone, also_everyone, room_a, room_b = Subscriber(), Subscriber(), Subscriber(), Subscriber()
+    gone = Subscriber(closed=True)
+    assert directory.subscribe(everyone)["rooms"] == []
+    directory.subscribe(also_everyone)
+    directory.subscribe(room_a, "a")
+    directory.subscribe(room_b, "b")
+    directory.subscribe(gone)
+
+    directory.joined("a", "1", "Ann")
+    directory.joined("a", "2", "Bob")
+    assert directory.flush() == 3
+    assert everyone.frames[0] is also_everyone.frames[0]
+    assert everyone.frames[0].data["rooms"] == [{"room": "a", "count": 2}]
+    assert room_a.frames[0].data["rooms"] == [{"room": "a", "count": 2, "members": ["Ann", "Bob"]}]
+    # Nothing changed in room b; closed subscribers are dropped
+    assert room_b.frames == [] and gone not in directory._subscribers
+    # No changes, no frames
+    assert directory.flush() == 0
+
+    directory.left("a", "1")
+    directory.left("a", "2")
+    directory.flush()
+    assert room_a.frames[-1].data["rooms"] == [{"room": "a", "count": 0, "members": []}]
+
+
+def test_endpoints_revalidate_and_presence_follows_joins(monkeypatch):
+    monkeypatch.setattr(server.room_directory, "refresh_interval", 0)
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/api/ws") as watcher, client.websocket_connect("/api/ws") as peer:
+            watcher.send_json({"type": "presence-subscribe", "room": "lobby"})
+            snapshot = watcher.receive_json()
+            assert snapshot["type"] == "presence"
+            assert snapshot["rooms"] == [{"room": "lobby", "count": 0, "members": []}]
+            assert client.get("/api/rooms/lobby").status_code == 404
+
+            peer.send_json({"type": "join", "room": "lobby", "name": "Ann"})
+            peer.receive_json()
+            client.portal.call(server.room_directory.flush)
+            update = watcher.receive_json()
+            assert update["type"] == "presence-update"
+            assert update["rooms"] == [{"room": "lobby", "count": 1, "members": ["Ann"]}]
+
+            for path in ("/api/rooms", "/api/rooms/lobby"):
+                first = client.get(path)
+                assert first.status_code == 200
+                again = client.get(path, headers={"If-None-Match": first.headers["etag"]})
+                assert again.status_code == 304 and not again.content
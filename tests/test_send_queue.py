@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class StalledSocket:
+    """Accepts writes only while `flowing` is set, like a client that stopped reading."""
+
+    def __init__(self):
+        self.flowing = asyncio.Event()
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, text: str):
+        await self.flowing.wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.close_code = code
+
+
+async def stalled_connection(monkeypatch, policy: str, head: dict, key: str | None = None):
+    # Queue of 3 whose writer is stuck sending `head`
+    monkeypatch.setattr(server, "WS_SEND_QUEUE_SIZE", 3)
+    monkeypatch.setattr(server, "WS_SEND_OVERFLOW_POLICY", policy)
+    socket = StalledSocket()
+    conn = server.PeerConnection(socket, "slow")
+    conn.start()
+    assert conn.send(head, key)
+    for _ in range(3):
+        await asyncio.sleep(0)
+    return conn, socket
+
+
+async def flush(conn, socket):
+    socket.flowing.set()
+    while conn._queue:
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    return [m.get("id") or m["type"] for m in socket.sent]
+
+
+def offer(n: int) -> dict:
+    return {"type": "offer", "id": f"offer{n}"}
+
+
+def text(n: int) -> dict:
+    return {"type": "text", "id": f"text{n}"}
+
+
+async def test_drop_oldest_sheds_chat_and_never_signaling(monkeypatch):
+    conn, socket = await stalled_connection(monkeypatch, "drop_oldest", offer(1))
+    assert conn.send(text(1)) and conn.send(offer(2))
+    # Full: each new frame evicts the oldest chat frame
+    assert conn.send(text(2))
+    assert conn.send(offer(3))
+    # Nothing but signaling queued: the new chat frame is the one shed
+    assert not conn.send(text(3))
+    assert conn.dropped == 3 and not conn.closed
+    assert await flush(conn, socket) == ["offer1", "offer2", "offer3"]
+
+
+async def test_drop_oldest_may_shed_the_frame_being_written(monkeypatch):
+    conn, socket = await stalled_connection(monkeypatch, "drop_oldest", text(1))
+    assert conn.send(offer(1)) and conn.send(offer(2))
+    # text1 is mid-send and the only chat frame; it leaves the queue, but the write in flight completes
+    assert conn.send(offer(3))
+    assert [frame.data["id"] for _, frame in conn._queue] == ["offer1", "offer2", "offer3"]
+    # Finishing text1 must not pop offer1, now at the head, as if it had been sent
+    assert await flush(conn, socket) == ["text1", "offer1", "offer2", "offer3"]
+
+
+async def test_coalesce_replaces_the_queued_frame_with_the_same_key(monkeypatch):
+    conn, socket = await stalled_connection(monkeypatch, "coalesce", offer(1))
+    assert conn.send({"type": "new-peer", "id": "b"}, "peer:b")
+    assert conn.send(offer(2))
+    assert conn.send({"type": "leave", "id": "b"}, "peer:b")
+    # No key in common: falls back to shedding chat, then to the new chat frame itself
+    assert not conn.send(text(1))
+    assert conn.dropped == 2
+    assert await flush(conn, socket) == ["offer1", "offer2", "b"]
+    assert socket.sent[-1]["type"] == "leave"
+
+
+async def test_coalesce_may_supersede_the_frame_being_written(monkeypatch):
+    conn, socket = await stalled_connection(monkeypatch, "coalesce", {"type": "new-peer", "id": "b"}, "peer:b")
+    assert conn.send(offer(1)) and conn.send(offer(2))
+    assert conn.send({"type": "leave", "id": "b"}, "peer:b")
+    # The new-peer already on the wire still arrives, then everything queued exactly once
+    assert await flush(conn, socket) == ["b", "offer1", "offer2", "b"]
+    assert [m["type"] for m in socket.sent] == ["new-peer", "offer", "offer", "leave"]
+
+
+async def test_disconnect_closes_a_full_queue(monkeypatch):
+    conn, socket = await stalled_connection(monkeypatch, "disconnect", offer(1))
+    assert conn.send(text(1)) and conn.send(offer(2))
+    assert not conn.send(text(2))
+    assert conn.closed and not conn._queue
+    await conn._aborting
+    assert socket.close_code == 1013
+    assert not conn.send(offer(3))
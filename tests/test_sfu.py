@@ -0,0 +1,27 @@
+import argparse
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiortc")
+
+import server
+
+
+def test_loopback_room_hears_every_publisher(monkeypatch):
+    # sfu_loopback switches SFU_MODE on at import; keep that out of the other tests
+    monkeypatch.setenv("SFU_MODE", "on")
+    import sfu_loopback
+    from sfu import create_sfu
+
+    monkeypatch.setattr(server, "sfu", create_sfu())
+    monkeypatch.setattr(server, "db", None)
+    args = argparse.Namespace(url=None, peers=3, room="sfu-test", duration=3)
+    result = asyncio.run(sfu_loopback.run(args))
+
+    assert result["ok"], result
+    assert result["receiving_min"] == 2
+    assert result["sfu"]["publishers"] == 3
+    assert result["sfu"]["frames_forwarded"] > 0
+    # Every peer left, so the server dropped the room
+    assert server.sfu.rooms == {}